@@ -0,0 +1,248 @@
+"""
+Benchmarks of the quantum register.
+
+Run with
+    python benchmark.py threads --qbits 20 22 24 --threads 1 2 4 8
+to show how applying gates scales with the number of threads, or
+    python benchmark.py suite --qbits 3 8 13 18 --output results.json --baseline baseline.json
+to time gates, J and oracle operations, Grover loops, sampling, a loop of diagonal operations through the
+optimisation passes of execute and whole programs through execute and quantum_http, writing the times to
+results.json and flagging those slower than the times in baseline.json.
+Add --save-baseline to write the times to the baseline instead.
+"""
+import argparse
+import json
+import sys
+import time
+from math import pi
+from math import sqrt
+
+from flask import Flask
+from flask import request
+
+from gates import H
+from main import quantum_http
+from main import result_cache
+from register import DEFAULT_THREADS
+from register import Register
+from register import execute
+from register import unitary_cache
+
+DEFAULT_SUITE_QBITS = [3, 8, 13, 18, 22, 26]
+DEFAULT_THRESHOLD = 0.2  # fraction slower than the baseline that is a regression
+
+
+def time_gates(num_qbits, num_threads, repeats=3):
+    """
+    Time a Hadamard gate applied to every qbit of a register
+    :param num_qbits: number of qbits in the register
+    :param num_threads: number of threads to split the amplitudes between
+    :param repeats: number of times to time the gates, the fastest is reported
+    :return: seconds for each gate
+    """
+    register = Register(num_qbits, 0, num_threads=num_threads)
+    register.unit_vector[0] = 1.0
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        for qbit in range(1, num_qbits + 1):
+            register.gate_function(qbit, H)
+        elapsed = (time.perf_counter() - start) / num_qbits
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def thread_scaling(qbits, threads):
+    """
+    Print the time per gate and the speed up over a single thread for each register size and number of threads
+    :param qbits: list of register sizes
+    :param threads: list of numbers of threads
+    :return:
+    """
+    print("{:>6} {:>8} {:>12} {:>8}".format("qbits", "threads", "ms/gate", "speedup"))
+    for num_qbits in qbits:
+        single = None
+        for num_threads in threads:
+            elapsed = time_gates(num_qbits, num_threads)
+            single = elapsed if single is None else single
+            print("{:>6} {:>8} {:>12.3f} {:>8.2f}".format(num_qbits, num_threads, elapsed * 1000, single / elapsed))
+
+
+def best_time(function, repeats=3):
+    """
+    :param function: function to time, called with no arguments
+    :param repeats: number of times to call the function, the fastest is reported
+    :return: seconds taken by the fastest call
+    """
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def grover_program(num_qbits, num_measures=1000):
+    """
+    :param num_qbits: number of qbits in the register
+    :param num_measures: number of measurements
+    :return: program searching for the last state with Grover's algorithm, as in register_test
+    """
+    hadamards = [{"op": 'H', "args": {"qbit": qbit}} for qbit in range(1, num_qbits + 1)]
+    count = int(pi / 4 * sqrt(2 ** num_qbits))
+    initial_vector = [0.0] * 2 ** num_qbits
+    initial_vector[0] = 1.0
+    return {
+        "num_qbits": num_qbits,
+        "num_measures": num_measures,
+        "initial_vector": initial_vector,
+        "compile": False,
+        "operations": hadamards + [{"op": 'Repeat', "args": {"count": count, "operations": [
+            {"op": 'O', "args": {"desired_state": 2 ** num_qbits - 1}}] + hadamards + [{"op": 'J'}] + hadamards}}]
+    }
+
+
+def diagonal_program(num_qbits, count=20, num_measures=1000):
+    """
+    :param num_qbits: number of qbits in the register, at least 3
+    :param count: number of times the diagonal operations are repeated
+    :param num_measures: number of measurements
+    :return: program repeating an oracle, J and phase shifts on the first, middle and last qbits, which execute
+        optimises, starting from the uniform state so that no initial vector is listed
+    """
+    return {
+        "num_qbits": num_qbits,
+        "num_measures": num_measures,
+        "initial_state": "uniform",
+        "final_vector": False,
+        "operations": [{"op": 'Repeat', "args": {"count": count, "operations": [
+            {"op": 'O', "args": {"desired_state": 2 ** num_qbits - 1}},
+            {"op": 'J'},
+            {"op": 'P', "args": {"qbit": 1, "theta": 0.3}},
+            {"op": 'Z', "args": {"qbit": num_qbits // 2 + 1}},
+            {"op": 'P', "args": {"qbit": num_qbits, "theta": 0.2}}
+        ]}}]
+    }
+
+
+def suite(num_qbits, repeats=3):
+    """
+    Time each benchmark of the suite for a register size
+    :param num_qbits: number of qbits in the register
+    :param repeats: number of times to run each benchmark, the fastest is reported
+    :return: dictionary of benchmark name -> seconds
+    """
+    register = Register(num_qbits, 1000, seed=1)
+    register.unit_vector[0] = 1.0
+    for qbit in range(1, num_qbits + 1):
+        register.hadamard_gate(qbit)
+    results = {
+        "gates": best_time(lambda: [register.gate_function(qbit, H) for qbit in range(1, num_qbits + 1)], repeats)
+        / num_qbits,
+        "oracle": best_time(lambda: (register.oracle(2 ** num_qbits - 1), register.j_gate()), repeats) / 2,
+        "sampling": best_time(register.counting_states, repeats)
+    }
+    # Applied through execute so that the time includes the diagonal operations as optimised
+    program = diagonal_program(num_qbits)
+    results["diagonals"] = best_time(lambda: execute(program), repeats)
+    if num_qbits <= 16:
+        # Grover needs sqrt(2^n) iterations so is only run for small registers
+        program = grover_program(num_qbits)
+        results["grover"] = best_time(lambda: execute(program), repeats)
+    if num_qbits <= 16:
+        # Whole programs list every amplitude of the initial and final vectors as json so only small
+        # registers are run through execute and quantum_http
+        program = {
+            "num_qbits": num_qbits,
+            "num_measures": 1000,
+            "initial_vector": register.unit_vector.real.tolist(),
+            "operations": [{"op": 'H', "args": {"qbit": qbit}} for qbit in range(1, num_qbits + 1)] +
+                          [{"op": 'P', "args": {"qbit": qbit, "theta": 0.1 * qbit}} for qbit in range(1, num_qbits + 1)]
+        }
+        app = Flask(__name__)
+        # jsonify cannot encode the complex amplitudes of the final vector so only the states are returned
+        http_program = dict(program, final_vector=False)
+
+        def http():
+            # Clear the caches so the program is executed each time
+            result_cache.clear()
+            unitary_cache.clear()
+            with app.test_request_context(json=http_program):
+                return quantum_http(request).get_data()
+
+        results["execute"] = best_time(lambda: execute(program), repeats)
+        results["quantum_http"] = best_time(http, repeats)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    :param results: dictionary of benchmark name -> seconds
+    :param baseline: dictionary of benchmark name -> seconds of an earlier run
+    :param threshold: fraction slower than the baseline that is a regression
+    :return: list of (name, seconds, baseline seconds) of the benchmarks slower than the baseline by more than threshold
+    """
+    return [(name, results[name], baseline[name]) for name in sorted(results)
+            if name in baseline and results[name] > baseline[name] * (1 + threshold)]
+
+
+def run_suite(qbits, output=None, baseline=None, save_baseline=False, threshold=DEFAULT_THRESHOLD):
+    """
+    Run the suite for each register size, print the times and compare them with the baseline
+    :param qbits: list of register sizes
+    :param output: optional file to write the times to as json
+    :param baseline: optional json file of earlier times
+    :param save_baseline: write the times to the baseline file rather than comparing with it
+    :param threshold: fraction slower than the baseline that is a regression
+    :return: list of regressions as returned by compare
+    """
+    results = {}
+    print("{:>24} {:>12}".format("benchmark", "ms"))
+    for num_qbits in qbits:
+        for name, seconds in sorted(suite(num_qbits).items()):
+            key = "{}/{}".format(name, num_qbits)
+            results[key] = seconds
+            print("{:>24} {:>12.3f}".format(key, seconds * 1000))
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if not baseline:
+        return []
+    if save_baseline:
+        with open(baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        return []
+    with open(baseline) as file:
+        regressions = compare(results, json.load(file), threshold)
+    for name, seconds, baseline_seconds in regressions:
+        print("REGRESSION {} {:.3f} ms, baseline {:.3f} ms".format(name, seconds * 1000, baseline_seconds * 1000))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark")
+    threads = subparsers.add_parser("threads", help="scaling of gates with the number of threads")
+    threads.add_argument("--qbits", type=int, nargs="+", default=[20, 22, 24])
+    threads.add_argument("--threads", type=int, nargs="+",
+                         default=sorted(set([2 ** i for i in range(DEFAULT_THREADS.bit_length())] + [DEFAULT_THREADS])))
+    suite_parser = subparsers.add_parser("suite", help="suite of benchmarks compared with a baseline")
+    suite_parser.add_argument("--qbits", type=int, nargs="+", default=DEFAULT_SUITE_QBITS)
+    suite_parser.add_argument("--output", help="json file to write the times to")
+    suite_parser.add_argument("--baseline", help="json file of the times to compare with")
+    suite_parser.add_argument("--save-baseline", action="store_true", help="write the times to the baseline file")
+    suite_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                              help="fraction slower than the baseline that is a regression")
+    args = parser.parse_args()
+    if args.benchmark == "threads":
+        thread_scaling(args.qbits, args.threads)
+    elif args.benchmark == "suite":
+        if run_suite(args.qbits, args.output, args.baseline, args.save_baseline, args.threshold):
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
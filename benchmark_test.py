@@ -0,0 +1,27 @@
+from unittest import main
+
+from benchmark import compare
+from benchmark import suite
+from mock_extension import MockExtension
+
+
+class TestBenchmark(MockExtension):
+
+    def test_compare(self):
+        # Only benchmarks slower than the baseline by more than the threshold are regressions
+        results = {"gates/3": 1.1, "oracle/3": 1.3, "sampling/3": 0.5, "execute/3": 2.0}
+        baseline = {"gates/3": 1.0, "oracle/3": 1.0, "sampling/3": 1.0}
+        self.assertEqual(compare(results, baseline, 0.2), [("oracle/3", 1.3, 1.0)], "Incorrect regressions")
+        self.assertEqual(len(compare(results, baseline, 0.05)), 2, "Incorrect regressions")
+
+    def test_suite(self):
+        # Every benchmark is timed for a small register
+        results = suite(3, repeats=1)
+        self.assertEqual(sorted(results), ["diagonals", "execute", "gates", "grover", "oracle", "quantum_http",
+                                          "sampling"],
+                         "Incorrect benchmarks")
+        self.assertTrue(all(seconds > 0 for seconds in results.values()), "Benchmark not timed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import collections
+import hashlib
+import json
+import threading
+
+
+def canonical_key(value):
+    """
+    Hash a json style value so that equal programs give equal keys regardless of dictionary order
+    :param value: json style value, for example a list of operations
+    :return: hex digest of the canonical json encoding of value
+    """
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LRUCache(object):
+    """
+    Least recently used cache bounded by the number of bytes held rather than the number of entries
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: maximum total size of the cached values
+        """
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """
+        :param key: key of value
+        :return: cached value, or None if there is no value for key
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, num_bytes):
+        """
+        Add value to the cache evicting the least recently used values until it fits
+        :param key: key of value
+        :param value: value to cache
+        :param num_bytes: size of value, values larger than the cache are not stored
+        :return:
+        """
+        if num_bytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= self.entries.pop(key)[1]
+            while self.entries and self.num_bytes + num_bytes > self.max_bytes:
+                self.num_bytes -= self.entries.popitem(last=False)[1][1]
+            self.entries[key] = (value, num_bytes)
+            self.num_bytes += num_bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return: dictionary of cache hit, miss and size counters
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.num_bytes}
@@ -0,0 +1,39 @@
+from unittest import main
+
+from cache import LRUCache
+from cache import canonical_key
+from mock_extension import MockExtension
+
+
+class TestCache(MockExtension):
+
+    def test_canonical_key_ignores_order(self):
+        # Dictionaries with the same content give the same key
+        first = {"op": 'P', "args": {"qbit": 3, "theta": 0.5}}
+        second = {"args": {"theta": 0.5, "qbit": 3}, "op": 'P'}
+        self.assertEqualWrapper(canonical_key(first), canonical_key(second), "Key depends on order")
+        self.assertNotEqual(canonical_key(first), canonical_key([first]), "Different values give same key")
+
+    def test_hits_and_misses(self):
+        cache = LRUCache(100)
+        self.assertEqualWrapper(cache.get("a"), None, "Empty cache returned value")
+        cache.put("a", 1, 10)
+        self.assertEqualWrapper(cache.get("a"), 1, "Cached value not returned")
+        self.assertEqualDictionaryWrapper(cache.stats(), {"hits": 1, "misses": 1, "entries": 1, "bytes": 10},
+                                          "Incorrect cache stats")
+
+    def test_evicts_least_recently_used(self):
+        # Values are evicted oldest first until the new value fits in the byte limit
+        cache = LRUCache(100)
+        cache.put("a", 1, 40)
+        cache.put("b", 2, 40)
+        cache.get("a")
+        cache.put("c", 3, 40)
+        self.assertTrue("a" in cache and "c" in cache and "b" not in cache, "Least recently used not evicted")
+        self.assertEqualWrapper(cache.num_bytes, 80, "Incorrect cache size")
+        cache.put("d", 4, 101)
+        self.assertTrue("d" not in cache, "Value larger than cache stored")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import numpy
+
+from gates import I
+from gates import gates
+from gates import phase_matrix
+
+SINGLE_QBIT_OPS = {"H", "P", "X", "Y", "Z", "U"}
+CONTROLLED_OPS = {"CNOT": "X", "CZ": "Z", "CP": "P", "CU": "U"}  # controlled operation -> gate on the target
+FLIP_OPS = {"J", "O"}
+SWEEP_ARGS = {"theta", "desired_state"}  # arguments that may be given a list or range of values
+MONOMIAL_OPS = {"X", "Y", "Z", "P", "CNOT", "CZ", "CP", "D", "O", "J"}  # operations that never spread a state
+MERGED_DIAGONAL_PASSES = 2  # passes over the state of a D operation, reading and writing every amplitude once
+
+# Number of gates removed by the optimisation passes since the counters were last reset
+stats = {"gates_removed": 0, "diagonals_merged": 0}
+
+
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+
+
+def is_swept(operation):
+    """
+    :param operation: any operation
+    :return: True if any argument of the operation is an array of values of a sweep
+    """
+    args = operation['args'] if 'args' in operation else {}
+    return any(numpy.ndim(args[name]) > 0 for name in SWEEP_ARGS if name in args)
+
+
+def gate_matrix(operation):
+    """
+    :param operation: single qbit operation, for example {"op" : 'P', "args" : {"qbit" : 3, "theta" : 0.0}},
+        or controlled operation
+    :return: 2x2 matrix of the operation, for a controlled operation the matrix applied to the target
+    """
+    name = operation['op']
+    args = operation['args']
+    name = CONTROLLED_OPS[name] if name in CONTROLLED_OPS else name
+    if name == 'P':
+        return phase_matrix(args['theta'])
+    if name == 'U':
+        return numpy.asarray(args['matrix'], complex)
+    return gates[name]
+
+
+def fuse_gates(operations):
+    """
+    Multiply runs of single qbit gates on the same qbit into one 2x2 gate.
+    Gates on different qbits commute, so a run on a qbit is only ended by a controlled operation on
+    the qbit or an operation on the whole register such as O, J or Repeat. Runs whose product is the
+    identity are dropped and the bodies of Repeat operations are fused separately. Swept gates are left
+    as they are.
+    :param operations: list of operations in the same format as Register.execute_operations
+    :return: equivalent list of operations
+    """
+    fused = []
+    pending = {}  # qbit -> [product of the gates, number of gates, operation when there is a single gate]
+
+    def flush(qbits=None):
+        for qbit in sorted(set(pending) if qbits is None else set(pending) & set(qbits)):
+            matrix, count, operation = pending.pop(qbit)
+            if numpy.allclose(matrix, I):
+                stats["gates_removed"] += count
+                continue
+            stats["gates_removed"] += count - 1
+            if operation is None:
+                operation = {"op": 'U', "args": {"qbit": qbit, "matrix": matrix}}
+            fused.append(operation)
+
+    for operation in operations:
+        name = operation['op']
+        if name in SINGLE_QBIT_OPS and is_swept(operation):
+            flush([operation['args']['qbit']])
+            fused.append(operation)
+            continue
+        if name in CONTROLLED_OPS:
+            flush([operation['args']['control'], operation['args']['target']])
+            fused.append(operation)
+            continue
+        if name in SINGLE_QBIT_OPS:
+            qbit = operation['args']['qbit']
+            matrix = gate_matrix(operation)
+            if qbit in pending:
+                pending[qbit] = [numpy.dot(matrix, pending[qbit][0]), pending[qbit][1] + 1, None]
+            else:
+                pending[qbit] = [matrix, 1, operation]
+            continue
+        flush()
+        if name == 'Repeat':
+            args = operation['args']
+            body = fuse_gates(args['operations'])
+            if not body or args['count'] == 0:
+                continue
+            if len(body) == 1 and body[0]['op'] in SINGLE_QBIT_OPS and not is_swept(body[0]):
+                # Repeating a single gate is a single gate raised to the count
+                qbit = body[0]['args']['qbit']
+                matrix = numpy.linalg.matrix_power(gate_matrix(body[0]), args['count'])
+                pending[qbit] = [matrix, args['count'], body[0] if args['count'] == 1 else None]
+                flush()
+                continue
+            fused.append({"op": 'Repeat', "args": {"count": args['count'], "operations": body}})
+        else:
+            fused.append(operation)
+    flush()
+    return fused
+
+
+def optimise(operations):
+    """
+    Run all the optimisation passes over a list of operations
+    :param operations: list of operations in the same format as Register.execute_operations
+    :return: equivalent list of operations
+    """
+    return merge_diagonals(fuse_gates(operations))
+
+
+def diagonal_parts(operation):
+    """
+    :param operation: any operation
+    :return: (factors, flips, controlled) as used by the D operation if the operation is diagonal, otherwise None
+    """
+    name = operation['op']
+    args = operation['args'] if 'args' in operation else {}
+    if is_swept(operation):
+        return None
+    if name == 'D':
+        return tuple(list(args[part]) if part in args else [] for part in ('factors', 'flips', 'controlled'))
+    if name == 'J':
+        return [], [[0, -1.]], []
+    if name == 'O':
+        return [], [[args['desired_state'], -1.]], []
+    if name in ('P', 'Z', 'U', 'CZ', 'CP', 'CU'):
+        matrix = gate_matrix(operation)
+        if matrix[0, 1] != 0 or matrix[1, 0] != 0:
+            return None
+        if name in CONTROLLED_OPS:
+            return [], [], [[args['control'], args['target'], [matrix[0, 0], matrix[1, 1]]]]
+        return [[args['qbit'], [matrix[0, 0], matrix[1, 1]]]], [], []
+    return None
+
+
+def is_monomial(operations):
+    """
+    :param operations: list of operations in the same format as Register.execute_operations
+    :return: True if every operation, including those in the bodies of Repeat operations, is a permutation of the
+        states times a diagonal, so never increases the number of nonzero states: X, Y, Z, P, CNOT, CZ, CP, D, O, J
+        and U or CU gates whose matrix is diagonal or anti diagonal
+    """
+    for operation in operations:
+        name = operation['op']
+        if name == 'Repeat':
+            if not is_monomial(operation['args']['operations']):
+                return False
+        elif name in ('U', 'CU'):
+            matrix = gate_matrix(operation)
+            if (matrix[0, 1] != 0 or matrix[1, 0] != 0) and (matrix[0, 0] != 0 or matrix[1, 1] != 0):
+                return False
+        elif name not in MONOMIAL_OPS:
+            return False
+    return True
+
+
+def diagonal_passes(operation, factors, controlled):
+    """
+    :param operation: diagonal operation
+    :param factors: single qbit factors of the operation as returned by diagonal_parts
+    :param controlled: controlled factors of the operation as returned by diagonal_parts
+    :return: number of passes over the state the operation takes on its own, a gate only changing the half of
+        the state where its qbit is 1, or the quarter where its control and target are 1, when its other factor is 1
+    """
+    if operation['op'] == 'D':
+        return MERGED_DIAGONAL_PASSES
+    return sum(1 if factor[0] == 1 or factor[1] == 1 else 2 for qbit, factor in factors) + \
+        sum(0.5 if factor[0] == 1 else 1 for control, target, factor in controlled)
+
+
+def qbit_diagonal(factors=(), controlled=()):
+    """
+    Build the product of single qbit and controlled diagonal factors over only the qbits they are on,
+    in a single buffer that is doubled for each qbit rather than by a chain of Kronecker products
+    :param factors: list of [qbit, [factor when qbit is 0, factor when qbit is 1]]
+    :param controlled: list of [control, target, [factor when target is 0, factor when target is 1]]
+        applied only where the control qbit is 1
+    :return: sorted list of the qbits and numpy array of length 2^len(qbits) of the product for each value
+        of the qbits, the first qbit the most significant bit
+    """
+    qbits = sorted(set([qbit for qbit, factor in factors] +
+                       [qbit for control, target, factor in controlled for qbit in (control, target)]))
+    axes = {qbit: axis for axis, qbit in enumerate(qbits)}
+    qbit_factors = [numpy.ones(2, complex) for qbit in qbits]
+    for qbit, factor in factors:
+        qbit_factors[axes[qbit]] *= factor
+    diagonal = numpy.empty(2 ** len(qbits), complex)
+    diagonal[0] = 1.
+    size = 1
+    for factor in reversed(qbit_factors):
+        # The next qbit is the most significant bit of the values built so far
+        numpy.multiply(diagonal[:size], factor[1], out=diagonal[size:2 * size])
+        diagonal[:size] *= factor[0]
+        size *= 2
+    values = diagonal.reshape((2,) * len(qbits))
+    for control, target, factor in controlled:
+        if control == target:
+            raise ValueError("Control and target are both qbit {}".format(control))
+        index = [slice(None)] * len(qbits)
+        index[axes[control]] = 1
+        for bit in (0, 1):
+            if factor[bit] != 1:
+                index[axes[target]] = bit
+                values[tuple(index)] *= factor[bit]
+    return qbits, diagonal
+
+
+def merge_diagonals(operations):
+    """
+    Merge runs of consecutive diagonal operations, P, Z, CZ, CP, D and diagonal U and CU gates on any qbits,
+    into a single D operation that multiplies the state by the product of their factors in one pass, when that
+    is fewer passes over the state than applying them one at a time. The product is built here, once, rather than
+    each time the D operation is applied. J and O only change a single state so are left as they are, and as
+    diagonal operations commute they do not end a run.
+    Repeat bodies are merged separately and swept operations are left as they are.
+    :param operations: list of operations in the same format as Register.execute_operations
+    :return: equivalent list of operations
+    """
+    merged = []
+    run = []  # (operation, single qbit factors, controlled factors)
+    flips = []  # J, O and the flips of D operations in the run, applied after it
+
+    def flush():
+        if len(run) > 1 and sum(diagonal_passes(*item) for item in run) > MERGED_DIAGONAL_PASSES:
+            stats["diagonals_merged"] += len(run) - 1
+            factors = [factor for operation, operation_factors, operation_controlled in run
+                       for factor in operation_factors]
+            controlled = [factor for operation, operation_factors, operation_controlled in run
+                          for factor in operation_controlled]
+            qbits, diagonal = qbit_diagonal(factors, controlled)
+            merged.append({"op": 'D', "args": {"factors": factors, "controlled": controlled,
+                                               "qbits": qbits, "diagonal": diagonal}})
+        else:
+            merged.extend(operation for operation, operation_factors, operation_controlled in run)
+        merged.extend(flips)
+        del run[:]
+        del flips[:]
+
+    for operation in operations:
+        parts = diagonal_parts(operation)
+        if parts is not None:
+            factors, operation_flips, controlled = parts
+            if operation_flips:
+                flips.append(operation if not factors and not controlled else
+                             {"op": 'D', "args": {"flips": operation_flips}})
+            if factors or controlled:
+                run.append((operation if not operation_flips else
+                            {"op": 'D', "args": {"factors": factors, "controlled": controlled}}, factors, controlled))
+            continue
+        flush()
+        if operation['op'] == 'Repeat':
+            args = operation['args']
+            merged.append({"op": 'Repeat', "args": {"count": args['count'],
+                                                    "operations": merge_diagonals(args['operations'])}})
+        else:
+            merged.append(operation)
+    flush()
+    return merged
@@ -0,0 +1,157 @@
+from math import pi
+from unittest import main
+
+import numpy
+
+import circuit
+from circuit import fuse_gates
+from circuit import is_monomial
+from circuit import merge_diagonals
+from circuit import optimise
+from mock_extension import MockExtension
+from register import Register
+
+
+class TestCircuit(MockExtension):
+
+    def setUp(self):
+        super(TestCircuit, self).setUp()
+        circuit.reset_stats()
+
+    def assertSameResult(self, num_qbits, operations, optimised, msg):
+        state = numpy.random.RandomState(4).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        expected = Register(num_qbits, self.num_measures)
+        expected.unit_vector = state
+        expected.execute_operations(operations)
+        found = Register(num_qbits, self.num_measures)
+        found.unit_vector = state
+        found.execute_operations(optimised)
+        self.assertTrue(numpy.allclose(found.unit_vector, expected.unit_vector), msg)
+
+    def test_fuse_identity_removed(self):
+        # H.H and X.X are the identity so no operations are left
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'X', "args": {"qbit": 2}},
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'X', "args": {"qbit": 2}}
+        ]
+        self.assertSequenceEqualWrapper(fuse_gates(operations), [], "Identity not removed")
+        self.assertEqualWrapper(circuit.stats["gates_removed"], 4, "Incorrect number of gates removed")
+
+    def test_fuse_same_qbit(self):
+        # H P H on qbit 3 becomes one gate, the gate on qbit 1 is unchanged
+        operations = [
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'Y', "args": {"qbit": 1}},
+            {"op": 'P', "args": {"qbit": 3, "theta": pi / 3}},
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'J'},
+            {"op": 'Z', "args": {"qbit": 3}}
+        ]
+        fused = fuse_gates(operations)
+        self.assertSequenceEqualWrapper([operation['op'] for operation in fused], ['Y', 'U', 'J', 'Z'],
+                                        "Incorrect fused operations")
+        self.assertEqualWrapper(circuit.stats["gates_removed"], 2, "Incorrect number of gates removed")
+        self.assertSameResult(3, operations, fused, "Fused gates give different result")
+
+    def test_fuse_repeat(self):
+        # Repeat bodies are fused and a repeated single gate becomes a power of the gate
+        operations = [
+            {"op": 'Repeat', "args": {"count": 3, "operations": [
+                {"op": 'H', "args": {"qbit": 2}},
+                {"op": 'H', "args": {"qbit": 2}},
+                {"op": 'P', "args": {"qbit": 1, "theta": 0.2}}
+            ]}},
+            {"op": 'Repeat', "args": {"count": 2, "operations": [
+                {"op": 'O', "args": {"desired_state": 3}},
+                {"op": 'X', "args": {"qbit": 1}},
+                {"op": 'Y', "args": {"qbit": 1}}
+            ]}}
+        ]
+        fused = fuse_gates(operations)
+        self.assertSequenceEqualWrapper([operation['op'] for operation in fused], ['U', 'Repeat'],
+                                        "Incorrect fused operations")
+        self.assertEqualWrapper(len(fused[1]['args']['operations']), 2, "Repeat body not fused")
+        self.assertSameResult(3, operations, fused, "Fused repeat gives different result")
+
+    def test_merge_diagonals(self):
+        # Runs of diagonal operations on any qbits become a single D operation when that saves passes over the
+        # state, J and O are left as they are without ending the run
+        operations = [
+            {"op": 'P', "args": {"qbit": 1, "theta": 0.7}},
+            {"op": 'Z', "args": {"qbit": 2}},
+            {"op": 'O', "args": {"desired_state": 5}},
+            {"op": 'J'},
+            {"op": 'P', "args": {"qbit": 3, "theta": 0.4}},
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'Z', "args": {"qbit": 3}},
+            {"op": 'P', "args": {"qbit": 1, "theta": 0.2}},
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'Repeat', "args": {"count": 2, "operations": [
+                {"op": 'Z', "args": {"qbit": 1}},
+                {"op": 'P', "args": {"qbit": 2, "theta": 0.3}},
+                {"op": 'P', "args": {"qbit": 3, "theta": 0.1}}
+            ]}}
+        ]
+        merged = merge_diagonals(operations)
+        self.assertSequenceEqualWrapper([operation['op'] for operation in merged],
+                                        ['D', 'O', 'J', 'H', 'Z', 'P', 'H', 'Repeat'], "Incorrect merged operations")
+        self.assertSequenceEqualWrapper(merged[0]['args']['qbits'], [1, 2, 3], "Product not built when merged")
+        self.assertSequenceEqualWrapper([operation['op'] for operation in merged[7]['args']['operations']], ['D'],
+                                        "Repeat body not merged")
+        self.assertEqualWrapper(circuit.stats["diagonals_merged"], 4, "Incorrect number of diagonals merged")
+        self.assertSameResult(3, operations, merged, "Merged diagonals give different result")
+
+    def test_optimise_controlled(self):
+        # Gates are not fused across a controlled gate on their qbit and controlled phases are merged
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'CNOT', "args": {"control": 1, "target": 2}},
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'CZ', "args": {"control": 2, "target": 1}},
+            {"op": 'CP', "args": {"control": 1, "target": 3, "theta": 0.4}},
+            {"op": 'Z', "args": {"qbit": 2}},
+            {"op": 'P', "args": {"qbit": 3, "theta": 0.2}}
+        ]
+        optimised = optimise(operations)
+        self.assertSequenceEqualWrapper([operation['op'] for operation in optimised], ['H', 'CNOT', 'H', 'D'],
+                                        "Incorrect optimised operations")
+        self.assertSameResult(3, operations, optimised, "Optimised controlled gates give different result")
+
+    def test_optimise_grover(self):
+        # Fused and merged Grover iterations give the same result
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'H', "args": {"qbit": 2}},
+            {"op": 'Repeat', "args": {"count": 3, "operations": [
+                {"op": 'O', "args": {"desired_state": 2}},
+                {"op": 'P', "args": {"qbit": 2, "theta": pi}},
+                {"op": 'H', "args": {"qbit": 1}},
+                {"op": 'H', "args": {"qbit": 2}},
+                {"op": 'J'},
+                {"op": 'H', "args": {"qbit": 1}},
+                {"op": 'H', "args": {"qbit": 2}}
+            ]}}
+        ]
+        self.assertSameResult(2, operations, optimise(operations), "Optimised Grover gives different result")
+
+    def test_is_monomial(self):
+        # Permutations and diagonals never spread a state, H or a U mixing the basis states does
+        permutation = [
+            {"op": 'X', "args": {"qbit": 1}},
+            {"op": 'CP', "args": {"control": 1, "target": 2, "theta": 0.4}},
+            {"op": 'U', "args": {"qbit": 2, "matrix": [[0, 1j], [1, 0]]}},
+            {"op": 'Repeat', "args": {"count": 2, "operations": [{"op": 'J'}, {"op": 'Y', "args": {"qbit": 2}}]}}
+        ]
+        self.assertTrue(is_monomial(permutation), "Permutation program not monomial")
+        self.assertFalse(is_monomial(permutation + [{"op": 'Repeat', "args": {"count": 2, "operations": [
+            {"op": 'H', "args": {"qbit": 1}}]}}]), "Hadamard in Repeat monomial")
+        self.assertFalse(is_monomial([{"op": 'CU', "args": {"control": 1, "target": 2, "matrix": [[1, 1], [1, -1]]}}]),
+                         "Mixing controlled unitary monomial")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import base64
+
+import numpy
+
+# Encodings of the vectors of a response, None being a json list of numbers
+VECTOR_ENCODINGS = {None, "base64"}
+DEFAULT_VECTOR_DTYPE = "complex128"
+
+
+def decode_vector(vector):
+    """
+    Decode a vector of a program, either a list of numbers or a dictionary of the base64 encoding of the
+    raw little endian bytes of the vector and their numpy dtype
+        {"dtype": "complex128", "base64": "AAAAAAAA8D8AAAAAAAAAAA..."}
+    The decoded bytes are viewed as an array without copying them into a list of numbers.
+    :param vector: list of numbers or dictionary of the encoded bytes
+    :return: vector as a list or read only numpy array
+    """
+    if not isinstance(vector, dict) or 'base64' not in vector:
+        return vector
+    dtype = numpy.dtype(vector['dtype'] if 'dtype' in vector else DEFAULT_VECTOR_DTYPE).newbyteorder('<')
+    if dtype.kind not in "fc":
+        raise ValueError("Vector dtype {} is not floating point or complex".format(dtype.name))
+    return numpy.frombuffer(base64.b64decode(vector['base64']), dtype)
+
+
+def encode_vector(vector, encoding=None):
+    """
+    Encode a vector of a response
+    :param vector: numpy array
+    :param encoding: None for a list of numbers or base64 for a dictionary of the base64 encoding of the raw
+        little endian bytes of the vector and their numpy dtype, as read by decode_vector
+    :return: encoded vector
+    """
+    if encoding is None:
+        return vector.tolist()
+    if encoding == "base64":
+        # Encode straight from the buffer of the array, only copying if it is not contiguous little endian
+        vector = numpy.ascontiguousarray(vector, vector.dtype.newbyteorder('<'))
+        return {"dtype": vector.dtype.name, "base64": base64.b64encode(vector).decode('ascii')}
+    raise ValueError("Vector encoding {} is not one of {}".format(encoding, ", ".join(
+        sorted(encoding for encoding in VECTOR_ENCODINGS if encoding is not None))))
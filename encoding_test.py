@@ -0,0 +1,50 @@
+from unittest import main
+
+import numpy
+
+from encoding import decode_vector
+from encoding import encode_vector
+from mock_extension import MockExtension
+from register import execute
+
+
+class TestEncoding(MockExtension):
+
+    def test_round_trip(self):
+        # A vector is decoded to the same values it was encoded from, lists are left alone
+        for vector in [numpy.array([0.5, 0.5j, -0.5, 0.5 - 0j]), numpy.arange(4, dtype=numpy.float32)]:
+            encoded = encode_vector(vector, "base64")
+            self.assertEqualWrapper(encoded["dtype"], vector.dtype.name, "Incorrect dtype")
+            self.assertTrue(numpy.array_equal(decode_vector(encoded), vector), "Decoded vector differs")
+        self.assertSequenceEqualWrapper(encode_vector(numpy.array([1.0, 0.0])), [1.0, 0.0], "Incorrect list")
+        self.assertSequenceEqualWrapper(decode_vector([1.0, 0.0]), [1.0, 0.0], "List changed")
+        with self.assertRaises(ValueError):
+            decode_vector({"dtype": "int64", "base64": "AAAAAAAAAAA="})
+        with self.assertRaises(ValueError):
+            encode_vector(numpy.zeros(2), "hex")
+
+    def test_execute_base64(self):
+        # A program given and asking for base64 vectors matches one using lists
+        initial_vector = numpy.zeros(8, complex)
+        initial_vector[3] = 1.0
+        program = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "seed": 2,
+            "initial_vector": initial_vector.tolist(),
+            "operations": [{"op": 'H', "args": {"qbit": 1}}, {"op": 'P', "args": {"qbit": 1, "theta": 0.5}}]
+        }
+        expected = execute(program)
+        encoded = execute(dict(program, initial_vector=encode_vector(initial_vector, "base64"),
+                               vector_encoding="base64"))
+        self.assertTrue(numpy.allclose(decode_vector(encoded["final_vector"]), expected["final_vector"]),
+                        "Incorrect final vector")
+        self.assertEqualDictionaryWrapper(encoded["states"], expected["states"], "Incorrect states")
+        batch = execute(dict(program, initial_vectors=[encode_vector(initial_vector, "base64")],
+                             vector_encoding="base64"))
+        self.assertTrue(numpy.allclose(decode_vector(batch["results"][0]["probabilities"]),
+                                       abs(numpy.array(expected["final_vector"])) ** 2), "Incorrect probabilities")
+
+
+if __name__ == '__main__':
+    main()
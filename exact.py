@@ -0,0 +1,48 @@
+import numpy
+
+MAX_EXACT_STATES = 2 ** 16  # most states an exact response may list
+NOISE_EPSILONS = 16  # probabilities within this many squared machine epsilons of 0 are rounding noise
+
+
+def noise_floor(dtype):
+    """
+    :param dtype: floating point dtype of the probabilities
+    :return: largest probability that is only rounding noise, for example from H applied twice, which leaves
+        amplitudes of the order of the machine epsilon so probabilities of the order of its square
+    """
+    return NOISE_EPSILONS * numpy.finfo(dtype).eps ** 2
+
+
+def check_exact_size(num_states, top_k=None, min_probability=0.):
+    """
+    Check the exact probabilities of a register are few enough to list
+    :param num_states: number of states that may have a nonzero probability
+    :param top_k: largest number of states to list
+    :param min_probability: smallest probability of a state to list, at most 1 / min_probability states have it
+    :return:
+    """
+    limits = [num_states]
+    if top_k is not None:
+        limits.append(top_k)
+    if min_probability > 0:
+        limits.append(int(1. / min_probability))
+    if min(limits) > MAX_EXACT_STATES:
+        raise ValueError("Exact probabilities of {} states are more than {}, give top_k or min_probability"
+                         .format(num_states, MAX_EXACT_STATES))
+
+
+def top_states(probabilities, top_k=None, min_probability=0.):
+    """
+    Select the most likely states in one pass over the probabilities
+    :param probabilities: numpy array of the probability of each state
+    :param top_k: largest number of states to select
+    :param min_probability: smallest probability of a state to select, or 0 to select every state whose
+        probability is more than rounding noise
+    :return: numpy array of the indices of the selected states in decreasing order of probability,
+        states of equal probability in increasing order
+    """
+    selected = numpy.flatnonzero(probabilities >= min_probability if min_probability > 0 else
+                                 probabilities > noise_floor(probabilities.dtype))
+    if top_k is not None and top_k < len(selected):
+        selected = numpy.sort(selected[numpy.argpartition(-probabilities[selected], top_k - 1)[:top_k]])
+    return selected[numpy.argsort(-probabilities[selected], kind='mergesort')]
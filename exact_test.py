@@ -0,0 +1,80 @@
+from unittest import main
+
+import numpy
+
+from exact import MAX_EXACT_STATES
+from exact import check_exact_size
+from exact import top_states
+from mock_extension import MockExtension
+from register import Register
+from register import execute
+
+
+class TestExact(MockExtension):
+
+    def test_top_states(self):
+        # The most likely states are selected in decreasing order, equal probabilities by index
+        probabilities = numpy.array([0.1, 0.0, 0.3, 0.1, 0.5])
+        self.assertSequenceEqualWrapper(top_states(probabilities).tolist(), [4, 2, 0, 3], "Incorrect states")
+        self.assertSequenceEqualWrapper(top_states(probabilities, top_k=2).tolist(), [4, 2], "Incorrect top_k")
+        self.assertSequenceEqualWrapper(top_states(probabilities, min_probability=0.2).tolist(), [4, 2],
+                                        "Incorrect min_probability")
+        check_exact_size(2 ** 40, top_k=10)
+        check_exact_size(2 ** 40, min_probability=0.01)
+        with self.assertRaises(ValueError):
+            check_exact_size(MAX_EXACT_STATES + 1)
+
+    def test_exact_rounding_noise(self):
+        # H applied twice to each qbit leaves rounding noise rather than 0 in a state, which is not listed
+        register = Register(2, 0)
+        register.unit_vector = [numpy.sqrt(1 / 3.)] * 3 + [0.]
+        register.execute_operations([{"op": 'H', "args": {"qbit": qbit}} for qbit in [1, 2, 1, 2]])
+        self.assertTrue(0 < register.probabilities()[3] < 1e-30, "No rounding noise to test")
+        self.assertEqualWrapper(sorted(register.exact_states()), ["|00>", "|01>", "|10>"],
+                                "Rounding noise listed as an exact state")
+
+    def test_exact_small_probabilities(self):
+        # Small probabilities above rounding noise are listed in single precision and down to an explicit
+        # min_probability below the noise floor
+        num_qbits = 20
+        register = Register(num_qbits, 0, precision="single")
+        register.unit_vector = numpy.full(2 ** num_qbits, 2 ** (-num_qbits / 2.))
+        self.assertEqualWrapper(len(register.exact_states(top_k=3)), 3, "Uniform single precision state not listed")
+        probabilities = numpy.array([0.5, 1e-6, 1e-33, 0.])
+        self.assertSequenceEqualWrapper(top_states(probabilities).tolist(), [0, 1], "Incorrect noise floor")
+        self.assertSequenceEqualWrapper(top_states(probabilities, min_probability=1e-40).tolist(), [0, 1, 2],
+                                        "min_probability overridden by the noise floor")
+
+    def test_execute_exact(self):
+        # Every backend returns the exact probabilities of the state vector
+        num_qbits = 4
+        request = {
+            "num_qbits": num_qbits,
+            "num_measures": 0,
+            "initial_state": {"basis": 0},
+            "operations": [{"op": 'H', "args": {"qbit": qbit}} for qbit in range(1, num_qbits)] +
+                          [{"op": 'P', "args": {"qbit": 1, "theta": 0.3}}, {"op": 'H', "args": {"qbit": 1}},
+                           {"op": 'P', "args": {"qbit": 2, "theta": 0.9}}, {"op": 'H', "args": {"qbit": 2}},
+                           {"op": 'CNOT', "args": {"control": 2, "target": 4}}]
+        }
+        probabilities = abs(numpy.array(execute(request)["final_vector"])) ** 2
+        expected = {"|" + format(state, "04b") + ">": probabilities[state] for state in range(2 ** num_qbits)
+                    if probabilities[state] > 0.1}
+        for backend in [{"backend": "dense"}, {"backend": "sparse"}, {"backend": "mps"}, {"memory_budget": 64}]:
+            result = execute(dict(request, exact={"top_k": len(expected)}, **backend))
+            self.assertReasonablyEqualDictionaryWrapper(result["exact_states"], expected, 1e-9,
+                                                        "Incorrect exact states with {}".format(backend))
+            found = list(result["exact_states"].values())
+            self.assertTrue(found == sorted(found, reverse=True), "States not in order with {}".format(backend))
+        # A Clifford program has equal probabilities over an affine subspace
+        request["operations"] = request["operations"][:3] + request["operations"][-1:]
+        result = execute(dict(request, backend="stabilizer", exact=True))
+        self.assertReasonablyEqualDictionaryWrapper(result["exact_states"],
+                                                    execute(dict(request, exact=True))["exact_states"], 1e-9,
+                                                    "Incorrect stabilizer states")
+        self.assertEqualDictionaryWrapper(execute(dict(request, exact={"min_probability": 0.2}))["exact_states"], {},
+                                          "Incorrect min_probability")
+
+
+if __name__ == '__main__':
+    main()
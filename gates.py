@@ -0,0 +1,31 @@
+import cmath
+import math
+
+import numpy
+
+ROOT2RECIPRICOL = 1 / math.sqrt(2)
+I = numpy.identity(2, complex)
+empty = numpy.zeros((2, 2), complex)
+H = ROOT2RECIPRICOL * numpy.array([[1, 1],
+                                   [1, -1]], complex)
+X = numpy.array([[0, 1],
+                 [1, 0]], complex)
+Y = numpy.array([[0, complex(0, -1)],
+                 [complex(0, 1), 0]], complex)
+Z = numpy.array([[1, 0],
+                 [0, -1]], complex)
+gates = {"H": H, "X": X, "Y": Y, "Z": Z}
+
+
+def phase_matrix(theta):
+    """
+    :param theta: phase shift in radians, or numpy array of phase shifts for a sweep
+    :return: 2x2 matrix of phase shift gate, or array of matrices one for each phase shift
+    """
+    if numpy.ndim(theta) > 0:
+        R = numpy.zeros(numpy.shape(theta) + (2, 2), complex)
+        R[..., 0, 0] = 1
+        R[..., 1, 1] = numpy.exp(1j * numpy.asarray(theta, float))
+        return R
+    return numpy.array([[1, 0],
+                        [0, cmath.exp(1j * complex(theta))]])
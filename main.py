@@ -1,6 +1,94 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Response
 from flask import jsonify
 
+from cache import LRUCache
+from cache import canonical_key
+from register import DEFAULT_MEASURES
+from register import DEFAULT_THREADS
+from register import Register
 from register import execute
+from register import result
+from register import run
+
+RESULT_CACHE_BYTES = 256 * 2 ** 20
+result_cache = LRUCache(RESULT_CACHE_BYTES)
+LIST_BYTES_PER_AMPLITUDE = 40  # list entry and complex object for each amplitude of a response
+STATE_LABEL_BYTES = 120  # dictionary entry, label string and float of each measured state of a response
+CACHE_ENTRY_BYTES = 1024  # key, tuple, response dictionary and bookkeeping of each cache entry
+BATCH_WORKERS = None  # number of worker processes for batches, None uses every core
+BATCH_PENDING_PER_WORKER = 4  # programs queued per worker before waiting for results
+JSON_LINES_TYPES = {'application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'}
+batch_executor = None
+
+
+def execute_cached(program):
+    """
+    Execute a program reusing the final state of an identical earlier program.
+    The states of a cached program are measured again from the cached final vector,
+    unless the program gives a seed in which case the cached response is returned.
+    Only the final vectors of dense registers held in memory are cached, and profiled programs are
+    always executed so that the profile is of running them.
+    :param program: program in the same format as register.execute
+    :return: response in the same format as register.execute
+    """
+    if 'profile' in program and program['profile']:
+        return execute(program)
+    key = canonical_key(program)
+    cached = result_cache.get(key)
+    if cached is not None:
+        vector, initial_norm, retval = cached
+        if retval is not None:
+            return dict(retval)
+        return result(vector_register(program, vector, initial_norm), program)
+    register = run(program)
+    retval = result(register, program)
+    num_bytes = CACHE_ENTRY_BYTES
+    if 'seed' in program:
+        num_bytes += STATE_LABEL_BYTES * sum(len(states) for states in response_states(retval))
+        if ('final_vector' in retval or 'results' in retval) and 'vector_encoding' in program and \
+                program['vector_encoding']:
+            # The response holds the vectors as base64 strings, 4 characters for each 3 bytes
+            num_bytes += register.nbytes * 4 // 3
+        elif 'final_vector' in retval or 'results' in retval:
+            # The response holds the vectors as lists of boxed complex numbers
+            num_bytes += register.number_of_states * (register.batch_size or 1) * LIST_BYTES_PER_AMPLITUDE
+        result_cache.put(key, (None, None, retval), num_bytes)
+    elif type(register) is Register:
+        # The other registers hold their state in a form that cannot be copied cheaply, or in a file
+        result_cache.put(key, (register.unit_vector, register.initial_norm, None), num_bytes + register.nbytes)
+    return retval
+
+
+def response_states(retval):
+    """
+    :param retval: response of a program
+    :return: list of the dictionaries of measured states of the response, one for each point of a batch
+    """
+    return [point["states"] for point in retval["results"]] if 'results' in retval else [retval["states"]]
+
+
+def vector_register(program, vector, initial_norm):
+    """
+    Rebuild the register of a program from its cached final vector
+    :param program: program in the same format as register.execute
+    :param vector: final vector of the program, or for a batch one row for each state vector
+    :param initial_norm: norm of the initial state recorded by run, or None
+    :return: register holding a copy of vector
+    """
+    register = Register(int(vector.shape[-1]).bit_length() - 1,
+                        program['num_measures'] if 'num_measures' in program else DEFAULT_MEASURES,
+                        batch_size=len(vector) if vector.ndim > 1 else None,
+                        precision=program['precision'] if 'precision' in program else "double")
+    register.unit_vector = vector
+    register.initial_norm = initial_norm
+    return register
 
 
 def quantum_http(request):
@@ -35,5 +123,129 @@ def quantum_http(request):
     request_json = request.get_json(silent=True)
     retval = {}
     if request_json:
-        retval = execute(request_json)
+        retval = execute_cached(request_json)
     return jsonify(retval)
+
+
+def json_default(value):
+    """
+    Encode values json does not support, complex numbers become [real, imaginary]
+    """
+    if isinstance(value, complex):
+        return [value.real, value.imag]
+    raise TypeError("Cannot encode {} as json".format(type(value).__name__))
+
+
+def execute_item(index, program, num_threads=DEFAULT_THREADS):
+    """
+    Execute a single program of a batch, reporting any error in the result rather than raising it
+    :param index: position of the program in the batch
+    :param program: program in the same format as register.execute, or a line of json holding it
+    :param num_threads: number of threads the program uses unless it gives num_threads
+    :return: json line of the response with the index of the program added
+    """
+    try:
+        if not isinstance(program, dict):
+            program = json.loads(program)
+        if 'num_threads' not in program:
+            program = dict(program, num_threads=num_threads)
+        retval = execute(program)
+    except Exception as e:
+        retval = {"error": "{}: {}".format(type(e).__name__, e)}
+    retval["index"] = index
+    return json.dumps(retval, default=json_default) + "\n"
+
+
+def replace_batch_executor(workers, executor=None):
+    """
+    Create the pool of processes for batches, replacing a broken pool
+    :param workers: number of worker processes
+    :param executor: pool that is broken, which is only replaced if it is still the pool for batches
+    :return: pool of processes for batches
+    """
+    global batch_executor
+    if batch_executor is not None and batch_executor is executor:
+        batch_executor.shutdown(wait=False)
+        batch_executor = None
+    if batch_executor is None:
+        batch_executor = ProcessPoolExecutor(workers)
+    return batch_executor
+
+
+def finished_lines(done, pending, workers):
+    """
+    :param done: futures of programs that have finished
+    :param pending: dictionary of the index of the program and pool of each unfinished future, from which
+        the finished futures are removed
+    :param workers: number of worker processes
+    :return: generator of json lines of the responses of the finished programs, a program lost with a worker
+        that died returns an error and the pool is replaced for the programs that follow
+    """
+    for future in done:
+        index, executor = pending.pop(future)
+        try:
+            yield future.result()
+        except BrokenProcessPool as e:
+            replace_batch_executor(workers, executor)
+            yield json.dumps({"error": "{}: {}".format(type(e).__name__, e), "index": index}) + "\n"
+
+
+def execute_batch(programs):
+    """
+    Execute programs on a pool of processes
+    :param programs: iterable of programs or lines of json holding them
+    :return: generator of json lines of the responses in the order they finish
+    """
+    workers = BATCH_WORKERS or os.cpu_count() or 1
+    max_pending = BATCH_PENDING_PER_WORKER * workers
+    # The workers share the cores, so each program runs on its share of the threads
+    num_threads = max(1, DEFAULT_THREADS // workers)
+    pending = {}
+    for index, program in enumerate(programs):
+        executor = replace_batch_executor(workers)
+        try:
+            future = executor.submit(execute_item, index, program, num_threads)
+        except BrokenProcessPool:
+            executor = replace_batch_executor(workers, executor)
+            future = executor.submit(execute_item, index, program, num_threads)
+        pending[future] = (index, executor)
+        if len(pending) >= max_pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for line in finished_lines(done, pending, workers):
+                yield line
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for line in finished_lines(done, pending, workers):
+            yield line
+
+
+def quantum_batch_http(request):
+    """
+    HTTP Cloud Function to execute many programs in parallel.
+        Args:
+            request (flask.Request): The request object.
+            This should be a json array of programs in the same format as quantum_http,
+            or a stream of programs with one json program per line
+        Returns:
+            Stream of json lines, one per program in the order they finish, each the same as the
+            response of quantum_http with the index of the program in the request added.
+            A program that fails returns its error rather than failing the whole batch
+            {"final_vector" : [[1.0, 0.0], [0.0, 0.0]], "states" : { "|0>":1.0}, "index" : 1}
+            {"error" : "KeyError: 'initial_vector'", "index" : 0}
+            A program lost with a worker process that dies also returns an error, and json that cannot be parsed
+            or is not an array returns status 400 with the error.
+        """
+    content_type = request.headers['content-type']
+    if content_type == 'application/json':
+        programs = request.get_json(silent=True)
+        if programs is None:
+            return Response(json.dumps({"error": "Batch is not valid json"}), status=400,
+                            mimetype='application/json')
+        if not isinstance(programs, list):
+            return Response(json.dumps({"error": "Batch must be a json array of programs"}), status=400,
+                            mimetype='application/json')
+    elif content_type in JSON_LINES_TYPES:
+        programs = (line for line in request.stream if line.strip())
+    else:
+        raise ValueError("Unknown content type: {}".format(content_type))
+    return Response(execute_batch(programs), mimetype='application/x-ndjson')
@@ -1,3 +1,7 @@
+import io
+import json
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
 from math import pi
 from unittest import main, TestCase
 from unittest.mock import Mock, patch
@@ -5,7 +9,12 @@ from mock_extension import MockExtension
 
 from register_test import TestRegister
 
+import main as main_module
+from main import execute_batch
+from main import execute_item
+from main import quantum_batch_http
 from main import quantum_http
+from main import result_cache
 
 
 def side_effect(json):
@@ -34,6 +43,138 @@ class TestQuantumHTTP(MockExtension):
         self.assertEqualDictionaryWrapper(res["states"], {"|001>": 1.0},
                                           "Phase shift between 2 Hadamard gate same qubit probability")
 
+    @patch('main.jsonify', side_effect=side_effect)
+    def test_quantum_http_cached(self, mock_jsonify):
+        # A repeated program is served from the cache, with the same states when a seed is given
+        data = {
+            "num_qbits": 3,
+            "num_measures": 1000,
+            "seed": 5,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [
+                {"op": 'H', "args": {"qbit": 1}},
+                {"op": 'H', "args": {"qbit": 2}}
+            ]
+        }
+        req = Mock()
+        req.get_json = Mock(return_value=data)
+        req.headers = {'content-type': 'application/json'}
+        result_cache.clear()
+        first = quantum_http(req)
+        second = quantum_http(req)
+        self.assertEqualDictionaryWrapper(result_cache.stats(), {"hits": 1, "misses": 1, "entries": 1,
+                                                                 "bytes": 1824}, "Incorrect cache stats")
+        self.assertEqualDictionaryWrapper(second["states"], first["states"], "Seeded states differ")
+        self.assertSequenceEqualWrapper(second["final_vector"], first["final_vector"], "Cached vector differs")
+        # A profiled program is run again rather than looked up
+        req.get_json = Mock(return_value=dict(data, profile=True))
+        self.assertTrue("profile" in quantum_http(req), "Profile missing")
+        self.assertEqualWrapper(result_cache.stats()["entries"], 1, "Profiled program cached")
+
+    @patch('main.jsonify', side_effect=side_effect)
+    def test_quantum_http_cached_vector(self, mock_jsonify):
+        # Without a seed only the final vector of a dense register is cached, and measured again on a hit
+        data = {
+            "num_qbits": 3,
+            "num_measures": 1000,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [{"op": 'X', "args": {"qbit": 1}}]
+        }
+        req = Mock()
+        req.get_json = Mock(return_value=data)
+        req.headers = {'content-type': 'application/json'}
+        result_cache.clear()
+        first = quantum_http(req)
+        second = quantum_http(req)
+        self.assertEqualDictionaryWrapper(result_cache.stats(), {"hits": 1, "misses": 1, "entries": 1,
+                                                                 "bytes": 1152}, "Incorrect cache stats")
+        self.assertEqualDictionaryWrapper(second["states"], {"|100>": 1.0}, "Incorrect cached states")
+        self.assertSequenceEqualWrapper(second["final_vector"], first["final_vector"], "Cached vector differs")
+        # A memory mapped register holds its state in a file so is not cached
+        req.get_json = Mock(return_value=dict(data, memory_budget=64))
+        quantum_http(req)
+        self.assertEqualWrapper(result_cache.stats()["entries"], 1, "Memory mapped register cached")
+
+    def test_quantum_batch_http(self):
+        # Each line of the batch gives a line of result, with errors reported per program
+        programs = [
+            {"num_qbits": 2, "num_measures": 100, "initial_vector": [0, 1.0, 0, 0],
+             "operations": [{"op": 'X', "args": {"qbit": 1}}]},
+            {"num_qbits": 2, "num_measures": 100},
+            {"num_qbits": 1, "num_measures": 100, "initial_vector": [1.0, 0],
+             "operations": [{"op": 'Y', "args": {"qbit": 1}}]}
+        ]
+        lines = [json.dumps(program) for program in programs] + ["not json"]
+        req = Mock()
+        req.headers = {'content-type': 'application/x-ndjson'}
+        req.stream = io.BytesIO("\n".join(lines).encode("utf-8"))
+        res = quantum_batch_http(req)
+        results = dict((result["index"], result) for result in
+                       (json.loads(line) for line in res.get_data(as_text=True).splitlines()))
+        self.assertSequenceEqualWrapper(sorted(results.keys()), [0, 1, 2, 3], "Missing batch results")
+        self.assertEqualDictionaryWrapper(results[0]["states"], {"|11>": 1.0}, "Incorrect batch states")
+        self.assertSequenceEqualWrapper(results[2]["final_vector"], [[0.0, 0.0], [0.0, 1.0]],
+                                        "Incorrect batch final vector")
+        self.assertTrue("initial_vector" in results[1]["error"], "Missing batch error")
+        self.assertTrue("error" in results[3], "Missing batch json error")
+
+    def test_quantum_batch_http_invalid_json(self):
+        # A json batch that cannot be parsed is a bad request rather than an empty batch
+        req = Mock()
+        req.headers = {'content-type': 'application/json'}
+        req.get_json = Mock(return_value=None)
+        res = quantum_batch_http(req)
+        self.assertEqualWrapper(res.status_code, 400, "Invalid json batch not refused")
+        self.assertTrue("error" in json.loads(res.get_data(as_text=True)), "Missing invalid json error")
+
+    def test_quantum_batch_http_not_array(self):
+        # Valid json that is not an array of programs is a bad request
+        req = Mock()
+        req.headers = {'content-type': 'application/json'}
+        req.get_json = Mock(return_value={"num_qbits": 1})
+        res = quantum_batch_http(req)
+        self.assertEqualWrapper(res.status_code, 400, "Batch that is not an array not refused")
+
+    def test_execute_batch_broken_pool(self):
+        # Programs lost with a worker that dies return errors and the pool is replaced for the next batch
+        class BrokenExecutor(object):
+            def submit(self, function, index, program, num_threads):
+                future = Future()
+                future.set_exception(BrokenProcessPool("A process in the pool was terminated abruptly"))
+                return future
+
+            def shutdown(self, wait=True):
+                self.shut_down = True
+
+        class Executor(object):
+            def __init__(self, workers):
+                pass
+
+            def submit(self, function, index, program, num_threads):
+                future = Future()
+                future.set_result(function(index, program, num_threads))
+                return future
+
+        broken = BrokenExecutor()
+        with patch.object(main_module, 'batch_executor', broken), \
+                patch('main.ProcessPoolExecutor', Executor), \
+                patch('main.execute', side_effect=lambda program: {"states": {}}):
+            lines = [json.loads(line) for line in execute_batch([{"num_qbits": 1}, {"num_qbits": 1}])]
+            self.assertSequenceEqualWrapper(sorted(line["index"] for line in lines), [0, 1], "Lost programs missing")
+            self.assertTrue(all("BrokenProcessPool" in line["error"] for line in lines), "Missing lost program error")
+            self.assertTrue(broken.shut_down, "Broken pool not shut down")
+            self.assertTrue(isinstance(main_module.batch_executor, Executor), "Broken pool not replaced")
+            lines = [json.loads(line) for line in execute_batch([{"num_qbits": 1}])]
+            self.assertEqualDictionaryWrapper(lines[0], {"states": {}, "index": 0}, "Batch after a broken pool failed")
+
+    def test_execute_item_threads(self):
+        # A program of a batch runs on the worker's share of the threads unless it gives its own
+        with patch('main.execute', side_effect=lambda program: {"num_threads": program["num_threads"]}):
+            self.assertEqualWrapper(json.loads(execute_item(0, {"num_qbits": 1}, 3))["num_threads"], 3,
+                                    "Worker threads not used")
+            self.assertEqualWrapper(json.loads(execute_item(0, {"num_threads": 2}, 3))["num_threads"], 2,
+                                    "Program threads not used")
+
 
 if __name__ == '__main__':
     main()
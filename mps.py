@@ -0,0 +1,563 @@
+import heapq
+import itertools
+
+import numpy
+
+from exact import MAX_EXACT_STATES
+from exact import check_exact_size
+from exact import noise_floor
+from exact import top_states
+from gates import H
+from gates import I
+from gates import X
+from gates import Y
+from gates import Z
+from gates import phase_matrix
+from stabilizer import count_rows
+
+DEFAULT_BOND_DIMENSION = 64  # largest bond between neighbouring qbits unless the program asks otherwise
+TRUNCATION_CUTOFF = 1e-14  # fraction of the norm below which a singular value is dropped
+SWAP = numpy.identity(4, complex)[[0, 2, 1, 3]]
+PAULI_MATRICES = {"I": I, "X": X, "Y": Y, "Z": Z}
+
+
+def controlled_matrix(T):
+    """
+    :param T: 2x2 matrix of gate operation
+    :return: 4x4 matrix applying T to the second qbit where the first qbit is 1
+    """
+    C = numpy.identity(4, complex)
+    C[2:, 2:] = T
+    return C
+
+
+class MPSRegister(object):
+    """
+    Register whose state is held as a matrix product state, one tensor of shape (left bond, 2, right bond) for
+    each qbit with qbit 1 first, so the memory used grows with the entanglement of the state rather than 2^n.
+    The tensors are kept in mixed canonical form, those before the center being left orthonormal and those
+    after it right orthonormal, so two qbit gates truncate the bonds at the largest singular values.
+    """
+    batch_size = None
+    profiler = None  # Profiler recording the operations applied by execute_operations
+    in_memory = False  # the state vector is only built when asked for
+    holds_amplitudes = False  # the work of a gate depends on the bonds rather than the bytes of the tensors
+
+    def __init__(self, num_qbits, num_measures, seed=None, max_bond_dimension=DEFAULT_BOND_DIMENSION):
+        """
+        :param num_qbits: number of qbits in the register
+        :param num_measures: number of measurements taken by counting_states
+        :param seed: seed for the random measurements, so that measurements can be repeated
+        :param max_bond_dimension: largest bond between neighbouring qbits, larger bonds are truncated
+        """
+        self.num_qbits = num_qbits
+        self.number_of_states = 2 ** self.num_qbits
+        self.numMeasures = num_measures
+        self.random = numpy.random.RandomState(seed)
+        self.initial_norm = None
+        self.max_bond_dimension = max_bond_dimension
+        self.truncation_error = 0.  # total weight of the singular values dropped by truncation
+        self.set_basis_state(0)
+
+    def set_basis_state(self, state, amplitude=1.):
+        """
+        Set the register to a basis state, a product state with bonds of 1
+        :param state: index of state, qbit 1 is the most significant bit
+        :param amplitude: amplitude of the state
+        :return:
+        """
+        self.tensors = []
+        for qbit in range(1, self.num_qbits + 1):
+            tensor = numpy.zeros((1, 2, 1), complex)
+            tensor[0, (state >> (self.num_qbits - qbit)) & 1, 0] = 1.
+            self.tensors.append(tensor)
+        self.tensors[0] *= amplitude
+        self.center = 0
+
+    def set_basis_states(self, states, amplitudes):
+        """
+        Set the register to a sum of basis states, with a bond of the number of states before truncation
+        :param states: list of state indices
+        :param amplitudes: list of the amplitude of each state
+        :return:
+        """
+        self.set_basis_state(states[0], amplitudes[0])
+        for state, amplitude in zip(states[1:], amplitudes[1:]):
+            self.add_basis_state(state, amplitude)
+        if len(states) > 1:
+            self.compress()
+
+    def set_uniform_state(self):
+        """
+        Set the register to the equal superposition of every state, a product state with bonds of 1
+        :return:
+        """
+        self.tensors = [numpy.full((1, 2, 1), numpy.sqrt(.5), complex) for qbit in range(self.num_qbits)]
+        self.center = 0
+
+    @property
+    def unit_vector(self):
+        """
+        State of the register as a complex numpy array of length 2^n, built by contracting every tensor
+        """
+        vector = numpy.ones((1, 1), complex)
+        for tensor in self.tensors:
+            vector = numpy.dot(vector, tensor.reshape(tensor.shape[0], -1)).reshape(-1, tensor.shape[2])
+        return vector.reshape(-1)
+
+    @unit_vector.setter
+    def unit_vector(self, vector):
+        vector = numpy.asarray(vector, complex)
+        if vector.shape != (2 ** self.num_qbits,):
+            raise ValueError("Vector of shape {} is not a state of {} qbits".format(vector.shape, self.num_qbits))
+        nonzero = numpy.flatnonzero(vector)
+        if len(nonzero) == 1:
+            self.set_basis_state(int(nonzero[0]), vector[nonzero[0]])
+            return
+        # Split off one qbit at a time with a singular value decomposition
+        self.tensors = []
+        remainder = vector.reshape(1, -1)
+        for qbit in range(1, self.num_qbits):
+            left = remainder.shape[0]
+            U, S, V = self.truncated_svd(remainder.reshape(left * 2, -1))
+            self.tensors.append(U.reshape(left, 2, -1))
+            remainder = S[:, None] * V
+        self.tensors.append(remainder.reshape(-1, 2, 1))
+        self.center = self.num_qbits - 1
+
+    @property
+    def nbytes(self):
+        return sum(tensor.nbytes for tensor in self.tensors)
+
+    @property
+    def bond_dimensions(self):
+        """
+        :return: list of the bonds between each pair of neighbouring qbits
+        """
+        return [tensor.shape[2] for tensor in self.tensors[:-1]]
+
+    def norm(self):
+        return numpy.linalg.norm(self.tensors[self.center])
+
+    def state_label(self, bits):
+        """
+        :param bits: value of each qbit of the state, qbit 1 first
+        :return: ket label of state, for example |011>
+        """
+        return "|" + "".join(str(bit) for bit in bits) + ">"
+
+    def truncated_svd(self, matrix):
+        """
+        Singular value decomposition keeping at most max_bond_dimension of the largest singular values.
+        The weight of the dropped values is added to the truncation error and the kept values are
+        scaled to keep the norm.
+        :param matrix: numpy array to decompose
+        :return: (U, S, V) with matrix approximately U * S * V
+        """
+        U, S, V = numpy.linalg.svd(matrix, full_matrices=False)
+        weights = S * S
+        total = weights.sum()
+        keep = max(1, min(self.max_bond_dimension, numpy.count_nonzero(weights > TRUNCATION_CUTOFF * total)))
+        if keep < len(S):
+            dropped = weights[keep:].sum()
+            self.truncation_error += dropped / total if total else 0.
+            S = S[:keep] * numpy.sqrt(total / (total - dropped))
+        return U[:, :keep], S, V[:keep]
+
+    def move_center(self, site):
+        """
+        Move the center of the canonical form to site with QR decompositions of the tensors passed
+        :param site: index of the tensor, qbit - 1
+        :return:
+        """
+        while self.center < site:
+            tensor = self.tensors[self.center]
+            Q, R = numpy.linalg.qr(tensor.reshape(-1, tensor.shape[2]))
+            self.tensors[self.center] = Q.reshape(tensor.shape[0], 2, -1)
+            self.tensors[self.center + 1] = numpy.tensordot(R, self.tensors[self.center + 1], axes=(1, 0))
+            self.center += 1
+        while self.center > site:
+            tensor = self.tensors[self.center]
+            Q, R = numpy.linalg.qr(tensor.reshape(tensor.shape[0], -1).T)
+            self.tensors[self.center] = Q.T.reshape(-1, 2, tensor.shape[2])
+            self.tensors[self.center - 1] = numpy.tensordot(self.tensors[self.center - 1], R.T, axes=(2, 0))
+            self.center -= 1
+
+    def compress(self):
+        """
+        Bring the tensors to canonical form and truncate every bond, for example after adding states
+        :return:
+        """
+        self.center = 0
+        self.move_center(self.num_qbits - 1)
+        for site in range(self.num_qbits - 1, 0, -1):
+            tensor = self.tensors[site]
+            U, S, V = self.truncated_svd(tensor.reshape(tensor.shape[0], -1))
+            self.tensors[site] = V.reshape(-1, 2, tensor.shape[2])
+            self.tensors[site - 1] = numpy.tensordot(self.tensors[site - 1], U * S, axes=(2, 0))
+        self.center = 0
+
+    def gate_function(self, qbit, T):
+        """
+        Apply a single qbit gate to the tensor of the qbit
+        :param qbit:start AT 1
+        :param T: 2x2 matrix of gate operation
+        :return:
+        """
+        self.tensors[qbit - 1] = numpy.einsum('ij,ajb->aib', T, self.tensors[qbit - 1])
+
+    def neighbour_gate(self, site, G):
+        """
+        Apply a two qbit gate to the tensors at site and site + 1, splitting them again with a truncated SVD
+        :param site: index of the first tensor, qbit - 1
+        :param G: 4x4 matrix of gate operation, the first qbit being the most significant
+        :return:
+        """
+        self.move_center(site)
+        pair = numpy.tensordot(self.tensors[site], self.tensors[site + 1], axes=(2, 0))
+        pair = numpy.einsum('ijkl,akld->aijd', G.reshape(2, 2, 2, 2), pair)
+        left, right = pair.shape[0], pair.shape[3]
+        U, S, V = self.truncated_svd(pair.reshape(left * 2, right * 2))
+        self.tensors[site] = U.reshape(left, 2, -1)
+        self.tensors[site + 1] = (S[:, None] * V).reshape(-1, 2, right)
+        self.center = site + 1
+
+    def two_qbit_gate(self, first, second, G):
+        """
+        Apply a two qbit gate, moving the second qbit next to the first with swap gates and back again
+        :param first: first qbit, start AT 1
+        :param second: second qbit, start AT 1
+        :param G: 4x4 matrix of gate operation, the first qbit being the most significant
+        :return:
+        """
+        if first == second:
+            raise ValueError("Control and target are both qbit {}".format(first))
+        if first > second:
+            first, second = second, first
+            G = G.reshape(2, 2, 2, 2).transpose(1, 0, 3, 2).reshape(4, 4)
+        for site in range(second - 2, first - 1, -1):
+            self.neighbour_gate(site, SWAP)
+        self.neighbour_gate(first - 1, G)
+        for site in range(first, second - 1):
+            self.neighbour_gate(site, SWAP)
+
+    def controlled_gate_function(self, control, target, T):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param T: 2x2 matrix of gate operation
+        :return:
+        """
+        self.two_qbit_gate(control, target, controlled_matrix(T))
+
+    def hadamard_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.gate_function(qbit, H)
+
+    def phase_gate(self, qbit, theta):
+        """
+        :param qbit:start AT 1
+        :param theta: user defines theta in radians
+        :return:
+        """
+        self.gate_function(qbit, phase_matrix(theta))
+
+    def pauli_x_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.gate_function(qbit, X)
+
+    def pauli_y_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.gate_function(qbit, Y)
+
+    def pauli_z_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.gate_function(qbit, Z)
+
+    def unitary_gate(self, qbit, matrix):
+        """
+        :param qbit:start AT 1
+        :param matrix: 2x2 unitary matrix of gate as nested lists or numpy array
+        :return:
+        """
+        self.gate_function(qbit, numpy.asarray(matrix, complex))
+
+    def controlled_not_gate(self, control, target):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :return:
+        """
+        self.controlled_gate_function(control, target, X)
+
+    def controlled_z_gate(self, control, target):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :return:
+        """
+        self.controlled_gate_function(control, target, Z)
+
+    def controlled_phase_gate(self, control, target, theta):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param theta: user defines theta in radians
+        :return:
+        """
+        self.controlled_gate_function(control, target, phase_matrix(theta))
+
+    def controlled_unitary_gate(self, control, target, matrix):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param matrix: 2x2 unitary matrix of gate as nested lists or numpy array
+        :return:
+        """
+        self.controlled_gate_function(control, target, numpy.asarray(matrix, complex))
+
+    def amplitude(self, state):
+        """
+        :param state: index of state
+        :return: amplitude of the state
+        """
+        vector = numpy.ones(1, complex)
+        for qbit, tensor in enumerate(self.tensors, 1):
+            vector = numpy.dot(vector, tensor[:, (state >> (self.num_qbits - qbit)) & 1, :])
+        return vector[0]
+
+    def add_basis_state(self, state, amplitude):
+        """
+        Add amplitude times a basis state to the state, which adds one to every bond
+        :param state: index of state
+        :param amplitude: amplitude to add
+        :return:
+        """
+        for qbit, tensor in enumerate(self.tensors, 1):
+            left, right = tensor.shape[0], tensor.shape[2]
+            bit = (state >> (self.num_qbits - qbit)) & 1
+            first, last = qbit == 1, qbit == self.num_qbits
+            added = numpy.zeros((left + (not first), 2, right + (not last)), complex)
+            added[:left, :, :right] = tensor
+            added[-1, bit, -1] += amplitude if first else 1.
+            self.tensors[qbit - 1] = added
+
+    def phase_flip(self, state, factor=-1.):
+        """
+        Multiply the amplitude of a single state by factor, as psi + (factor - 1) <state|psi> |state>
+        :param state: index of state to change
+        :param factor: phase factor to multiply the state amplitude by
+        :return:
+        """
+        amplitude = self.amplitude(state)
+        if amplitude != 0:
+            self.add_basis_state(state, (factor - 1) * amplitude)
+            self.compress()
+
+    def diagonal_gate(self, factors=(), flips=(), controlled=()):
+        """
+        Apply a diagonal operation as single and controlled diagonal gates and changes to single states
+        :param factors: list of [qbit, [factor when qbit is 0, factor when qbit is 1]]
+        :param flips: list of [state, factor to multiply the state by]
+        :param controlled: list of [control, target, [factor when target is 0, factor when target is 1]]
+            applied only where the control qbit is 1
+        :return:
+        """
+        for qbit, factor in factors:
+            self.gate_function(qbit, numpy.diag(factor))
+        for control, target, factor in controlled:
+            self.controlled_gate_function(control, target, numpy.diag(factor))
+        for state, factor in flips:
+            self.phase_flip(state, factor)
+
+    def j_gate(self):
+        """
+        Apply J = I - 2|0><0|
+        :return:
+        """
+        self.phase_flip(0)
+
+    def oracle(self, desired_state):
+        """
+        Apply oracle O = I - 2|desired_state><desired_state|
+        :param desired_state: index of state to find
+        :return:
+        """
+        self.phase_flip(desired_state)
+
+    def sample(self, num_samples, probabilities=None):
+        """
+        Draw all measurements together one qbit at a time. With the center at the first qbit the
+        probability of each value of a qbit given the values of the qbits before it is the norm of the
+        contraction of those values with the tensor of the qbit.
+        :param num_samples: number of measurements to take
+        :param probabilities: ignored
+        :return: numpy array with the value of each qbit of each measurement, one row for each measurement
+        """
+        self.move_center(0)
+        samples = numpy.zeros((num_samples, self.num_qbits), numpy.uint8)
+        left = numpy.ones((num_samples, 1), complex)
+        for site, tensor in enumerate(self.tensors):
+            zero = numpy.dot(left, tensor[:, 0, :])
+            one = numpy.dot(left, tensor[:, 1, :])
+            zero_probability = (zero.conjugate() * zero).real.sum(axis=1)
+            one_probability = (one.conjugate() * one).real.sum(axis=1)
+            measured = self.random.random_sample(num_samples) * (zero_probability + one_probability) >= zero_probability
+            samples[:, site] = measured
+            probability = numpy.where(measured, one_probability, zero_probability)
+            left = numpy.where(measured[:, None], one, zero) / numpy.sqrt(probability)[:, None]
+        return samples
+
+    def measure(self):
+        return self.state_label(self.sample(1)[0])
+
+    def count_samples(self, probabilities, qbits=None):
+        """
+        :param probabilities: ignored
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the fraction of measurements that found each state, or each value of qbits
+        """
+        if self.numMeasures <= 0:
+            return {}
+        samples = self.sample(self.numMeasures)
+        if qbits is not None:
+            samples = samples[:, numpy.asarray(qbits) - 1]
+        states, counts = count_rows(samples)
+        return {self.state_label(state): float(count) / self.numMeasures for state, count in zip(states, counts)}
+
+    def counting_states(self, qbits=None):
+        """
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the fraction of measurements that found each state, or each value of qbits
+        """
+        return self.count_samples(None, qbits)
+
+    def marginal_probabilities(self, qbits):
+        """
+        Contract the tensors with their conjugates one qbit at a time, keeping the value of each measured qbit
+        and summing over the others
+        :param qbits: list of the qbits to measure
+        :return: numpy array of the probability of each value of qbits, qbits[0] the most significant bit
+        """
+        # environment[value, a, b] joins the right bonds a of the conjugate tensors and b of the tensors
+        # for each value of the measured qbits so far
+        environment = numpy.ones((1, 1, 1), complex)
+        for qbit, tensor in enumerate(self.tensors, 1):
+            right = numpy.tensordot(environment, tensor, axes=(2, 0))  # value, a, qbit, right bond
+            if qbit in qbits:
+                environment = numpy.einsum('vasd,asc->vscd', right, tensor.conjugate())
+                environment = environment.reshape(-1, tensor.shape[2], tensor.shape[2])
+            else:
+                environment = numpy.tensordot(right, tensor.conjugate(), axes=([1, 2], [0, 1])).transpose(0, 2, 1)
+        ordered = sorted(qbits)
+        probabilities = environment[:, 0, 0].real.reshape((2,) * len(qbits))
+        return probabilities.transpose([ordered.index(qbit) for qbit in qbits]).reshape(-1)
+
+    def expectation(self, pauli):
+        """
+        Contract the state with the Pauli string and the conjugate of the state one qbit at a time
+        :param pauli: Pauli string with one of I, X, Y or Z for every qbit, qbit 1 first
+        :return: expectation value of the Pauli string
+        """
+        # environment[a, b] joins the right bond a of the conjugate tensors with the right bond b of the tensors
+        environment = numpy.ones((1, 1), complex)
+        for tensor, character in zip(self.tensors, pauli):
+            applied = numpy.tensordot(PAULI_MATRICES[character], tensor, axes=(1, 1))  # value, left, right
+            right = numpy.tensordot(environment, applied, axes=(1, 1))  # conjugate left, value, right
+            environment = numpy.tensordot(tensor.conjugate(), right, axes=([0, 1], [0, 1]))
+        return environment[0, 0].real
+
+    def exact_states(self, top_k=None, min_probability=0., qbits=None):
+        """
+        Search the states one qbit at a time, most likely first. With the center at the first qbit the probability
+        of the values of the first qbits is the norm of their contraction with the tensors of those qbits, which
+        only falls as qbits are added, so complete states are found in decreasing order of probability and values
+        less likely than min_probability are never extended. A state spread evenly over many states needs almost
+        every value of the first qbits searched, so the search stops with an error after MAX_EXACT_STATES values.
+        :param top_k: largest number of states to return
+        :param min_probability: smallest probability of a state to return
+        :param qbits: list of the qbits to measure, by default every qbit, whose 2^len(qbits) probabilities
+            are all found with marginal_probabilities
+        :return: dictionary of the probability of each of the most likely states, or values of qbits,
+            in decreasing order
+        """
+        if qbits is not None:
+            check_exact_size(2 ** len(qbits))
+            probabilities = self.marginal_probabilities(qbits)
+            return {self.state_label(format(state, "0" + str(len(qbits)) + "b")): float(probabilities[state])
+                    for state in top_states(probabilities, top_k, min_probability)}
+        check_exact_size(2 ** self.num_qbits, top_k, min_probability)
+        self.move_center(0)
+        states = {}
+        order = itertools.count()  # values of equal probability and length are searched in the order reached
+        # Heap of the negative probability, negative number of qbits, order, values of the first qbits and their
+        # contraction. Of values of equal probability the longest is searched first, so that a run of qbits
+        # that are certain is followed to a complete state rather than searched alongside every other value.
+        heap = [(-self.norm() ** 2, 0, next(order), (), numpy.ones(1, complex))]
+        for searched in itertools.count():
+            if not heap or top_k is not None and len(states) >= top_k:
+                break
+            if searched > MAX_EXACT_STATES:
+                raise ValueError("Exact probabilities searched more than {} values of the first qbits, "
+                                 "give a larger min_probability".format(MAX_EXACT_STATES))
+            negative_probability, depth, index, bits, left = heapq.heappop(heap)
+            if len(bits) == self.num_qbits:
+                states[self.state_label(bits)] = float(-negative_probability)
+                continue
+            tensor = self.tensors[len(bits)]
+            for bit in (0, 1):
+                branch = numpy.dot(left, tensor[:, bit, :])
+                probability = numpy.vdot(branch, branch).real
+                if probability >= min_probability if min_probability > 0 else probability > noise_floor(float):
+                    heapq.heappush(heap, (-probability, -len(bits) - 1, next(order), bits + (bit,), branch))
+        return states
+
+    def repeat(self, count, operations):
+        for i in range(count):
+            self.execute_operations(operations)
+
+    def execute_operations(self, operations):
+        """
+        Perform list of operations on register
+        :param operations: list of operations in the same format as Register.execute_operations
+        :return:
+        """
+        if self.profiler is not None:
+            self.profiler.execute_operations(self, operations)
+            return
+        for operation in operations:
+            op = self.op_table[operation['op']]
+            if 'args' in operation:
+                args = operation['args']
+            else:
+                args = {}
+            op(self, **args)
+
+    op_table = {
+        'H': hadamard_gate,
+        'P': phase_gate,
+        'X': pauli_x_gate,
+        'Y': pauli_y_gate,
+        'Z': pauli_z_gate,
+        'U': unitary_gate,
+        'CNOT': controlled_not_gate,
+        'CZ': controlled_z_gate,
+        'CP': controlled_phase_gate,
+        'CU': controlled_unitary_gate,
+        'D': diagonal_gate,
+        'O': oracle,
+        'J': j_gate,
+        'Repeat': repeat
+    }
@@ -0,0 +1,98 @@
+from unittest import main
+from unittest.mock import patch
+
+import numpy
+
+from gates import H
+from mock_extension import MockExtension
+from mps import MPSRegister
+from register import Register
+from register import execute
+
+
+class TestMPS(MockExtension):
+
+    def setUp(self):
+        MockExtension.setUp(self)
+        self.num_qbits = 6
+        self.operations = [{"op": 'H', "args": {"qbit": qbit}} for qbit in range(1, self.num_qbits + 1)]
+        self.operations += [{"op": 'CP', "args": {"control": qbit, "target": qbit % self.num_qbits + 1,
+                                                  "theta": 0.9}} for qbit in range(1, self.num_qbits + 1)]
+        self.operations += [
+            {"op": 'CNOT', "args": {"control": 5, "target": 1}},
+            {"op": 'CU', "args": {"control": 2, "target": 6, "matrix": H}},
+            {"op": 'Y', "args": {"qbit": 3}},
+            {"op": 'D', "args": {"factors": [[2, [1, 1j]]], "flips": [[5, -1]], "controlled": [[1, 6, [1, -1]]]}},
+            {"op": 'O', "args": {"desired_state": 45}},
+            {"op": 'J'}
+        ]
+
+    def test_matches_register(self):
+        # Gates on the tensors, including gates on qbits that are not neighbours, match gates on the state vector
+        expected = Register(self.num_qbits, self.num_measures, seed=4)
+        expected.unit_vector[0] = 1.0
+        expected.execute_operations(self.operations)
+        register = MPSRegister(self.num_qbits, self.num_measures, seed=4)
+        register.execute_operations(self.operations)
+        self.assertTrue(numpy.allclose(register.unit_vector, expected.unit_vector), "MPS register differs")
+        self.assertTrue(register.truncation_error < 1e-12, "Truncated without a bond limit")
+        probabilities = abs(expected.unit_vector) ** 2
+        test_states = {self.make_state_string(state, self.num_qbits): probability
+                       for state, probability in enumerate(probabilities) if probability > 0.01}
+        self.assertReasonablyEqualDictionaryWrapper(register.counting_states(), test_states,
+                                                    self.state_accuracy_percent, "Incorrect MPS states")
+
+    def test_truncation(self):
+        # Bonds are cut to the bond dimension and the dropped weight is reported
+        register = MPSRegister(self.num_qbits, self.num_measures, max_bond_dimension=2)
+        register.execute_operations(self.operations)
+        self.assertTrue(max(register.bond_dimensions) <= 2, "Bond larger than the bond dimension")
+        self.assertTrue(register.truncation_error > 0.01, "Truncation not reported")
+        self.assertReasonablyEqualWrapper(register.norm(), 1.0, 1e-9, "Truncation changed the norm")
+
+    def test_execute_large_ghz_state(self):
+        # A GHZ state of many qbits only needs bonds of 2
+        num_qbits = 60
+        request = {
+            "num_qbits": num_qbits,
+            "num_measures": self.num_measures,
+            "backend": "mps",
+            "max_bond_dimension": 4,
+            "operations": [{"op": 'H', "args": {"qbit": 1}}] +
+                          [{"op": 'CNOT', "args": {"control": 1, "target": qbit}} for qbit in range(2, num_qbits + 1)]
+        }
+        result = execute(request)
+        self.assertTrue("final_vector" not in result, "MPS register returned final vector")
+        self.assertTrue(result["truncation_error"] < 1e-12, "Incorrect truncation error")
+        test_states = {"|" + "0" * num_qbits + ">": 0.5, "|" + "1" * num_qbits + ">": 0.5}
+        self.assertReasonablyEqualDictionaryWrapper(result["states"], test_states, self.state_accuracy_percent,
+                                                    "Incorrect GHZ state")
+
+    def test_execute_final_vector_over_memory_budget(self):
+        # The final vector of an mps register is only built when it fits in the memory budget
+        request = {
+            "num_qbits": 60,
+            "num_measures": self.num_measures,
+            "backend": "mps",
+            "final_vector": True,
+            "operations": [{"op": 'H', "args": {"qbit": 1}}]
+        }
+        with self.assertRaises(ValueError):
+            execute(request)
+        result = execute(dict(request, num_qbits=2))
+        self.assertEqualWrapper(len(result["final_vector"]), 4, "Missing MPS final vector")
+
+    def test_exact_states_deepest_first(self):
+        # Of values of equal probability the longest is extended first, so the certain qbits after the first
+        # are followed to a complete state without searching the other value of the first qbit alongside
+        num_qbits = 60
+        register = MPSRegister(num_qbits, self.num_measures)
+        register.execute_operations([{"op": 'H', "args": {"qbit": 1}}])
+        with patch('mps.MAX_EXACT_STATES', num_qbits + 10):
+            states = register.exact_states(top_k=1)
+        self.assertEqualWrapper(len(states), 1, "Incorrect number of exact states")
+        self.assertReasonablyEqualWrapper(list(states.values())[0], 0.5, 1e-9, "Incorrect exact probability")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import numpy
+
+PAULIS = "IXYZ"
+OBSERVABLE_CHUNK_STATES = 2 ** 20  # states of the vector read at once when finding an expectation value
+
+
+def parse_pauli(term, num_qbits):
+    """
+    :param term: Pauli string, either one of I, X, Y or Z for every qbit with qbit 1 first, for example ZIZ,
+        or the Paulis that are not the identity each followed by its qbit, for example Z1 Z3
+    :param num_qbits: number of qbits in the register
+    :return: Pauli string with one of I, X, Y or Z for every qbit, qbit 1 first
+    """
+    if not any(character.isdigit() for character in term):
+        if len(term) != num_qbits or any(character not in PAULIS for character in term):
+            raise ValueError("Pauli string {} is not one of {} for each of {} qbits".format(term, PAULIS, num_qbits))
+        return term
+    paulis = ["I"] * num_qbits
+    for factor in term.split():
+        qbit = int(factor[1:])
+        if factor[0] not in PAULIS or not 1 <= qbit <= num_qbits or paulis[qbit - 1] != "I":
+            raise ValueError("Pauli {} of {} is not a Pauli on a qbit of {} qbits".format(factor, term, num_qbits))
+        paulis[qbit - 1] = factor[0]
+    return "".join(paulis)
+
+
+def pauli_masks(pauli):
+    """
+    As an operator on the basis states a Pauli string is P|k> = i^y (-1)^parity(k & z) |k ^ x>
+    :param pauli: Pauli string with one of I, X, Y or Z for every qbit, qbit 1 first
+    :return: integer with the bits of the qbits that are X or Y, integer with the bits of the qbits that are
+        Z or Y and the number y of qbits that are Y
+    """
+    x_mask, z_mask = 0, 0
+    for qbit, character in enumerate(pauli, 1):
+        mask = 1 << (len(pauli) - qbit)
+        if character in "XY":
+            x_mask |= mask
+        if character in "ZY":
+            z_mask |= mask
+    return x_mask, z_mask, pauli.count("Y")
+
+
+def parity(values):
+    """
+    :param values: numpy array of non negative 64 bit integers, changed in place
+    :return: numpy array of the parity of the number of bits set in each value, 0 or 1
+    """
+    for shift in (32, 16, 8, 4, 2, 1):
+        values ^= values >> shift
+    return values & 1
+
+
+def pauli_expectation(vector, pauli, chunk_states=OBSERVABLE_CHUNK_STATES):
+    """
+    Expectation value <psi|P|psi> of a Pauli string, the sum over the states k of
+    i^y (-1)^parity(k & z) conj(psi[k ^ x]) psi[k], found a chunk of states at a time
+    :param vector: numpy array of the state vector, or of a batch of state vectors one in each row
+    :param pauli: Pauli string with one of I, X, Y or Z for every qbit, qbit 1 first
+    :param chunk_states: number of states read at once
+    :return: expectation value, or for a batch a numpy array of the expectation value of each state vector
+    """
+    x_mask, z_mask, num_y = pauli_masks(pauli)
+    number_of_states = vector.shape[-1]
+    total = numpy.zeros(vector.shape[:-1], complex)
+    for start in range(0, number_of_states, chunk_states):
+        states = numpy.arange(start, min(start + chunk_states, number_of_states), dtype=numpy.int64)
+        signs = 1 - 2 * parity(states & z_mask)
+        # The states flipped by x from a contiguous chunk are a contiguous chunk in a different order
+        flipped = vector[..., states ^ x_mask] if x_mask else vector[..., start:start + len(states)]
+        total += (flipped.conjugate() * vector[..., start:start + len(states)] * signs).sum(axis=-1, dtype=complex)
+    return (1j ** num_y * total).real
@@ -0,0 +1,86 @@
+from functools import reduce
+from itertools import product
+from unittest import main
+
+import numpy
+
+from gates import I
+from gates import X
+from gates import Y
+from gates import Z
+from mock_extension import MockExtension
+from observables import parse_pauli
+from register import execute
+
+PAULI_MATRICES = {"I": I, "X": X, "Y": Y, "Z": Z}
+
+
+def expected_values(vector, paulis):
+    """
+    :return: expectation value of each Pauli string from the whole matrix of the string
+    """
+    return [numpy.vdot(vector, reduce(numpy.kron, [PAULI_MATRICES[character] for character in pauli]).dot(vector)).real
+            for pauli in paulis]
+
+
+class TestObservables(MockExtension):
+
+    def test_parse_pauli(self):
+        # Pauli strings are given for every qbit or as the qbits that are not the identity
+        self.assertEqualWrapper(parse_pauli("ZIZ", 3), "ZIZ", "Incorrect whole string")
+        self.assertEqualWrapper(parse_pauli("Z1 Y3", 4), "ZIYI", "Incorrect qbit string")
+        for term in ["ZI", "ZIA", "Z5", "Z1 X1"]:
+            with self.assertRaises(ValueError):
+                parse_pauli(term, 3)
+
+    def test_execute_observables(self):
+        # Every backend finds the expectation values of the state vector
+        num_qbits = 4
+        random = numpy.random.RandomState(3)
+        operations = []
+        for i in range(25):
+            qbit = int(random.randint(1, num_qbits + 1))
+            operations.append([{"op": 'H', "args": {"qbit": qbit}},
+                               {"op": 'P', "args": {"qbit": qbit, "theta": float(random.rand() * 3)}},
+                               {"op": 'CNOT', "args": {"control": qbit, "target": qbit % num_qbits + 1}},
+                               {"op": 'Y', "args": {"qbit": qbit}}][random.randint(4)])
+        paulis = ["ZIZI", "X1 Y3", "YYXZ", "IIII", "Y2", "XXXX", "Z4"]
+        request = {"num_qbits": num_qbits, "num_measures": 0, "initial_state": {"basis": 3},
+                   "operations": operations, "observables": paulis[:-1] + [{"pauli": "Z4", "weight": -2.0}]}
+        expected = expected_values(numpy.array(execute(request)["final_vector"]),
+                                   [parse_pauli(pauli, num_qbits) for pauli in paulis])
+        expected[-1] *= -2.0
+        for backend in [{"backend": "sparse"}, {"backend": "mps"}, {"memory_budget": 64}, {"precision": "single"}]:
+            self.assertTrue(numpy.allclose(execute(dict(request, **backend))["observables"], expected, atol=1e-6),
+                            "Incorrect observables with {}".format(backend))
+        # A batch has the expectation values of each of its state vectors
+        del request["initial_state"]
+        initial_vectors = [[1.0] + [0] * 15, [0] * 15 + [1.0]]
+        results = execute(dict(request, initial_vectors=initial_vectors))["results"]
+        for initial_vector, point in zip(initial_vectors, results):
+            self.assertTrue(numpy.allclose(point["observables"],
+                                           execute(dict(request, initial_vector=initial_vector))["observables"]),
+                            "Incorrect batch observables")
+
+    def test_stabilizer_observables(self):
+        # The stabilizer backend finds -1, 0 or 1 for every Pauli string of a Clifford program
+        num_qbits = 3
+        random = numpy.random.RandomState(7)
+        paulis = ["".join(pauli) for pauli in product("IXYZ", repeat=num_qbits)]
+        for trial in range(5):
+            operations = []
+            for i in range(15):
+                qbit = int(random.randint(1, num_qbits + 1))
+                operations.append([{"op": 'H', "args": {"qbit": qbit}},
+                                   {"op": 'P', "args": {"qbit": qbit, "theta": numpy.pi / 2}},
+                                   {"op": 'CNOT', "args": {"control": qbit, "target": qbit % num_qbits + 1}},
+                                   {"op": 'Y', "args": {"qbit": qbit}}][random.randint(4)])
+            request = {"num_qbits": num_qbits, "num_measures": 0, "initial_state": {"basis": trial},
+                       "operations": operations, "observables": paulis}
+            expected = expected_values(numpy.array(execute(dict(request, backend="dense"))["final_vector"]), paulis)
+            self.assertTrue(numpy.allclose(execute(dict(request, backend="stabilizer"))["observables"], expected),
+                            "Incorrect stabilizer observables")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import time
+
+# Estimated floating point operations for each amplitude of the state, a complex multiply being 6 and an add 2
+FLOPS_PER_AMPLITUDE = {
+    "H": 14, "U": 14, "X": 6, "Y": 6, "P": 3, "Z": 3,
+    "CNOT": 3, "CZ": 1.5, "CP": 1.5, "CU": 7, "D": 6, "J": 0, "O": 0
+}
+# Estimated number of times the bytes of the state are read or written by each operation,
+# a diagonal gate only changing the half of the state where its qbit is 1
+STATE_PASSES = {
+    "H": 2, "U": 2, "X": 2, "Y": 2, "P": 1, "Z": 1,
+    "CNOT": 1, "CZ": 0.5, "CP": 0.5, "CU": 1, "D": 2, "J": 0, "O": 0
+}
+AMPLITUDE_BYTES = {"single": 8, "double": 16}
+
+
+def totals():
+    """
+    :return: empty dictionary of the totals recorded for a group of operations
+    """
+    return {"count": 0, "time": 0., "bytes": 0, "flops": 0}
+
+
+class Profiler(object):
+    """
+    Record the wall time, and estimate the bytes of state touched and floating point operations, of each operation
+    applied to a register, grouped by operation, by qbit and by the number of Repeat operations it is nested in.
+    Profile a register by setting its profiler, which then runs the operations given to execute_operations
+        register.profiler = Profiler()
+        register.execute_operations(operations)
+        register.profiler.report()
+    Without a profiler registers only check that it is not set each time execute_operations is called.
+    The bytes and floating point operations are only estimated for registers that hold amplitudes, and are left
+    out of the report of the mps and stabilizer registers.
+    """
+
+    def __init__(self):
+        self.level = 0  # number of Repeat operations the current operation is nested in
+        self.total = totals()
+        self.ops = {}
+        self.qbits = {}
+        self.levels = {}
+        self.counting_time = 0.
+        self.estimated = True  # every operation recorded was applied to amplitudes so has estimates
+
+    def execute_operations(self, register, operations):
+        """
+        Perform list of operations on register timing each one
+        :param register: register to apply the operations to
+        :param operations: list of operations in the same format as Register.execute_operations
+        :return:
+        """
+        for operation in operations:
+            op = register.op_table[operation['op']]
+            if 'args' in operation:
+                args = operation['args']
+            else:
+                args = {}
+            if operation['op'] == 'Repeat':
+                self.level += 1
+                try:
+                    op(register, **args)
+                finally:
+                    self.level -= 1
+                continue
+            start = time.perf_counter()
+            op(register, **args)
+            self.record(register, operation['op'], args, time.perf_counter() - start)
+
+    def record(self, register, name, args, elapsed):
+        """
+        Add an operation to the totals
+        :param register: register the operation was applied to
+        :param name: name of the operation, for example H
+        :param args: arguments of the operation
+        :param elapsed: wall time of the operation in seconds
+        :return:
+        """
+        if register.holds_amplitudes:
+            state_bytes = register.nbytes
+            amplitudes = state_bytes // AMPLITUDE_BYTES[register.precision]
+            num_bytes = int(STATE_PASSES.get(name, 1) * state_bytes)
+            flops = int(FLOPS_PER_AMPLITUDE.get(name, 0) * amplitudes)
+        else:
+            self.estimated = False
+            num_bytes, flops = 0, 0
+        groups = [self.total, self.ops.setdefault(name, totals()), self.levels.setdefault(str(self.level), totals())]
+        qbit = args['qbit'] if 'qbit' in args else args['target'] if 'target' in args else None
+        if qbit is not None:
+            groups.append(self.qbits.setdefault(str(qbit), totals()))
+        for group in groups:
+            group["count"] += 1
+            group["time"] += elapsed
+            group["bytes"] += num_bytes
+            group["flops"] += flops
+
+    def counting_states(self, register, qbits=None):
+        """
+        Call counting_states of register recording its wall time
+        :param register: register to measure
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: result of register.counting_states(qbits)
+        """
+        start = time.perf_counter()
+        states = register.counting_states(qbits)
+        self.counting_time += time.perf_counter() - start
+        return states
+
+    def report(self):
+        """
+        :return: dictionary of the totals for all operations, for each operation, for each qbit, for each
+            number of nested Repeat operations and the time taken by counting_states, in seconds
+        """
+        return {
+            "total": self.group_report(self.total),
+            "ops": {name: self.group_report(group) for name, group in self.ops.items()},
+            "qbits": {qbit: self.group_report(group) for qbit, group in self.qbits.items()},
+            "levels": {level: self.group_report(group) for level, group in self.levels.items()},
+            "counting_states": {"time": self.counting_time}
+        }
+
+    def group_report(self, group):
+        """
+        :param group: totals recorded for a group of operations
+        :return: copy of the totals, without the bytes and flops unless they were estimated
+        """
+        return {key: value for key, value in group.items() if self.estimated or key not in ("bytes", "flops")}
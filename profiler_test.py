@@ -0,0 +1,41 @@
+from unittest import main
+
+from mock_extension import MockExtension
+from mps import MPSRegister
+from profiler import Profiler
+from register import Register
+from register import SparseRegister
+from stabilizer import StabilizerRegister
+
+
+class TestProfiler(MockExtension):
+
+    def test_profiles_every_register(self):
+        # A profiler set on any register records the operations it applies, nested Repeats at the next level
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'Repeat', "args": {"count": 2, "operations": [
+                {"op": 'Repeat', "args": {"count": 2, "operations": [
+                    {"op": 'CNOT', "args": {"control": 1, "target": 2}}
+                ]}}
+            ]}}
+        ]
+        # Two of the 64 states of the sparse register are nonzero, so it stays sparse
+        sparse = SparseRegister(6, 0)
+        sparse.unit_vector = [1.0] + [0] * 63
+        for register in [Register(3, 0), MPSRegister(3, 0), StabilizerRegister(3, 0), sparse]:
+            register.profiler = Profiler()
+            register.execute_operations(operations)
+            report = register.profiler.report()
+            self.assertEqualDictionaryWrapper({level: group["count"] for level, group in report["levels"].items()},
+                                              {"0": 1, "2": 4}, "Incorrect operations at each level")
+            self.assertEqualDictionaryWrapper({qbit: group["count"] for qbit, group in report["qbits"].items()},
+                                              {"1": 1, "2": 4}, "Incorrect operations on each qbit")
+            self.assertTrue(report["total"]["time"] > 0, "Operations not timed")
+            # Only a dense state vector has estimates of the bytes and floating point operations of its gates
+            self.assertEqualWrapper("flops" in report["total"], type(register) is Register,
+                                    "Incorrect estimates for " + type(register).__name__)
+
+
+if __name__ == '__main__':
+    main()
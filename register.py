@@ -1,60 +1,510 @@
-import cmath
-import math
-import random
 import copy
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
 
+from cache import LRUCache
+from cache import canonical_key
+from circuit import SWEEP_ARGS
+from circuit import fuse_gates
+from circuit import is_monomial
+from circuit import optimise
+from circuit import qbit_diagonal
+from encoding import VECTOR_ENCODINGS
+from encoding import decode_vector
+from encoding import encode_vector
+from exact import check_exact_size
+from exact import top_states
+from gates import H
+from gates import I
+from gates import ROOT2RECIPRICOL
+from gates import X
+from gates import Y
+from gates import Z
+from gates import empty
+from gates import gates
+from gates import phase_matrix
+from mps import DEFAULT_BOND_DIMENSION
+from mps import MPSRegister
+from observables import parity
+from observables import parse_pauli
+from observables import pauli_expectation
+from observables import pauli_masks
+from profiler import Profiler
+from sparse import controlled_transform
+from sparse import diagonal_factors
+from sparse import from_dense
+from sparse import lookup
+from sparse import prune
+from sparse import to_dense
+from sparse import transform_qbit
+from stabilizer import CLIFFORD_TOLERANCE
+from stabilizer import StabilizerRegister
+from stabilizer import basis_state
+from stabilizer import is_clifford
+
 DEFAULT_QBITS = 3
 DEFAULT_MEASURES = 100
-ROOT2RECIPRICOL = 1 / math.sqrt(2)
-I = numpy.identity(2, complex)
-empty = numpy.zeros((2, 2), complex)
-H = ROOT2RECIPRICOL * numpy.array([[1, 1],
-                                   [1, -1]], complex)
-X = numpy.array([[0, 1],
-                 [1, 0]], complex)
-Y = numpy.array([[0, complex(0, -1)],
-                 [complex(0, 1), 0]], complex)
-Z = numpy.array([[1, 0],
-                 [0, -1]], complex)
-gates = {"H": H, "X": X, "Y": Y, "Z": Z}
+UNITARY_CACHE_BYTES = 256 * 2 ** 20
+DEFAULT_THREADS = os.cpu_count() or 1
+PARALLEL_MIN_STATES = 2 ** 16  # smallest register whose gates are split between threads
+DEFAULT_BLOCK_STATES = 2 ** 20  # states read and written at once by a memory mapped register
+DEFAULT_SPARSE_FILL = 1. / 16  # fraction of nonzero states above which a sparse register is made dense
+MAX_SPARSE_QBITS = 62  # largest sparse register whose state indices fit in 64 bit integers
+STATE_VECTOR_MAX_CLIFFORD_QBITS = 24  # Clifford programs of more qbits default to the stabilizer backend
+BACKENDS = {None, "dense", "sparse", "stabilizer", "mps"}
+INITIAL_STATES = ("uniform", "ghz")  # named initial states, besides a basis state given as {"basis": index}
+PRECISIONS = {"single": numpy.complex64, "double": numpy.complex128}  # precision -> dtype of the state
+
+
+def physical_memory():
+    """
+    :return: bytes of physical memory, or None if it is not known
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+DEFAULT_MEMORY_BUDGET = (physical_memory() or 2 ** 33) // 2  # largest state held in memory
+
+
+def marginal(probabilities, num_qbits, qbits):
+    """
+    Sum the probabilities over the qbits that are not measured by reshaping them so that each measured qbit,
+    and each run of neighbouring qbits that are not measured, is an axis
+    :param probabilities: numpy array of the probability of each state, or for a batch one row for each state vector
+    :param num_qbits: number of qbits in the register
+    :param qbits: list of the qbits to measure, start AT 1
+    :return: numpy array of the probability of each value of qbits, qbits[0] the most significant bit
+    """
+    shape = list(probabilities.shape[:-1])
+    batch_axes = list(range(len(shape)))
+    summed = []
+    for qbit in range(1, num_qbits + 1):
+        if qbit in qbits:
+            shape.append(2)
+        elif summed and summed[-1] == len(shape) - 1:
+            shape[-1] *= 2
+        else:
+            summed.append(len(shape))
+            shape.append(2)
+    measured = probabilities.reshape(shape).sum(axis=tuple(summed), dtype=float)
+    # The measured axes are in order of qbit so are moved to the order of qbits
+    ordered = sorted(qbits)
+    measured = measured.transpose(batch_axes + [len(batch_axes) + ordered.index(qbit) for qbit in qbits])
+    return measured.reshape(probabilities.shape[:-1] + (-1,))
+
+
+def qbit_view(state, num_qbits, qbit):
+    """
+    View state vector so that the axis of length 2 selects the value of qbit
+    :param state: state vector of length 2^num_qbits, or array of state vectors in the last axis
+    :param num_qbits: number of qbits in the state
+    :param qbit:start AT 1, qbit 1 is the most significant bit of the state index
+    :return: view of state with shape (..., 2^(qbit-1), 2, 2^(num_qbits-qbit))
+    """
+    return state.reshape(state.shape[:-1] + (2 ** (qbit - 1), 2, 2 ** (num_qbits - qbit)))
+
+
+def transform_slices(zero, one, T, out_zero=None, out_one=None):
+    """
+    Apply 2x2 matrix T to the pair of amplitude slices where a qbit is 0 and where it is 1
+    :param zero: view of the amplitudes where the qbit is 0
+    :param one: view of the amplitudes where the qbit is 1
+    :param T: 2x2 matrix of gate operation, or for a batch of states an array of one matrix for each state
+    :param out_zero: optional view to write the result for zero to, when given with out_one no memory is
+        allocated and the contents of zero are overwritten
+    :param out_one: optional view to write the result for one to
+    :return: True if the result was written to out_zero and out_one, False if it was applied in place
+    """
+    # Keep the arithmetic in the precision of the state
+    T = numpy.asarray(T, zero.dtype)
+    if T.ndim > 2:
+        # Broadcast the matrix of each state over the slices of that state
+        T = T.reshape(T.shape[:-2] + (1,) * (zero.ndim - T.ndim + 2) + (2, 2))
+    anti_diagonal = not T[..., 0, 0].any() and not T[..., 1, 1].any()
+    if not T[..., 0, 1].any() and not T[..., 1, 0].any():
+        # Diagonal gate is a phase change of each slice
+        if (T[..., 0, 0] != 1).any():
+            zero *= T[..., 0, 0]
+        if (T[..., 1, 1] != 1).any():
+            one *= T[..., 1, 1]
+        return False
+    if out_zero is None:
+        if anti_diagonal:
+            # Anti-diagonal gate swaps the slices
+            new_zero = T[..., 0, 1] * one
+            numpy.multiply(zero, T[..., 1, 0], out=one)
+        else:
+            new_zero = T[..., 0, 0] * zero + T[..., 0, 1] * one
+            one[...] = T[..., 1, 0] * zero + T[..., 1, 1] * one
+        zero[...] = new_zero
+        return False
+    if anti_diagonal:
+        numpy.multiply(one, T[..., 0, 1], out=out_zero)
+        numpy.multiply(zero, T[..., 1, 0], out=out_one)
+        return True
+    numpy.multiply(zero, T[..., 0, 0], out=out_zero)
+    numpy.multiply(one, T[..., 0, 1], out=out_one)
+    numpy.add(out_zero, out_one, out=out_zero)
+    numpy.multiply(one, T[..., 1, 1], out=out_one)
+    # The input is no longer needed so reuse its zero slice as the temporary
+    numpy.multiply(zero, T[..., 1, 0], out=zero)
+    numpy.add(out_one, zero, out=out_one)
+    return True
+
+
+def apply_gate(state, num_qbits, qbit, T, out=None):
+    """
+    Apply 2x2 matrix T to qbit of state, in O(2^n) time and memory
+    :param state: state vector as complex numpy array
+    :param num_qbits: number of qbits in the state
+    :param qbit:start AT 1
+    :param T: 2x2 matrix of gate operation, or for a batch of states an array of one matrix for each state
+    :param out: optional buffer the same shape as state to write the result to,
+        when given no memory is allocated and the contents of state are overwritten
+    :return: array holding the result, state when applied in place otherwise out
+    """
+    view = qbit_view(state, num_qbits, qbit)
+    if out is None:
+        transform_slices(view[..., 0, :], view[..., 1, :], T)
+        return state
+    out_view = qbit_view(out, num_qbits, qbit)
+    if transform_slices(view[..., 0, :], view[..., 1, :], T, out_view[..., 0, :], out_view[..., 1, :]):
+        return out
+    return state
+
+
+def controlled_view(state, num_qbits, control, target):
+    """
+    View state vector so that the values of the control and target qbits each select an axis of length 2
+    :param state: state vector of length 2^num_qbits, or array of state vectors in the last axis
+    :param num_qbits: number of qbits in the state
+    :param control: control qbit, start AT 1
+    :param target: target qbit, start AT 1
+    :return: (view where the control is 1 and the target is 0, view where both the control and target are 1)
+    """
+    if control == target:
+        raise ValueError("Control and target are both qbit {}".format(control))
+    low, high = sorted((control, target))
+    view = state.reshape(state.shape[:-1] + (2 ** (low - 1), 2, 2 ** (high - low - 1), 2, 2 ** (num_qbits - high)))
+    if control < target:
+        return view[..., 1, :, 0, :], view[..., 1, :, 1, :]
+    return view[..., 0, :, 1, :], view[..., 1, :, 1, :]
+
+
+def apply_controlled_gate(state, num_qbits, control, target, T):
+    """
+    Apply 2x2 matrix T to the target qbit of state in place, only where the control qbit is 1
+    :param state: state vector as complex numpy array
+    :param num_qbits: number of qbits in the state
+    :param control: control qbit, start AT 1
+    :param target: target qbit, start AT 1
+    :param T: 2x2 matrix of gate operation, or for a batch of states an array of one matrix for each state
+    :return:
+    """
+    zero, one = controlled_view(state, num_qbits, control, target)
+    transform_slices(zero, one, T)
+
+
+thread_pools = {}
+
+
+def thread_pool(num_threads):
+    """
+    :param num_threads: number of threads in the pool
+    :return: pool of threads shared by every register using that number of threads
+    """
+    if num_threads not in thread_pools:
+        thread_pools[num_threads] = ThreadPoolExecutor(num_threads)
+    return thread_pools[num_threads]
+
+
+def split_views(views, num_chunks, num_axes):
+    """
+    Split views into chunks along the longest of their last axes
+    :param views: list of numpy arrays whose last num_axes axes have the same shape
+    :param num_chunks: number of chunks to split into
+    :param num_axes: number of last axes that may be split, the axes before them hold a batch of states
+    :return: list of chunks, each a list of one part of each view
+    """
+    shape = views[0].shape[-num_axes:]
+    axis = max(range(num_axes), key=lambda i: shape[i])
+    bounds = numpy.linspace(0, shape[axis], min(num_chunks, shape[axis]) + 1).astype(int)
+    chunks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        index = (Ellipsis, slice(start, stop)) + (slice(None),) * (num_axes - axis - 1)
+        chunks.append([view[index] for view in views])
+    return chunks
+
+
+def parallel_transform_slices(num_threads, num_axes, zero, one, T, out_zero=None, out_one=None):
+    """
+    Apply transform_slices to independent chunks of the amplitudes on a pool of threads.
+    Numpy releases the GIL for arithmetic on large arrays so the chunks run on separate cores.
+    :param num_threads: number of threads to use
+    :param num_axes: number of last axes of the views that hold amplitudes of a single state
+    :return: same as transform_slices
+    """
+    views = [zero, one] if out_zero is None else [zero, one, out_zero, out_one]
+    futures = [thread_pool(num_threads).submit(transform_slices, *(chunk[:2] + [T] + chunk[2:]))
+               for chunk in split_views(views, num_threads, num_axes)]
+    return [future.result() for future in futures][0]
+
+
+def diagonal_views(state, num_qbits, qbits, diagonal):
+    """
+    View state so that each of qbits selects an axis of length 2, and diagonal so that it broadcasts over the
+    axes of the qbits it is not on
+    :param state: state vector of length 2^num_qbits, or array of state vectors in the last axis
+    :param num_qbits: number of qbits in the state
+    :param qbits: sorted list of qbits, start AT 1
+    :param diagonal: numpy array of length 2^len(qbits) as built by qbit_diagonal
+    :return: view of state with shape (..., 2^(qbits[0]-1), 2, ..., 2, 2^(num_qbits-qbits[-1])) and view of diagonal
+        with shape (1, 2, ..., 2, 1) in the precision of the state
+    """
+    shape = []
+    previous = 0
+    for qbit in qbits:
+        shape += [2 ** (qbit - previous - 1), 2]
+        previous = qbit
+    shape.append(2 ** (num_qbits - previous))
+    diagonal_shape = [1 if axis % 2 == 0 else 2 for axis in range(len(shape))]
+    return state.reshape(state.shape[:-1] + tuple(shape)), \
+        diagonal.astype(state.dtype, copy=False).reshape(diagonal_shape)
+
+
+def state_array(vector, shape):
+    """
+    :param vector: state vector as a list or numpy array, or batch of state vectors
+    :param shape: shape of the state of the register, (2^n,) or (batch size, 2^n) which a single state vector
+        is copied to every row of
+    :return: vector as a numpy array
+    """
+    vector = numpy.asarray(vector)
+    if vector.shape not in (tuple(shape), tuple(shape[-1:])):
+        raise ValueError("Vector of shape {} does not match a state of shape {}".format(vector.shape, tuple(shape)))
+    return vector
+
+
+def precision_dtype(precision):
+    """
+    :param precision: "single" or "double"
+    :return: complex numpy dtype of a state held in that precision
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("Precision {} is not one of {}".format(precision, ", ".join(sorted(PRECISIONS))))
+    return PRECISIONS[precision]
 
 
 class Register(object):
-    def __init__(self, num_qbits=DEFAULT_QBITS, num_measures=DEFAULT_MEASURES):
+    in_memory = True  # the whole state is held in memory so can be returned
+    holds_amplitudes = True  # the state is amplitudes of the basis states, whose work the profiler estimates
+    profiler = None  # Profiler recording the operations applied by execute_operations
+    def __init__(self, num_qbits=DEFAULT_QBITS, num_measures=DEFAULT_MEASURES, double_buffer=False, batch_size=None,
+                 seed=None, num_threads=1, precision="double"):
+        """
+        :param num_qbits: number of qbits in the register
+        :param num_measures: number of measurements taken by counting_states
+        :param double_buffer: keep a second state buffer so that gates write into it rather than allocating
+        :param batch_size: when given the register holds batch_size state vectors as the rows of
+            unit_vector and every gate is applied to all of them at once
+        :param seed: seed for the random measurements, so that measurements can be repeated
+        :param num_threads: number of threads to split the amplitudes of registers of at least
+            PARALLEL_MIN_STATES states between when applying gates
+        :param precision: "double" to hold the state as complex128 or "single" to hold it as complex64,
+            which halves the memory and bandwidth used by each gate
+        """
+        self.init_fields(num_qbits, num_measures, seed, num_threads, precision, batch_size)
+        shape = (self.number_of_states,) if batch_size is None else (batch_size, self.number_of_states)
+        self._unit_vector = numpy.zeros(shape, precision_dtype(precision))
+        self.scratch_vector = numpy.empty_like(self._unit_vector) if double_buffer else None
+
+    def init_fields(self, num_qbits, num_measures, seed, num_threads, precision, batch_size=None):
+        """
+        Set the fields every kind of register has, apart from the state and scratch vector
+        :param num_qbits: number of qbits in the register
+        :param num_measures: number of measurements taken by counting_states
+        :param seed: seed for the random measurements
+        :param num_threads: number of threads, used only by registers of at least PARALLEL_MIN_STATES states
+        :param precision: "double" or "single"
+        :param batch_size: number of state vectors held, or None for a single state vector
+        """
         self.num_qbits = num_qbits  # number of qbits
         self.number_of_states = 2 ** self.num_qbits
-        self.unit_vector = [0j] * self.number_of_states
+        self.batch_size = batch_size
+        self.precision = precision
         self.numMeasures = num_measures
-        self.J = numpy.identity(self.number_of_states)
-        self.J[0, 0] = -1.
+        self.random = numpy.random.RandomState(seed)
+        self.num_threads = num_threads if self.number_of_states >= PARALLEL_MIN_STATES else 1
+        self.initial_norm = None  # norm of the initial state, recorded by run to report the norm drift
+
+    @property
+    def unit_vector(self):
+        """
+        State of the register as a contiguous complex numpy array
+        """
+        return self._unit_vector
+
+    @unit_vector.setter
+    def unit_vector(self, vector):
+        # Copy into the existing buffer rather than replacing it
+        self._unit_vector[...] = state_array(vector, self._unit_vector.shape)
+
+    def set_basis_states(self, states, amplitudes):
+        """
+        Set the register to a sum of basis states, every other state being 0
+        :param states: list of state indices
+        :param amplitudes: list of the amplitude of each state
+        :return:
+        """
+        self._unit_vector[...] = 0
+        self._unit_vector[..., numpy.asarray(states, numpy.int64)] = amplitudes
+
+    def set_uniform_state(self):
+        """
+        Set the register to the equal superposition of every state
+        :return:
+        """
+        self._unit_vector[...] = 1. / numpy.sqrt(self.number_of_states)
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes holding the state of the register
+        """
+        return self._unit_vector.nbytes
 
     def vector_as_string(self):
         return "[" + ", ".join(
             str(round(val.real, 2)) + (format(round(val.imag, 2), "+") + "j" if val.imag * val.imag > 0.0001 else "")
             for val in self.unit_vector) + "]"
 
+    def state_label(self, state, num_qbits=None):
+        """
+        :param state: index of state
+        :param num_qbits: number of qbits in the label, defaults to the number of qbits of the register
+        :return: ket label of state, for example |011>
+        """
+        return "|" + format(state, "0" + str(self.num_qbits if num_qbits is None else num_qbits) + "b") + ">"
+
+    def probabilities(self):
+        """
+        :return: numpy array of probability of measuring each state
+        """
+        return (self.unit_vector.conjugate() * self.unit_vector).real
+
+    def norm(self):
+        """
+        :return: norm of the state accumulated in double precision, or for a batch an array of the norm of each state
+        """
+        return numpy.sqrt(self.probabilities().sum(axis=-1, dtype=float))
+
+    def sample(self, num_samples, probabilities=None):
+        """
+        Draw all measurements in one pass using cumulative probability and binary search
+        :param num_samples: number of measurements to take
+        :param probabilities: probability of each state, defaults to the probabilities of the register
+        :return: numpy array of the measured state indices, or indices into probabilities when given
+        """
+        cumulative = numpy.cumsum(self.probabilities() if probabilities is None else probabilities, dtype=float)
+        samples = numpy.searchsorted(cumulative, self.random.random_sample(num_samples), side='right')
+        # Rounding can leave the total probability just below a random value, treat as the last state
+        return numpy.minimum(samples, len(cumulative) - 1)
+
     def measure(self):
-        q = 0
-        measure = random.random()
-        for i in range(self.number_of_states):
-            q += (self.unit_vector[i].conjugate() * self.unit_vector[i]).real
-            if measure < q:
-                break
-        return "|" + format(i, "0" + str(self.num_qbits) + "b") + ">"
-
-    def counting_states(self):
-        state_count = {}
-        for i in range(self.numMeasures):
-            m = self.measure()
-            if m in state_count:
-                state_count[m] += 1.0
-            else:
-                state_count[m] = 1.0
-        for state in state_count.keys():
-            state_count[state] /= self.numMeasures
-        return state_count
+        return self.state_label(int(self.sample(1)[0]))
+
+    def counting_states(self, qbits=None):
+        """
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the fraction of measurements that found each state, or each value of qbits,
+            or for a batch a list of dictionaries one for each state vector
+        """
+        if qbits is not None:
+            states, probabilities = self.marginal_states(qbits)
+            if self.batch_size is not None:
+                return [self.count_marginal_samples(states, point_probabilities, len(qbits))
+                        for point_probabilities in probabilities]
+            return self.count_marginal_samples(states, probabilities, len(qbits))
+        if self.batch_size is not None:
+            return [self.count_samples(probabilities) for probabilities in self.probabilities()]
+        return self.count_samples(self.probabilities())
+
+    def marginal_states(self, qbits):
+        """
+        :param qbits: list of the qbits to measure
+        :return: numpy array of values of qbits, qbits[0] the most significant bit, and numpy array of the
+            probability of measuring each value, or for a batch one row of probabilities for each state vector
+        """
+        return numpy.arange(2 ** len(qbits)), marginal(self.probabilities(), self.num_qbits, qbits)
+
+    def count_marginal_samples(self, states, probabilities, num_qbits):
+        """
+        :param states: numpy array of values of the measured qbits
+        :param probabilities: probability of each value
+        :param num_qbits: number of measured qbits
+        :return: dictionary of the fraction of measurements that found each value
+        """
+        if self.numMeasures <= 0:
+            return {}
+        found, counts = numpy.unique(Register.sample(self, self.numMeasures, probabilities), return_counts=True)
+        return {self.state_label(int(states[index]), num_qbits): float(count) / self.numMeasures
+                for index, count in zip(found, counts)}
+
+    def count_samples(self, probabilities):
+        """
+        :param probabilities: probability of each state
+        :return: dictionary of the fraction of measurements that found each state
+        """
+        if self.numMeasures <= 0:
+            return {}
+        states, counts = numpy.unique(self.sample(self.numMeasures, probabilities), return_counts=True)
+        return {self.state_label(int(state)): float(count) / self.numMeasures
+                for state, count in zip(states, counts)}
+
+    def exact_states(self, top_k=None, min_probability=0., qbits=None):
+        """
+        :param top_k: largest number of states to return
+        :param min_probability: smallest probability of a state to return
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the probability of each of the most likely states, or values of qbits,
+            in decreasing order, or for a batch a list of dictionaries one for each state vector
+        """
+        if qbits is None:
+            states, probabilities, num_qbits = numpy.arange(self.number_of_states), self.probabilities(), None
+        else:
+            (states, probabilities), num_qbits = self.marginal_states(qbits), len(qbits)
+        check_exact_size(len(states), top_k, min_probability)
+        if self.batch_size is not None:
+            return [self.label_states(states, point_probabilities, top_k, min_probability, num_qbits)
+                    for point_probabilities in probabilities]
+        return self.label_states(states, probabilities, top_k, min_probability, num_qbits)
+
+    def expectation(self, pauli):
+        """
+        :param pauli: Pauli string with one of I, X, Y or Z for every qbit, qbit 1 first
+        :return: expectation value of the Pauli string, or for a batch a numpy array of the expectation value
+            for each state vector
+        """
+        return pauli_expectation(self.unit_vector, pauli)
+
+    def label_states(self, states, probabilities, top_k=None, min_probability=0., num_qbits=None):
+        """
+        :param states: numpy array of state indices
+        :param probabilities: numpy array of the probability of each state
+        :param top_k: largest number of states to return
+        :param min_probability: smallest probability of a state to return
+        :param num_qbits: number of qbits in each label, defaults to the number of qbits of the register
+        :return: dictionary of the probability of each of the most likely states in decreasing order
+        """
+        return {self.state_label(int(states[index]), num_qbits): float(probabilities[index])
+                for index in top_states(probabilities, top_k, min_probability)}
 
     def states_as_string(self):
         states = self.counting_states()
@@ -84,9 +534,7 @@ class Register(object):
         :param theta: user defines theta in radians
         :return:
         """
-        R = numpy.array([[1, 0],
-                         [0, cmath.exp(1j * complex(theta))]])
-        self.gate_function(qbit, R)
+        self.gate_function(qbit, phase_matrix(theta))
 
     def pauli_x_gate(self, qbit):
         """
@@ -109,25 +557,163 @@ class Register(object):
         """
         self.gate_function(qbit, Z)
 
+    def unitary_gate(self, qbit, matrix):
+        """
+        :param qbit:start AT 1
+        :param matrix: 2x2 unitary matrix of gate as nested lists or numpy array
+        :return:
+        """
+        self.gate_function(qbit, numpy.asarray(matrix, complex))
+
     def gate_function(self, qbit, T):
-        exec_sequence = [I] * self.num_qbits
-        exec_sequence[qbit - 1] = T
-        gate = exec_sequence[0]
-        for m in exec_sequence[1:]:
-            gate = numpy.kron(gate, m)
+        """
+        Apply a single qbit gate directly to the pair of amplitude slices for the qbit,
+        rather than building the 2^n x 2^n Kronecker product of the gate with identities
+        :param qbit:start AT 1
+        :param T: 2x2 matrix of gate operation
+        :return:
+        """
+        if self.num_threads > 1:
+            self.parallel_gate_function(qbit, T)
+        elif self.scratch_vector is None:
+            apply_gate(self._unit_vector, self.num_qbits, qbit, T)
+        elif apply_gate(self._unit_vector, self.num_qbits, qbit, T, self.scratch_vector) is self.scratch_vector:
+            self._unit_vector, self.scratch_vector = self.scratch_vector, self._unit_vector
+
+    def parallel_gate_function(self, qbit, T):
+        """
+        Apply a single qbit gate with the amplitudes split into chunks applied by separate threads
+        :param qbit:start AT 1
+        :param T: 2x2 matrix of gate operation
+        :return:
+        """
+        view = qbit_view(self._unit_vector, self.num_qbits, qbit)
+        if self.scratch_vector is None:
+            parallel_transform_slices(self.num_threads, 2, view[..., 0, :], view[..., 1, :], T)
+            return
+        out_view = qbit_view(self.scratch_vector, self.num_qbits, qbit)
+        if parallel_transform_slices(self.num_threads, 2, view[..., 0, :], view[..., 1, :], T,
+                                     out_view[..., 0, :], out_view[..., 1, :]):
+            self._unit_vector, self.scratch_vector = self.scratch_vector, self._unit_vector
+
+    def controlled_gate_function(self, control, target, T):
+        """
+        Apply a gate to the target qbit by updating only the amplitudes where the control qbit is 1,
+        rather than building the 2^n x 2^n controlled operator
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param T: 2x2 matrix of gate operation
+        :return:
+        """
+        if self.num_threads > 1:
+            zero, one = controlled_view(self._unit_vector, self.num_qbits, control, target)
+            parallel_transform_slices(self.num_threads, 3, zero, one, T)
+        else:
+            apply_controlled_gate(self._unit_vector, self.num_qbits, control, target, T)
+
+    def controlled_not_gate(self, control, target):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :return:
+        """
+        self.controlled_gate_function(control, target, X)
+
+    def controlled_z_gate(self, control, target):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :return:
+        """
+        self.controlled_gate_function(control, target, Z)
 
-        self.unit_vector = numpy.dot(gate, self.unit_vector)
-        self.unit_vector = self.unit_vector.tolist()
+    def controlled_phase_gate(self, control, target, theta):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param theta: user defines theta in radians
+        :return:
+        """
+        self.controlled_gate_function(control, target, phase_matrix(theta))
+
+    def controlled_unitary_gate(self, control, target, matrix):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param matrix: 2x2 unitary matrix of gate as nested lists or numpy array
+        :return:
+        """
+        self.controlled_gate_function(control, target, numpy.asarray(matrix, complex))
+
+    def phase_flip(self, state, factor=-1.):
+        """
+        Apply diagonal operation that only changes the phase of a single state
+        :param state: index of state to change, or for a batch an array of one index for each state vector
+        :param factor: phase factor to multiply the state amplitude by
+        :return:
+        """
+        if numpy.ndim(state) > 0:
+            self.unit_vector[numpy.arange(len(state)), state] *= factor
+        else:
+            self.unit_vector[..., state] *= factor
+
+    def diagonal_gate(self, factors=(), flips=(), controlled=(), qbits=None, diagonal=None):
+        """
+        Apply a diagonal operation with a single multiply of the state by the product of its factors over the
+        qbits they are on, broadcast over the other qbits, then change the phase of each flipped state
+        :param factors: list of [qbit, [factor when qbit is 0, factor when qbit is 1]]
+        :param flips: list of [state, factor to multiply the state by]
+        :param controlled: list of [control, target, [factor when target is 0, factor when target is 1]]
+            applied only where the control qbit is 1
+        :param qbits: optional qbits of the factors as returned by qbit_diagonal, given with diagonal by
+            merge_diagonals so that the product is built once rather than each time the operation is applied
+        :param diagonal: optional product of the factors as returned by qbit_diagonal
+        :return:
+        """
+        if diagonal is None:
+            qbits, diagonal = qbit_diagonal(factors, controlled)
+        if qbits:
+            view, diagonal = diagonal_views(self._unit_vector, self.num_qbits, qbits, diagonal)
+            if self.num_threads > 1:
+                # Split the state along the longest of the axes of the qbits the diagonal is not on
+                batch_axes = view.ndim - diagonal.ndim
+                axis = max(range(batch_axes, view.ndim, 2), key=lambda axis: view.shape[axis])
+                futures = [thread_pool(self.num_threads).submit(numpy.multiply, part, diagonal, out=part)
+                           for part in numpy.array_split(view, self.num_threads, axis)]
+                for future in futures:
+                    future.result()
+            else:
+                view *= diagonal
+        for state, factor in flips:
+            self.phase_flip(state, factor)
 
     def j_gate(self):
-        self.unit_vector = numpy.dot(self.J, self.unit_vector)
-        self.unit_vector = self.unit_vector.tolist()
+        """
+        Apply J = I - 2|0><0| by flipping the sign of the |0> amplitude
+        :return:
+        """
+        self.phase_flip(0)
 
     def oracle(self, desired_state):
-        o = numpy.identity(self.number_of_states)
-        o[desired_state, desired_state] = -1.
-        self.unit_vector = numpy.dot(o, self.unit_vector)
-        self.unit_vector = self.unit_vector.tolist()
+        """
+        Apply oracle O = I - 2|desired_state><desired_state| by flipping the sign of the desired state amplitude
+        :param desired_state: index of state to find
+        :return:
+        """
+        self.phase_flip(desired_state)
+
+    def apply_unitary(self, U):
+        """
+        Apply a unitary for the whole register, for example one created by compile_unitary
+        :param U: 2^n x 2^n matrix
+        :return:
+        """
+        U = numpy.asarray(U, self._unit_vector.dtype)
+        if self.scratch_vector is None:
+            self._unit_vector = numpy.dot(self._unit_vector, U.T)
+        else:
+            numpy.dot(self._unit_vector, U.T, out=self.scratch_vector)
+            self._unit_vector, self.scratch_vector = self.scratch_vector, self._unit_vector
 
     def repeat(self, count, operations):
         for i in range(count):
@@ -154,6 +740,9 @@ class Register(object):
               "states" : { "00100":50.0, "00001":50.0}
             }
         """
+        if self.profiler is not None:
+            self.profiler.execute_operations(self, operations)
+            return
         for operation in operations:
             op = self.op_table[operation['op']]
             if 'args' in operation:
@@ -168,19 +757,742 @@ class Register(object):
         'X': pauli_x_gate,
         'Y': pauli_y_gate,
         'Z': pauli_z_gate,
+        'U': unitary_gate,
+        'CNOT': controlled_not_gate,
+        'CZ': controlled_z_gate,
+        'CP': controlled_phase_gate,
+        'CU': controlled_unitary_gate,
+        'D': diagonal_gate,
         'O': oracle,
         'J': j_gate,
         'Repeat': repeat
     }
 
 
+class MappedRegister(Register):
+    """
+    Register whose state is held in a memory mapped file rather than in memory, for registers larger than memory.
+    Gates are applied to blocks of the state in order so each pass reads and writes the file sequentially.
+    Qbits that change within a block are applied to the block, while qbits that are the same across a block
+    are applied to the pair of blocks where the qbit is 0 and 1, reading both blocks in order.
+    """
+    in_memory = False
+
+    def __init__(self, num_qbits=DEFAULT_QBITS, num_measures=DEFAULT_MEASURES, seed=None,
+                 block_states=DEFAULT_BLOCK_STATES, directory=None, precision="double"):
+        """
+        :param num_qbits: number of qbits in the register
+        :param num_measures: number of measurements taken by counting_states
+        :param seed: seed for the random measurements, so that measurements can be repeated
+        :param block_states: number of states in each block read from the file, a power of 2
+        :param directory: directory for the file holding the state, defaults to the temporary directory
+        :param precision: "double" to hold the state as complex128 or "single" to hold it as complex64
+        """
+        self.init_fields(num_qbits, num_measures, seed, 1, precision)
+        self.scratch_vector = None
+        directory = tempfile.gettempdir() if directory is None else directory
+        num_bytes = numpy.dtype(precision_dtype(precision)).itemsize * self.number_of_states
+        free_bytes = shutil.disk_usage(directory).free
+        if num_bytes > free_bytes:
+            raise ValueError("Memory mapped register of {} qbits needs {} bytes, more than the {} bytes free in {}"
+                             .format(num_qbits, num_bytes, free_bytes, directory))
+        self.block_states = min(block_states, self.number_of_states)
+        self.block_qbits = self.block_states.bit_length() - 1
+        self.fixed_qbits = self.num_qbits - self.block_qbits  # qbits that are the same across a block
+        # The file is deleted when the register is
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self._unit_vector = numpy.memmap(self.file, precision_dtype(precision), 'w+', shape=(self.number_of_states,))
+
+    def bit(self, state, qbit):
+        """
+        :param state: index of state
+        :param qbit:start AT 1
+        :return: value of qbit in state
+        """
+        return (state >> (self.num_qbits - qbit)) & 1
+
+    def blocks(self):
+        """
+        :return: generator of (index of first state, view of block) for the blocks in order
+        """
+        for start in range(0, self.number_of_states, self.block_states):
+            yield start, self._unit_vector[start:start + self.block_states]
+
+    def block_pairs(self, qbit):
+        """
+        :param qbit: qbit that is the same across a block
+        :return: generator of (index of first state, view of block where qbit is 0, view of block where qbit is 1)
+        """
+        stride = 2 ** (self.num_qbits - qbit)
+        for segment in range(0, self.number_of_states, 2 * stride):
+            for start in range(segment, segment + stride, self.block_states):
+                yield (start, self._unit_vector[start:start + self.block_states],
+                       self._unit_vector[start + stride:start + stride + self.block_states])
+
+    def gate_function(self, qbit, T):
+        if qbit > self.fixed_qbits:
+            for start, block in self.blocks():
+                apply_gate(block, self.block_qbits, qbit - self.fixed_qbits, T)
+        else:
+            for start, zero, one in self.block_pairs(qbit):
+                transform_slices(zero, one, T)
+
+    def controlled_gate_function(self, control, target, T):
+        if control == target:
+            raise ValueError("Control and target are both qbit {}".format(control))
+        local_control = control - self.fixed_qbits
+        if target > self.fixed_qbits:
+            local_target = target - self.fixed_qbits
+            for start, block in self.blocks():
+                if local_control > 0:
+                    apply_controlled_gate(block, self.block_qbits, local_control, local_target, T)
+                elif self.bit(start, control):
+                    apply_gate(block, self.block_qbits, local_target, T)
+        else:
+            for start, zero, one in self.block_pairs(target):
+                if local_control > 0:
+                    transform_slices(qbit_view(zero, self.block_qbits, local_control)[..., 1, :],
+                                     qbit_view(one, self.block_qbits, local_control)[..., 1, :], T)
+                elif self.bit(start, control):
+                    transform_slices(zero, one, T)
+
+    def diagonal_gate(self, factors=(), flips=(), controlled=(), qbits=None, diagonal=None):
+        for start, block in self.blocks():
+            # Factors of qbits that are the same across the block are a single number for the block
+            scale = 1.
+            block_factors = []
+            block_controlled = []
+            for qbit, factor in factors:
+                if qbit > self.fixed_qbits:
+                    block_factors.append([qbit - self.fixed_qbits, factor])
+                else:
+                    scale *= factor[self.bit(start, qbit)]
+            for control, target, factor in controlled:
+                local_control = control - self.fixed_qbits
+                local_target = target - self.fixed_qbits
+                if local_control > 0 and local_target > 0:
+                    block_controlled.append([local_control, local_target, factor])
+                elif local_control > 0:
+                    block_factors.append([local_control, [1., factor[self.bit(start, target)]]])
+                elif self.bit(start, control) and local_target > 0:
+                    block_factors.append([local_target, factor])
+                elif self.bit(start, control):
+                    scale *= factor[self.bit(start, target)]
+            block_qbits, block_diagonal = qbit_diagonal(block_factors, block_controlled)
+            if block_qbits:
+                view, block_diagonal = diagonal_views(block, self.block_qbits, block_qbits, block_diagonal)
+                view *= scale * block_diagonal
+            elif scale != 1:
+                block *= scale
+        for state, factor in flips:
+            self.phase_flip(state, factor)
+
+    def norm(self):
+        return numpy.sqrt(sum((block.conjugate() * block).real.sum(dtype=float) for start, block in self.blocks()))
+
+    def apply_unitary(self, U):
+        raise ValueError("Memory mapped register of {} qbits cannot apply a unitary".format(self.num_qbits))
+
+    def sample(self, num_samples, probabilities=None):
+        """
+        Draw all measurements with two passes over the file, the first finding the probability of
+        each block and the second finding the measured states within the blocks that were measured
+        :param num_samples: number of measurements to take
+        :param probabilities: ignored, the probabilities are read from the file
+        :return: numpy array of the measured state indices in increasing order
+        """
+        block_cumulative = numpy.cumsum([numpy.vdot(block, block).real for start, block in self.blocks()], dtype=float)
+        measures = numpy.sort(self.random.random_sample(num_samples))
+        # Rounding can leave the total probability just below a random value, treat as the last block
+        block_indices = numpy.minimum(numpy.searchsorted(block_cumulative, measures, side='right'),
+                                      len(block_cumulative) - 1)
+        samples = numpy.empty(num_samples, int)
+        for index in numpy.unique(block_indices):
+            start = index * self.block_states
+            block = self._unit_vector[start:start + self.block_states]
+            cumulative = numpy.cumsum((block.conjugate() * block).real, dtype=float)
+            cumulative += block_cumulative[index - 1] if index > 0 else 0.
+            selected = block_indices == index
+            found = numpy.searchsorted(cumulative, measures[selected], side='right')
+            samples[selected] = start + numpy.minimum(found, self.block_states - 1)
+        return samples
+
+    def counting_states(self, qbits=None):
+        if qbits is not None:
+            return Register.counting_states(self, qbits)
+        return self.count_samples(None)
+
+    def marginal_states(self, qbits):
+        # Measured qbits that are the same across a block select where the marginal of the block is added
+        probabilities = numpy.zeros((2,) * len(qbits))
+        block_qbits = [qbit - self.fixed_qbits for qbit in qbits if qbit > self.fixed_qbits]
+        for start, block in self.blocks():
+            index = tuple(self.bit(start, qbit) if qbit <= self.fixed_qbits else slice(None) for qbit in qbits)
+            block_probabilities = marginal((block.conjugate() * block).real, self.block_qbits, block_qbits)
+            probabilities[index] += block_probabilities.reshape((2,) * len(block_qbits))
+        return numpy.arange(2 ** len(qbits)), probabilities.reshape(-1)
+
+    def exact_states(self, top_k=None, min_probability=0., qbits=None):
+        if qbits is not None:
+            return Register.exact_states(self, top_k, min_probability, qbits)
+        # The most likely states of each block are candidates for the most likely states of the register
+        check_exact_size(self.number_of_states, top_k, min_probability)
+        states, probabilities = [], []
+        for start, block in self.blocks():
+            block_probabilities = (block.conjugate() * block).real
+            selected = top_states(block_probabilities, top_k, min_probability)
+            states.append(start + selected)
+            probabilities.append(block_probabilities[selected])
+        return self.label_states(numpy.concatenate(states), numpy.concatenate(probabilities), top_k, min_probability)
+
+    def expectation(self, pauli):
+        # Each block is read with the block it is flipped to
+        return pauli_expectation(self._unit_vector, pauli, self.block_states)
+
+    op_table = dict(Register.op_table, D=diagonal_gate)
+
+
+class SparseRegister(Register):
+    """
+    Register whose state is held as sorted arrays of the indices and amplitudes of its nonzero states,
+    so permutation and diagonal gates take time proportional to the number of nonzero states rather than 2^n.
+    Once more than the fill fraction of the states are nonzero, for example after Hadamard gates spread
+    the state, the register changes to a dense state vector if that fits in the memory budget.
+    """
+
+    def __init__(self, num_qbits=DEFAULT_QBITS, num_measures=DEFAULT_MEASURES, seed=None, num_threads=1,
+                 precision="double", fill=DEFAULT_SPARSE_FILL, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        :param num_qbits: number of qbits in the register, at most MAX_SPARSE_QBITS
+        :param num_measures: number of measurements taken by counting_states
+        :param seed: seed for the random measurements, so that measurements can be repeated
+        :param num_threads: number of threads used once the state is dense
+        :param precision: "double" to hold the amplitudes as complex128 or "single" to hold them as complex64
+        :param fill: fraction of the states that are nonzero above which the state is made dense
+        :param memory_budget: largest number of bytes of dense state, or of the nonzero states while sparse
+        """
+        if num_qbits > MAX_SPARSE_QBITS:
+            raise ValueError("Sparse register of {} qbits is larger than {} qbits".format(num_qbits, MAX_SPARSE_QBITS))
+        self.init_fields(num_qbits, num_measures, seed, num_threads, precision)
+        self.scratch_vector = None
+        self.dtype = precision_dtype(precision)
+        self.fill = fill
+        self.memory_budget = memory_budget
+        self.indices = numpy.zeros(0, numpy.int64)
+        self.values = numpy.zeros(0, self.dtype)
+        self._unit_vector = None  # dense state once the register is no longer sparse
+
+    @property
+    def sparse(self):
+        return self._unit_vector is None
+
+    @property
+    def holds_amplitudes(self):
+        """
+        True once the state is dense, while sparse the bytes of the state include the indices of its nonzero states
+        """
+        return not self.sparse
+
+    @property
+    def in_memory(self):
+        """
+        True if the dense state fits in the memory budget so can be returned
+        """
+        return numpy.dtype(self.dtype).itemsize * self.number_of_states <= self.memory_budget
+
+    @property
+    def unit_vector(self):
+        """
+        State of the register as a dense complex numpy array, built from the nonzero states while sparse
+        """
+        if self.sparse:
+            return to_dense(self.number_of_states, self.indices, self.values)
+        return self._unit_vector
+
+    @unit_vector.setter
+    def unit_vector(self, vector):
+        vector = state_array(vector, (self.number_of_states,))
+        if self.sparse:
+            self.indices, self.values = from_dense(vector.astype(self.dtype, copy=False))
+            self.check_fill()
+        else:
+            self._unit_vector[...] = vector
+
+    def set_basis_states(self, states, amplitudes):
+        if not self.sparse:
+            Register.set_basis_states(self, states, amplitudes)
+            return
+        states = numpy.asarray(states, numpy.int64)
+        order = numpy.argsort(states)
+        self.indices = states[order]
+        self.values = numpy.asarray(amplitudes, self.dtype)[order]
+        self.check_fill()
+
+    def set_uniform_state(self):
+        if self.sparse and not self.in_memory:
+            # Every state is nonzero, which takes more memory held sparse than dense
+            raise ValueError("Uniform state of {} qbits is larger than the memory budget of {} bytes"
+                             .format(self.num_qbits, self.memory_budget))
+        if self.sparse:
+            # Every state is nonzero so the state is dense once it fits in memory
+            self._unit_vector = numpy.empty(self.number_of_states, self.dtype)
+            self.indices = None
+            self.values = None
+        Register.set_uniform_state(self)
+
+    @property
+    def nbytes(self):
+        if self.sparse:
+            return self.indices.nbytes + self.values.nbytes
+        return self._unit_vector.nbytes
+
+    def check_fill(self):
+        """
+        Change to a dense state if more than the fill fraction of the states are nonzero and it fits in memory,
+        otherwise check the nonzero states still fit in the memory budget
+        :return:
+        """
+        if len(self.indices) > self.fill * self.number_of_states and self.in_memory:
+            self._unit_vector = to_dense(self.number_of_states, self.indices, self.values)
+            self.indices = None
+            self.values = None
+        elif self.nbytes > self.memory_budget:
+            raise ValueError("Sparse register of {} nonzero states is larger than the memory budget of {} bytes"
+                             .format(len(self.indices), self.memory_budget))
+
+    def mask(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return: integer with only the bit of qbit in a state index set
+        """
+        return 1 << (self.num_qbits - qbit)
+
+    def probabilities(self):
+        """
+        :return: numpy array of probability of measuring each nonzero state, or each state once dense
+        """
+        if self.sparse:
+            return (self.values.conjugate() * self.values).real
+        return Register.probabilities(self)
+
+    def norm(self):
+        return numpy.sqrt(self.probabilities().sum(dtype=float))
+
+    def sample(self, num_samples, probabilities=None):
+        if not self.sparse or probabilities is not None:
+            return Register.sample(self, num_samples, probabilities)
+        return self.indices[Register.sample(self, num_samples, self.probabilities())]
+
+    def counting_states(self, qbits=None):
+        if not self.sparse or qbits is not None:
+            return Register.counting_states(self, qbits)
+        return self.count_samples(None)
+
+    def marginal_states(self, qbits):
+        if not self.sparse:
+            return Register.marginal_states(self, qbits)
+        # Only the values of qbits found in the nonzero states are listed
+        values = numpy.zeros(len(self.indices), numpy.int64)
+        for qbit in qbits:
+            values = (values << 1) | ((self.indices >> (self.num_qbits - qbit)) & 1)
+        states, inverse = numpy.unique(values, return_inverse=True)
+        return states, numpy.bincount(inverse, weights=self.probabilities(), minlength=len(states))
+
+    def exact_states(self, top_k=None, min_probability=0., qbits=None):
+        if not self.sparse or qbits is not None:
+            return Register.exact_states(self, top_k, min_probability, qbits)
+        check_exact_size(len(self.indices), top_k, min_probability)
+        return self.label_states(self.indices, self.probabilities(), top_k, min_probability)
+
+    def expectation(self, pauli):
+        if not self.sparse:
+            return Register.expectation(self, pauli)
+        x_mask, z_mask, num_y = pauli_masks(pauli)
+        signs = 1 - 2 * parity(self.indices & z_mask)
+        flipped = lookup(self.indices, self.values, self.indices ^ x_mask)
+        return (1j ** num_y * (flipped.conjugate() * self.values * signs).sum(dtype=complex)).real
+
+    def gate_function(self, qbit, T):
+        if not self.sparse:
+            return Register.gate_function(self, qbit, T)
+        self.indices, self.values = transform_qbit(self.indices, self.values, self.mask(qbit), T)
+        self.check_fill()
+
+    def controlled_gate_function(self, control, target, T):
+        if not self.sparse:
+            return Register.controlled_gate_function(self, control, target, T)
+        if control == target:
+            raise ValueError("Control and target are both qbit {}".format(control))
+        self.indices, self.values = controlled_transform(self.indices, self.values, self.mask(control),
+                                                         self.mask(target), T)
+        self.check_fill()
+
+    def phase_flip(self, state, factor=-1.):
+        if not self.sparse:
+            return Register.phase_flip(self, state, factor)
+        self.values[self.indices == state] *= factor
+
+    def diagonal_gate(self, factors=(), flips=(), controlled=(), qbits=None, diagonal=None):
+        if not self.sparse:
+            return Register.diagonal_gate(self, factors, flips, controlled, qbits, diagonal)
+        self.values *= diagonal_factors(self.indices, self.num_qbits, factors, flips, controlled)
+        self.indices, self.values = prune(self.indices, self.values)
+
+    def apply_unitary(self, U):
+        if self.sparse:
+            raise ValueError("Sparse register of {} qbits cannot apply a unitary".format(self.num_qbits))
+        Register.apply_unitary(self, U)
+
+    op_table = dict(Register.op_table, D=diagonal_gate)
+
+
+unitary_cache = LRUCache(UNITARY_CACHE_BYTES)
+
+
+def compile_unitary(num_qbits, operations):
+    """
+    Calculate the unitary of the whole register for a list of operations.
+    The operations are applied to every row of the identity at once, and the body of
+    a Repeat is compiled separately and raised to the count by repeated squaring.
+    :param num_qbits: number of qbits in the register
+    :param operations: list of operations in the same format as execute_operations
+    :return: 2^n x 2^n matrix
+    """
+    number_of_states = 2 ** num_qbits
+    # Each row is the image of a basis state so the rows hold the transpose of the unitary
+    register = Register(num_qbits, 0, batch_size=number_of_states)
+    register.unit_vector = numpy.identity(number_of_states, complex)
+    for operation in operations:
+        if operation['op'] == 'Repeat':
+            args = operation['args']
+            body = compile_unitary(num_qbits, args['operations'])
+            register.apply_unitary(numpy.linalg.matrix_power(body, args['count']))
+        else:
+            register.execute_operations([operation])
+    return register.unit_vector.T.copy()
+
+
+def cached_unitary(num_qbits, operations):
+    """
+    Look up the unitary for operations in the unitary cache, compiling and caching it if not found
+    :param num_qbits: number of qbits in the register
+    :param operations: list of operations in the same format as execute_operations
+    :return: 2^n x 2^n matrix
+    """
+    key = canonical_key([num_qbits, operations])
+    U = unitary_cache.get(key)
+    if U is None:
+        U = compile_unitary(num_qbits, optimise(operations))
+        unitary_cache.put(key, U, U.nbytes)
+    return U
+
+
+def can_compile(num_qbits):
+    """
+    :param num_qbits: number of qbits in the register
+    :return: True if the unitary for the register fits in the unitary cache
+    """
+    return 16 * 4 ** num_qbits <= unitary_cache.max_bytes
+
+
+def sweep_values(value):
+    """
+    :param value: list of values, or range of values as either {"start" : 0.0, "stop" : 3.14, "num" : 50}
+        which includes the stop value, or {"start" : 0.0, "stop" : 3.14, "step" : 0.1} which does not
+    :return: numpy array of values
+    """
+    if isinstance(value, dict):
+        start = value['start'] if 'start' in value else 0
+        if 'num' in value:
+            return numpy.linspace(start, value['stop'], value['num'])
+        return numpy.arange(start, value['stop'], value['step'] if 'step' in value else 1)
+    return numpy.asarray(value)
+
+
+def expand_sweep(operations):
+    """
+    Replace the swept arguments of operations, those given as a list or range rather than a number,
+    by numpy arrays of their values. Every swept argument must have the same number of values.
+    The count of every Repeat is checked to not be negative, so that each way of applying it agrees.
+    :param operations: list of operations in the same format as Register.execute_operations
+    :return: (list of operations, number of values of the swept arguments or None if nothing is swept)
+    """
+    num_points = []
+
+    def expand(operations):
+        expanded = []
+        for operation in operations:
+            if 'args' not in operation:
+                expanded.append(operation)
+                continue
+            args = dict(operation['args'])
+            if operation['op'] == 'Repeat' and args['count'] < 0:
+                raise ValueError("Repeat count {} is negative".format(args['count']))
+            for name, value in args.items():
+                if name == 'operations':
+                    args[name] = expand(value)
+                elif name in SWEEP_ARGS and isinstance(value, (list, dict)):
+                    values = sweep_values(value)
+                    if name == 'desired_state':
+                        values = values.astype(int)
+                    if num_points and num_points[0] != len(values):
+                        raise ValueError("Swept arguments have {} and {} values".format(num_points[0], len(values)))
+                    num_points[:] = [len(values)]
+                    args[name] = values
+            expanded.append(dict(operation, args=args))
+        return expanded
+
+    expanded = expand(operations)
+    return expanded, num_points[0] if num_points else None
+
+
+def initial_terms(num_qbits, initial_vector=None, initial_state=None):
+    """
+    Nonzero states of an initial state given by a sparse initial vector or by name
+    :param num_qbits: number of qbits in the register
+    :param initial_vector: dictionary of state index -> amplitude, each amplitude a number or [real, imaginary]
+    :param initial_state: "ghz" or {"basis": state index}
+    :return: list of state indices and list of their amplitudes
+    """
+    if initial_state == "ghz":
+        return [0, 2 ** num_qbits - 1], [numpy.sqrt(.5)] * 2
+    if initial_state is not None:
+        initial_vector = {initial_state['basis']: 1.}
+    states = [int(state) for state in initial_vector]
+    amplitudes = [complex(*amplitude) if isinstance(amplitude, (list, tuple)) else amplitude
+                  for amplitude in initial_vector.values()]
+    for state in states:
+        if not 0 <= state < 2 ** num_qbits:
+            raise ValueError("State {} is not one of the states of {} qbits".format(state, num_qbits))
+    if len(set(states)) < len(states):
+        # Keys such as "1" and "01" are different strings for the same state
+        raise ValueError("Initial vector gives the amplitude of a state more than once")
+    return states, amplitudes
+
+
+def run(program):
+    """
+    Create a register for a program and apply the operations of the program to it
+    :param program: program in the same format as execute
+    :return: register holding the final state of the program
+    """
+    num_qbits = program['num_qbits'] if 'num_qbits' in program else DEFAULT_QBITS
+    num_measures = program['num_measures'] if 'num_measures' in program else DEFAULT_MEASURES
+    seed = program['seed'] if 'seed' in program else None
+    memory_budget = program['memory_budget'] if 'memory_budget' in program else DEFAULT_MEMORY_BUDGET
+    num_threads = program['num_threads'] if 'num_threads' in program else DEFAULT_THREADS
+    precision = program['precision'] if 'precision' in program else "double"
+    backend = program['backend'] if 'backend' in program else None
+    max_bond_dimension = program['max_bond_dimension'] if 'max_bond_dimension' in program else DEFAULT_BOND_DIMENSION
+    profile = program['profile'] if 'profile' in program else False
+    if backend not in BACKENDS:
+        raise ValueError("Backend {} is not one of {}".format(backend, ", ".join(sorted(BACKENDS - {None}))))
+    if backend in ("stabilizer", "mps") and precision != "double":
+        # A tableau has no amplitudes and the tensors are always complex128
+        raise ValueError("The {} backend does not support {} precision".format(backend, precision))
+    operations, num_points = expand_sweep(program['operations'] if 'operations' in program else [])
+    batch_size = num_points
+    initial_vector = decode_vector(program['initial_vector']) if 'initial_vector' in program else None
+    initial_state = program['initial_state'] if 'initial_state' in program else None
+    if initial_state is not None:
+        if 'initial_vector' in program or 'initial_vectors' in program:
+            raise ValueError("A program cannot have both initial_state and an initial vector")
+        if initial_state not in INITIAL_STATES and not (isinstance(initial_state, dict) and 'basis' in initial_state):
+            raise ValueError("Initial state {} is not one of {} or a basis state".format(
+                initial_state, ", ".join(sorted(INITIAL_STATES))))
+    # The nonzero states of a sparse initial vector or named state, built directly in the register
+    terms = initial_terms(num_qbits, initial_vector, initial_state) \
+        if isinstance(initial_vector, dict) or initial_state not in (None, "uniform") else None
+    if 'initial_vectors' in program:
+        if num_points is not None:
+            raise ValueError("A sweep cannot have initial_vectors")
+        initial_vectors = [decode_vector(vector) for vector in program['initial_vectors']]
+        batch_size = len(initial_vectors)
+    itemsize = numpy.dtype(precision_dtype(precision)).itemsize
+    in_memory = itemsize * 2 ** num_qbits * (batch_size or 1) <= memory_budget
+    if backend in (None, "stabilizer") and batch_size is None:
+        # A Clifford program from a basis, uniform or GHZ state is simulated with a tableau, by default only
+        # for large registers whose final vector is not asked for, as a tableau has no amplitudes
+        final_vector = program['final_vector'] if 'final_vector' in program else False
+        if initial_state in INITIAL_STATES:
+            initial_basis = None
+        elif terms is not None:
+            initial_basis = terms[0][0] if len(terms[0]) == 1 and \
+                abs(abs(terms[1][0]) - 1) <= CLIFFORD_TOLERANCE else None
+        else:
+            initial_basis = basis_state(initial_vector) if initial_vector is not None else 0
+        stabilizer = (initial_state in INITIAL_STATES or initial_basis is not None) and is_clifford(operations)
+        if backend == "stabilizer" and not stabilizer:
+            raise ValueError("Program is not Clifford gates applied to a basis, uniform or GHZ state")
+        if backend == "stabilizer" and final_vector:
+            raise ValueError("The stabilizer backend has no final vector")
+        if stabilizer and (backend == "stabilizer" or not in_memory or
+                           num_qbits > STATE_VECTOR_MAX_CLIFFORD_QBITS and not final_vector):
+            register = StabilizerRegister(num_qbits, num_measures, seed=seed)
+            if initial_state == "uniform":
+                register.set_uniform_state()
+            elif initial_state == "ghz":
+                register.set_ghz_state()
+            else:
+                register.set_basis_state(initial_basis)
+            if profile:
+                register.profiler = Profiler()
+            register.execute_operations(operations)
+            return register
+    if backend is None and not in_memory and batch_size is None and (initial_vector is not None or terms is not None) \
+            and is_monomial(operations):
+        # A state too large for memory that starts with few nonzero states is held sparse, as long as no
+        # operation spreads the state over more states
+        nonzero = len(terms[0]) if terms is not None else numpy.count_nonzero(initial_vector)
+        backend = "sparse" if nonzero <= DEFAULT_SPARSE_FILL * 2 ** num_qbits else None
+    if backend in ("sparse", "stabilizer", "mps") and batch_size is not None:
+        raise ValueError("A {} register cannot hold a batch of states".format(backend))
+    if backend == "mps" and (program['final_vector'] if 'final_vector' in program else False) and \
+            numpy.dtype(complex).itemsize * 2 ** num_qbits > memory_budget:
+        # The tensors are contracted to the whole state vector to return it
+        raise ValueError("The final vector of an mps register of {} qbits is larger than the memory budget of {} "
+                         "bytes".format(num_qbits, memory_budget))
+    # Compiling costs far more than applying the operations once, so is only done when the program asks
+    use_unitary = program['compile'] if 'compile' in program else False
+    # A sweep is applied to all its points at once, and a sparse or mps state is never a whole vector,
+    # so none of them is compiled
+    use_unitary = use_unitary and num_points is None and backend not in ("sparse", "mps")
+    if use_unitary and not (can_compile(num_qbits) and in_memory):
+        raise ValueError("Register of {} qbits is too large to compile".format(num_qbits))
+    if backend == "mps":
+        register = MPSRegister(num_qbits, num_measures, seed=seed, max_bond_dimension=max_bond_dimension)
+    elif backend == "sparse":
+        register = SparseRegister(num_qbits, num_measures, seed=seed, num_threads=num_threads, precision=precision,
+                                  memory_budget=memory_budget)
+    elif in_memory:
+        register = Register(num_qbits, num_measures, batch_size=batch_size, seed=seed, num_threads=num_threads,
+                            precision=precision)
+    elif batch_size is None:
+        register = MappedRegister(num_qbits, num_measures, seed=seed, precision=precision)
+    else:
+        raise ValueError("Batch of registers of {} qbits is larger than the memory budget".format(num_qbits))
+    if 'initial_vectors' in program:
+        register.unit_vector = initial_vectors
+    elif initial_state == "uniform":
+        register.set_uniform_state()
+    elif terms is not None:
+        register.set_basis_states(*terms)
+    elif backend != "mps" or initial_vector is not None:
+        if initial_vector is None:
+            raise KeyError('initial_vector')
+        register.unit_vector = initial_vector
+    if precision == "single":
+        register.initial_norm = register.norm()
+    if profile:
+        register.profiler = Profiler()
+    if operations:
+        if use_unitary:
+            register.apply_unitary(cached_unitary(num_qbits, operations))
+        elif profile:
+            # The profile is of the operations of the program, not of the gates they are optimised into
+            register.execute_operations(operations)
+        elif backend == "mps":
+            # Merging diagonals would turn gates on neighbouring qbits into changes to single states
+            register.execute_operations(fuse_gates(operations))
+        else:
+            register.execute_operations(optimise(operations))
+    return register
+
+
+def result(register, program):
+    """
+    :param register: register holding the final state of program
+    :param program: program in the same format as execute
+    :return: response in the same format as execute
+    """
+    vector_encoding = program['vector_encoding'] if 'vector_encoding' in program else None
+    if vector_encoding not in VECTOR_ENCODINGS:
+        raise ValueError("Vector encoding {} is not one of {}".format(
+            vector_encoding, ", ".join(sorted(VECTOR_ENCODINGS - {None}))))
+    qbits = program['measure_qbits'] if 'measure_qbits' in program else None
+    if qbits is not None and (not qbits or len(set(qbits)) != len(qbits) or
+                              not all(1 <= qbit <= register.num_qbits for qbit in qbits)):
+        raise ValueError("Measured qbits {} are not different qbits of {} qbits".format(qbits, register.num_qbits))
+    if register.profiler is None:
+        states = register.counting_states(qbits)
+    else:
+        states = register.profiler.counting_states(register, qbits)
+    exact = program['exact'] if 'exact' in program else False
+    exact_states = None
+    if exact:
+        # exact is true or a dictionary of top_k and min_probability
+        options = exact if isinstance(exact, dict) else {}
+        exact_states = register.exact_states(options['top_k'] if 'top_k' in options else None,
+                                             options['min_probability'] if 'min_probability' in options else 0.,
+                                             qbits)
+    observables = None
+    if 'observables' in program:
+        # Each observable is a Pauli string or a dictionary of a Pauli string and its weight
+        observables = [(observable['weight'] if 'weight' in observable else 1.) *
+                       register.expectation(parse_pauli(observable['pauli'], register.num_qbits))
+                       if isinstance(observable, dict) else
+                       register.expectation(parse_pauli(observable, register.num_qbits))
+                       for observable in program['observables']]
+    if register.batch_size is not None:
+        retval = {
+            "results": [{
+                "final_vector": encode_vector(final_vector, vector_encoding),
+                "probabilities": encode_vector(probabilities, vector_encoding),
+                "states": point_states
+            } for final_vector, probabilities, point_states in
+                zip(register.unit_vector, register.probabilities(), states)]
+        }
+        if register.initial_norm is not None:
+            for point, drift in zip(retval["results"], register.norm() - register.initial_norm):
+                point["norm_drift"] = float(drift)
+        if exact_states is not None:
+            for point, point_exact_states in zip(retval["results"], exact_states):
+                point["exact_states"] = point_exact_states
+        if observables is not None:
+            for index, point in enumerate(retval["results"]):
+                point["observables"] = [float(values[index]) for values in observables]
+        if register.profiler is not None:
+            retval["profile"] = register.profiler.report()
+        return retval
+    retval = {}
+    if program['final_vector'] if 'final_vector' in program else register.in_memory:
+        retval["final_vector"] = encode_vector(register.unit_vector, vector_encoding)
+    retval["states"] = states
+    if exact_states is not None:
+        retval["exact_states"] = exact_states
+    if observables is not None:
+        retval["observables"] = [float(value) for value in observables]
+    if isinstance(register, MPSRegister):
+        retval["truncation_error"] = float(register.truncation_error)
+    if register.initial_norm is not None:
+        retval["norm_drift"] = float(register.norm() - register.initial_norm)
+    if register.profiler is not None:
+        retval["profile"] = register.profiler.report()
+    return retval
+
+
 def execute(program):
     """
     :param program:
         {
           "num_qbits" : 3,
           "num_measures" : 100,
+          "seed" : 1234,
+          "num_threads" : 4,
+          "memory_budget" : 1073741824,
+          "final_vector" : true,
           "initial_vector" : [1.0, 0, 0, 0, 0, 0, 0, 0],
+          "initial_vectors" : [[1.0, 0, 0, 0, 0, 0, 0, 0], [0, 1.0, 0, 0, 0, 0, 0, 0]],
+          "initial_state" : "ghz",
+          "compile" : true,
+          "precision" : "single",
+          "backend" : "mps",
+          "max_bond_dimension" : 64,
+          "profile" : true,
+          "vector_encoding" : "base64",
+          "exact" : {"top_k" : 2, "min_probability" : 0.01},
+          "observables" : ["ZIZ", {"pauli" : "X1 Y2", "weight" : 0.5}],
+          "measure_qbits" : [3, 1],
           "operations" : [
             {"op" : 'H',
              "args" : {"qbit" : 3}},
@@ -191,20 +1503,39 @@ def execute(program):
     :return:
         {
           "final_vector" : [1.0, 0, 0, 0, 0, 0, 0, 0],
-          "states" : { "00100":50.0, "00001":50.0}
+          "states" : { "00100":50.0, "00001":50.0},
+          "exact_states" : { "00100":0.5, "00001":0.5},
+          "observables" : [1.0, 0.0],
+          "norm_drift" : 1.2e-07,
+          "truncation_error" : 0.0,
+          "profile" : {"total" : {"count" : 2, "time" : 1.2e-05, "bytes" : 384, "flops" : 136}, ...}
+        }
+        with exact_states, the exact probability of the most likely states in decreasing order, only if the
+        program asks for them with exact true or a dictionary of the top_k states to return and the
+        min_probability of a state to return,
+        observables, the exact expectation value of each weighted Pauli string, only if the program gives them,
+        norm_drift, the change in the norm of the state, only for single precision,
+        and truncation_error, the weight of the state dropped from the bonds, only for the mps backend,
+        and profile, the report of Profiler, only if the program asks for it,
+        or for a sweep or initial_vectors, one result for each point of the sweep or initial vector
+        {
+          "results" : [
+            {
+              "final_vector" : [1.0, 0, 0, 0, 0, 0, 0, 0],
+              "probabilities" : [1.0, 0, 0, 0, 0, 0, 0, 0],
+              "states" : { "00000":100.0}
+            }
+          ]
         }
+        With measure_qbits states and exact_states are of the values of only those qbits, labelled in the order
+        given, for example |01> for qbit 3 being 0 and qbit 1 being 1.
+        With vector_encoding base64 the final_vector and probabilities are the base64 encoding of their raw
+        little endian bytes, {"dtype" : "complex128", "base64" : "AAAAAAAA8D8AAAAAAAAAAA..."}, the same encoding
+        initial_vector and each of initial_vectors can be given in.
+        initial_vector may also be sparse, {"0" : 0.6, "7" : [0, 0.8]}, and initial_state used instead to start
+        in the uniform or ghz state or a basis state, {"basis" : 5}, which the register builds directly.
 
     """
-    num_qbits = program['num_qbits'] if 'num_qbits' in program else DEFAULT_QBITS
-    num_measures = program['num_measures'] if 'num_measures' in program else DEFAULT_MEASURES
-    register = Register(num_qbits, num_measures)
-    register.unit_vector = program['initial_vector']
-    if "operations" in program:
-        register.execute_operations(program['operations'])
-    retval = {
-        "final_vector": register.unit_vector,
-        "states": register.counting_states()
-    }
-    return retval
+    return result(run(program), program)
 
 r = Register()
@@ -2,11 +2,23 @@ from math import ceil
 from math import pi
 from math import sqrt
 from unittest import main
+from unittest.mock import patch
 
+import numpy
+
+from encoding import encode_vector
 from mock_extension import MockExtension
+from register import H
+from register import MappedRegister
 from register import ROOT2RECIPRICOL
 from register import Register
+from register import SparseRegister
+from register import X
+from register import Y
+from register import Z
+from register import compile_unitary
 from register import execute
+from register import unitary_cache
 
 
 # Tests based on exercises in "Undergraduate computational physics projects on quantum computing" D. Candela
@@ -26,7 +38,7 @@ class TestRegister(MockExtension):
         self.assertEqualWrapper(num_qbits, simple_register.num_qbits, "Wrong number of qbits")
         self.assertEqualWrapper(self.num_measures, simple_register.numMeasures, "Wrong number of measures")
         self.assertEqualWrapper(2 ** num_qbits, simple_register.number_of_states, "Wrong number of states")
-        self.assertSequenceEqualWrapper(simple_register.unit_vector, [0.0] * 2 ** num_qbits,
+        self.assertSequenceEqualWrapper(simple_register.unit_vector.tolist(), [0.0] * 2 ** num_qbits,
                                         "Incorrect initial unit vector")
 
     def test_simple_register_states(self, ):
@@ -77,6 +89,12 @@ class TestRegister(MockExtension):
             self.assertReasonablyEqualWrapper(probability, expected_prob, self.state_accuracy_percent,
                                               "Bad probability")
 
+    def test_counting_states_no_measures(self):
+        # No measurements gives no states
+        register = Register(3, 0)
+        register.unit_vector[0] = 1.0
+        self.assertEqualDictionaryWrapper(register.counting_states(), {}, "Incorrect states without measures")
+
     def test_hadamard_gate_single(self):
         # Programming project 2
 
@@ -102,7 +120,7 @@ class TestRegister(MockExtension):
             hadamard.unit_vector[0] = 1.
             hadamard.hadamard_gate(i)
             states = hadamard.counting_states()
-            self.assertEqualWrapper(hadamard.unit_vector, test_vector[i],
+            self.assertEqualWrapper(hadamard.unit_vector.tolist(), test_vector[i],
                                     "Incorrect unit vector after Hadamard " + str(i))
             self.assertReasonablyEqualDictionaryWrapper(states, test_states[i], self.state_accuracy_percent,
                                                         "Incorrect single Hadamard gate probability")
@@ -127,7 +145,7 @@ class TestRegister(MockExtension):
             paulix.unit_vector[0] = 1.
             paulix.pauli_x_gate(i)
             states = paulix.counting_states()
-            self.assertEqualWrapper(paulix.unit_vector, test_vector[i],
+            self.assertEqualWrapper(paulix.unit_vector.tolist(), test_vector[i],
                                     "Incorrect unit vector after Pauli X " + str(i))
             self.assertReasonablyEqualDictionaryWrapper(states, test_states[i], self.state_accuracy_percent,
                                                         "Incorrect single Pauli X gate probability")
@@ -152,7 +170,7 @@ class TestRegister(MockExtension):
             pauliy.unit_vector[0] = 1.
             pauliy.pauli_y_gate(i)
             states = pauliy.counting_states()
-            self.assertEqualWrapper(pauliy.unit_vector, test_vector[i],
+            self.assertEqualWrapper(pauliy.unit_vector.tolist(), test_vector[i],
                                     "Incorrect unit vector after Pauli Y " + str(i))
             self.assertReasonablyEqualDictionaryWrapper(states, test_states[i], self.state_accuracy_percent,
                                                         "Incorrect single Pauli X gate probability")
@@ -177,11 +195,609 @@ class TestRegister(MockExtension):
             pauliz.unit_vector[1] = 1.
             pauliz.pauli_z_gate(i)
             states = pauliz.counting_states()
-            self.assertEqualWrapper(pauliz.unit_vector, test_vector[i],
+            self.assertEqualWrapper(pauliz.unit_vector.tolist(), test_vector[i],
                                     "Incorrect unit vector after Pauli X " + str(i))
             self.assertReasonablyEqualDictionaryWrapper(states, test_states[i], self.state_accuracy_percent,
                                                         "Incorrect single Pauli X gate probability")
 
+    def test_gate_function_matches_kronecker(self):
+        # Gates applied to the amplitude slices must match the full Kronecker product operator
+        num_qbits = 4
+        state = numpy.random.RandomState(1).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        state /= numpy.linalg.norm(state)
+        for gate in [H, X, Y, Z]:
+            for qbit in range(1, num_qbits + 1):
+                operator = numpy.identity(1)
+                for i in range(1, num_qbits + 1):
+                    operator = numpy.kron(operator, gate if i == qbit else numpy.identity(2))
+                register = Register(num_qbits, self.num_measures)
+                register.unit_vector = state.tolist()
+                register.gate_function(qbit, gate)
+                self.assertTrue(numpy.allclose(register.unit_vector, numpy.dot(operator, state)),
+                                "Gate on qbit " + str(qbit) + " does not match Kronecker product")
+
+    def test_double_buffer_matches_in_place(self):
+        # Double buffered gates write into the scratch buffer and give the same result as in place gates
+        num_qbits = 4
+        state = numpy.random.RandomState(2).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        in_place = Register(num_qbits, self.num_measures)
+        double = Register(num_qbits, self.num_measures, double_buffer=True)
+        in_place.unit_vector = state
+        double.unit_vector = state
+        buffers = {id(double.unit_vector), id(double.scratch_vector)}
+        for gate in [H, X, Y, Z]:
+            for qbit in range(1, num_qbits + 1):
+                in_place.gate_function(qbit, gate)
+                double.gate_function(qbit, gate)
+        self.assertTrue(numpy.allclose(in_place.unit_vector, double.unit_vector), "Double buffer result differs")
+        self.assertEqualWrapper({id(double.unit_vector), id(double.scratch_vector)}, buffers,
+                                "Double buffer allocated new state")
+
+    def test_controlled_gates_match_operator(self):
+        # Controlled gates on every pair of qbits match the full controlled operator
+        num_qbits = 3
+        state = numpy.random.RandomState(5).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        projectors = [numpy.diag([1.0, 0.0]), numpy.diag([0.0, 1.0])]
+        gates = {"CNOT": X, "CZ": Z, "CU": H}
+        for name, gate in gates.items():
+            for control in range(1, num_qbits + 1):
+                for target in range(1, num_qbits + 1):
+                    if control == target:
+                        continue
+                    operator = numpy.zeros((2 ** num_qbits, 2 ** num_qbits), complex)
+                    for control_value, projector in enumerate(projectors):
+                        term = numpy.identity(1)
+                        for i in range(1, num_qbits + 1):
+                            if i == control:
+                                term = numpy.kron(term, projector)
+                            elif i == target and control_value == 1:
+                                term = numpy.kron(term, gate)
+                            else:
+                                term = numpy.kron(term, numpy.identity(2))
+                        operator += term
+                    args = {"control": control, "target": target}
+                    if name == "CU":
+                        args["matrix"] = gate
+                    register = Register(num_qbits, self.num_measures)
+                    register.unit_vector = state
+                    register.execute_operations([{"op": name, "args": args}])
+                    self.assertTrue(numpy.allclose(register.unit_vector, numpy.dot(operator, state)),
+                                    "Incorrect " + name + " control " + str(control) + " target " + str(target))
+
+    def test_execute_bell_state(self):
+        # Hadamard then controlled not entangles the qbits
+        for compile_operations in [True, False]:
+            request = {
+                "num_qbits": 3,
+                "num_measures": self.num_measures,
+                "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+                "compile": compile_operations,
+                "operations": [
+                    {"op": 'H', "args": {"qbit": 1}},
+                    {"op": 'CNOT', "args": {"control": 1, "target": 3}},
+                    {"op": 'CP', "args": {"control": 3, "target": 1, "theta": pi / 2}},
+                    {"op": 'CZ', "args": {"control": 1, "target": 2}}
+                ]
+            }
+            result = execute(request)
+            expected = [ROOT2RECIPRICOL, 0, 0, 0, 0, 1j * ROOT2RECIPRICOL, 0, 0]
+            self.assertTrue(numpy.allclose(result["final_vector"], expected), "Incorrect Bell state vector")
+            self.assertReasonablyEqualDictionaryWrapper(result["states"], {"|000>": 0.5, "|101>": 0.5},
+                                                        self.state_accuracy_percent, "Incorrect Bell state")
+
+    @patch('register.PARALLEL_MIN_STATES', 1)
+    def test_threaded_gates_match_single_thread(self):
+        # Splitting the amplitudes between threads gives the same result as a single thread
+        num_qbits = 4
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'Y', "args": {"qbit": 4}},
+            {"op": 'X', "args": {"qbit": 2}},
+            {"op": 'CU', "args": {"control": 3, "target": 1, "matrix": H}},
+            {"op": 'D', "args": {"factors": [[2, [1, 1j]]], "flips": [[3, -1]], "controlled": [[1, 4, [1, -1]]]}},
+            {"op": 'P', "args": {"qbit": 3, "theta": [0.1, 0.2, 0.3]}}
+        ]
+        state = numpy.random.RandomState(6).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        registers = [Register(num_qbits, self.num_measures, batch_size=3),
+                     Register(num_qbits, self.num_measures, batch_size=3, num_threads=3),
+                     Register(num_qbits, self.num_measures, batch_size=3, num_threads=3, double_buffer=True)]
+        for register in registers:
+            register.unit_vector = state
+            register.execute_operations(operations)
+        for register in registers[1:]:
+            self.assertTrue(numpy.allclose(register.unit_vector, registers[0].unit_vector),
+                            "Threaded gates give different result")
+
+    def test_mapped_register_matches_register(self):
+        # Gates applied to blocks of a memory mapped state match gates applied in memory
+        num_qbits = 5
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'H', "args": {"qbit": 5}},
+            {"op": 'Y', "args": {"qbit": 2}},
+            {"op": 'CNOT', "args": {"control": 1, "target": 2}},
+            {"op": 'CU', "args": {"control": 5, "target": 1, "matrix": H}},
+            {"op": 'CNOT', "args": {"control": 2, "target": 4}},
+            {"op": 'CP', "args": {"control": 4, "target": 5, "theta": 0.3}},
+            {"op": 'D', "args": {"factors": [[1, [1, 1j]], [4, [-1, 1]]], "flips": [[7, -1]],
+                                 "controlled": [[1, 3, [1j, 1]], [4, 2, [1, -1]], [2, 1, [-1, 1j]],
+                                                [3, 5, [1, 1j]]]}},
+            {"op": 'J'}
+        ]
+        state = numpy.random.RandomState(7).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        state /= numpy.linalg.norm(state)
+        expected = Register(num_qbits, self.num_measures, seed=8)
+        mapped = MappedRegister(num_qbits, self.num_measures, seed=8, block_states=4)
+        for register in [expected, mapped]:
+            register.unit_vector = state
+            register.execute_operations(operations)
+        self.assertTrue(numpy.allclose(mapped.unit_vector, expected.unit_vector), "Mapped register differs")
+        self.assertSequenceEqualWrapper(mapped.sample(1000).tolist(), sorted(expected.sample(1000).tolist()),
+                                        "Incorrect mapped register samples")
+        for qbits in [[4, 1, 2], [1], [5, 3]]:
+            self.assertTrue(numpy.allclose(mapped.marginal_states(qbits)[1], expected.marginal_states(qbits)[1]),
+                            "Incorrect mapped register marginal of {}".format(qbits))
+
+    def test_mapped_register_disk_space(self):
+        # A register larger than the free disk space is refused before its file is created
+        with patch('register.shutil.disk_usage', return_value=type('usage', (), {"free": 100})):
+            with self.assertRaises(ValueError):
+                MappedRegister(4, self.num_measures)
+        with self.assertRaises(ValueError):
+            execute({"num_qbits": 45, "num_measures": self.num_measures, "memory_budget": 2 ** 20,
+                     "initial_state": {"basis": 0},
+                     "operations": [{"op": 'H', "args": {"qbit": 1}}, {"op": 'P', "args": {"qbit": 1, "theta": 0.1}}]})
+
+    def test_execute_over_memory_budget(self):
+        # A register larger than the memory budget is memory mapped and does not return its final vector
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "memory_budget": 64,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [
+                {"op": 'H', "args": {"qbit": 3}},
+                {"op": 'P', "args": {"qbit": 3, "theta": pi}},
+                {"op": 'H', "args": {"qbit": 3}}
+            ]
+        }
+        result = execute(request)
+        self.assertTrue("final_vector" not in result, "Mapped register returned final vector")
+        self.assertEqualDictionaryWrapper(result["states"], {"|001>": 1.0}, "Incorrect mapped register states")
+
+    def test_sparse_register_matches_register(self):
+        # Gates applied to the nonzero states of a sparse register match gates applied to the dense state
+        num_qbits = 5
+        operations = [
+            {"op": 'X', "args": {"qbit": 1}},
+            {"op": 'H', "args": {"qbit": 3}},
+            {"op": 'CNOT', "args": {"control": 3, "target": 5}},
+            {"op": 'P', "args": {"qbit": 2, "theta": 0.3}},
+            {"op": 'CU', "args": {"control": 1, "target": 4, "matrix": H}},
+            {"op": 'D', "args": {"factors": [[1, [1, 1j]]], "flips": [[5, -1]], "controlled": [[1, 5, [1, -1]]]}},
+            {"op": 'J'},
+            {"op": 'O', "args": {"desired_state": 20}},
+            {"op": 'Y', "args": {"qbit": 2}},
+            {"op": 'H', "args": {"qbit": 3}}
+        ]
+        state = numpy.zeros(2 ** num_qbits)
+        state[3] = 1.0
+        expected = Register(num_qbits, self.num_measures, seed=9)
+        sparse = SparseRegister(num_qbits, self.num_measures, seed=9, fill=1.)
+        dense = SparseRegister(num_qbits, self.num_measures)
+        for register in [expected, sparse, dense]:
+            register.unit_vector = state
+            register.execute_operations(operations)
+            self.assertTrue(numpy.allclose(register.unit_vector, expected.unit_vector), "Sparse register differs")
+        self.assertTrue(sparse.sparse, "Sparse register made dense below fill")
+        self.assertEqualWrapper(len(sparse.indices), 8, "Incorrect number of nonzero states")
+        self.assertFalse(dense.sparse, "Sparse register not made dense above fill")
+        self.assertEqualDictionaryWrapper(sparse.counting_states(), expected.counting_states(),
+                                          "Incorrect sparse register states")
+
+    def test_execute_sparse_over_memory_budget(self):
+        # A register larger than the memory budget that starts in a basis state is held sparse
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "memory_budget": 64,
+            "initial_vector": [0, 1.0, 0, 0, 0, 0, 0, 0],
+            "operations": [
+                {"op": 'X', "args": {"qbit": 1}},
+                {"op": 'CNOT', "args": {"control": 1, "target": 2}},
+                {"op": 'Z', "args": {"qbit": 3}},
+                {"op": 'O', "args": {"desired_state": 7}}
+            ]
+        }
+        result = execute(request)
+        self.assertTrue("final_vector" not in result, "Sparse register over budget returned final vector")
+        self.assertEqualDictionaryWrapper(result["states"], {"|111>": 1.0}, "Incorrect sparse register states")
+        result = execute(dict(request, backend="sparse", memory_budget=2 ** 20))
+        self.assertSequenceEqualWrapper(result["final_vector"], [0, 0, 0, 0, 0, 0, 0, 1.0],
+                                        "Incorrect sparse final vector")
+
+    def test_execute_sparse_spreading_state(self):
+        # Gates that spread the state over the memory budget are refused rather than growing the sparse state,
+        # and a program with such gates is not held sparse by default. P keeps the programs off the stabilizer.
+        register = SparseRegister(50, 10, memory_budget=2 ** 12)
+        register.set_basis_states([0], [1.0])
+        with self.assertRaises(ValueError):
+            for qbit in range(1, 51):
+                register.hadamard_gate(qbit)
+        self.assertLessEqual(len(register.indices), 2 ** 9, "Sparse register grew past the memory budget")
+        request = {
+            "num_qbits": 50,
+            "num_measures": 10,
+            "initial_vector": {"0": 1.0},
+            "operations": [{"op": 'H', "args": {"qbit": qbit}} for qbit in range(1, 51)] +
+                          [{"op": 'P', "args": {"qbit": 1, "theta": 0.1}}]
+        }
+        with self.assertRaises(ValueError):
+            execute(dict(request, backend="sparse", memory_budget=2 ** 12))
+        with patch('register.MappedRegister', side_effect=ValueError("Memory mapped register")) as mapped:
+            with self.assertRaises(ValueError):
+                execute(dict(request, memory_budget=2 ** 12))
+            self.assertTrue(mapped.called, "Spreading program held sparse")
+        request["operations"] = [{"op": 'X', "args": {"qbit": qbit}} for qbit in range(1, 51)] + \
+                                [{"op": 'P', "args": {"qbit": 1, "theta": 0.1}}]
+        result = execute(dict(request, memory_budget=2 ** 12, final_vector=False))
+        self.assertEqualDictionaryWrapper(result["states"], {"|" + "1" * 50 + ">": 1.0},
+                                          "Permutation program not held sparse")
+
+    def test_execute_clifford_uses_stabilizer(self):
+        # A large Clifford program without an initial vector starts in |0...0> and is simulated with a tableau
+        num_qbits = 40
+        request = {
+            "num_qbits": num_qbits,
+            "num_measures": self.num_measures,
+            "operations": [
+                {"op": 'H', "args": {"qbit": 1}},
+                {"op": 'P', "args": {"qbit": 1, "theta": pi / 2}},
+                {"op": 'Repeat', "args": {"count": num_qbits - 1, "operations": [
+                    {"op": 'CZ', "args": {"control": 1, "target": num_qbits}},
+                    {"op": 'Y', "args": {"qbit": num_qbits}}
+                ]}}
+            ]
+        }
+        result = execute(request)
+        self.assertTrue("final_vector" not in result, "Stabilizer register returned final vector")
+        # Y is applied to the last qbit an odd number of times
+        test_states = {"|0" + "0" * (num_qbits - 2) + "1>": 0.5, "|1" + "0" * (num_qbits - 2) + "1>": 0.5}
+        self.assertReasonablyEqualDictionaryWrapper(result["states"], test_states, self.state_accuracy_percent,
+                                                    "Incorrect stabilizer states")
+        request["operations"].append({"op": 'P', "args": {"qbit": 1, "theta": pi / 4}})
+        with self.assertRaises(ValueError):
+            execute(dict(request, backend="stabilizer"))
+
+    def test_execute_clifford_final_vector(self):
+        # A Clifford program asking for its final vector runs on a state vector, which the stabilizer cannot give
+        request = {
+            "num_qbits": 4,
+            "num_measures": 10,
+            "initial_state": {"basis": 0},
+            "operations": [{"op": 'H', "args": {"qbit": 1}}, {"op": 'CNOT', "args": {"control": 1, "target": 4}}]
+        }
+        with patch('register.STATE_VECTOR_MAX_CLIFFORD_QBITS', 2):
+            self.assertTrue("final_vector" not in execute(request), "Large Clifford program not on stabilizer")
+            result = execute(dict(request, final_vector=True))
+        expected = [0.0] * 16
+        expected[0] = expected[9] = ROOT2RECIPRICOL
+        self.assertTrue(numpy.allclose(result["final_vector"], expected), "Incorrect Clifford final vector")
+        with self.assertRaises(ValueError):
+            execute(dict(request, backend="stabilizer", final_vector=True))
+
+    def test_execute_initial_states(self):
+        # Sparse and named initial states match the same state given as a whole initial vector on every backend
+        num_qbits = 4
+        request = {
+            "num_qbits": num_qbits,
+            "num_measures": self.num_measures,
+            "operations": [{"op": 'H', "args": {"qbit": 2}}, {"op": 'CNOT', "args": {"control": 1, "target": 3}}]
+        }
+        ghz = numpy.zeros(2 ** num_qbits)
+        ghz[[0, -1]] = sqrt(0.5)
+        basis = numpy.zeros(2 ** num_qbits, complex)
+        basis[5] = 1j
+        for initial, vector in [({"initial_state": "uniform"}, numpy.full(2 ** num_qbits, 0.25)),
+                                ({"initial_state": "ghz"}, ghz),
+                                ({"initial_state": {"basis": 5}}, abs(basis)),
+                                ({"initial_vector": {"5": [0, 1]}}, basis)]:
+            expected = execute(dict(request, initial_vector=vector.tolist()))
+            for backend in ["dense", "sparse", "mps"]:
+                result = execute(dict(request, final_vector=True, backend=backend, **initial))
+                self.assertTrue(numpy.allclose(result["final_vector"], expected["final_vector"]),
+                                "Incorrect {} initial state on {} backend".format(initial, backend))
+            result = execute(dict(request, backend="stabilizer", **initial))
+            self.assertReasonablyEqualDictionaryWrapper(result["states"], expected["states"],
+                                                        self.state_accuracy_percent,
+                                                        "Incorrect {} initial state on stabilizer".format(initial))
+        with self.assertRaises(ValueError):
+            execute(dict(request, initial_state="w"))
+        with self.assertRaises(ValueError):
+            execute(dict(request, initial_vector={"16": 1.0}))
+        with self.assertRaises(ValueError):
+            execute(dict(request, initial_vector={"1": 1.0, "01": 1.0}))
+
+    def test_execute_measure_qbits(self):
+        # Measuring some of the qbits gives the marginal of the state vector on every backend, in the order given
+        num_qbits = 5
+        random = numpy.random.RandomState(2)
+        operations = []
+        for i in range(30):
+            qbit = int(random.randint(1, num_qbits + 1))
+            operations.append([{"op": 'H', "args": {"qbit": qbit}},
+                               {"op": 'P', "args": {"qbit": qbit, "theta": float(random.rand() * 3)}},
+                               {"op": 'CNOT', "args": {"control": qbit, "target": qbit % num_qbits + 1}}
+                               ][random.randint(3)])
+        request = {"num_qbits": num_qbits, "num_measures": self.num_measures, "initial_state": {"basis": 0},
+                   "operations": operations}
+        probabilities = abs(numpy.array(execute(request)["final_vector"])) ** 2
+        # Sum over qbits 3 and 5 then order the remaining qbits 1, 2, 4 as 4, 1, 2
+        probabilities = probabilities.reshape((2,) * num_qbits).sum(axis=(2, 4)).transpose(2, 0, 1).reshape(-1)
+        test_states = {self.make_state_string(state, 3): probabilities[state] for state in range(8)
+                       if probabilities[state] > 1e-12}
+        for backend in [{"backend": "dense"}, {"backend": "sparse"}, {"backend": "mps"}, {"memory_budget": 64}]:
+            result = execute(dict(request, measure_qbits=[4, 1, 2], exact=True, **backend))
+            self.assertReasonablyEqualDictionaryWrapper(result["exact_states"], test_states, 1e-9,
+                                                        "Incorrect exact marginal with {}".format(backend))
+            self.assertReasonablyEqualDictionaryWrapper(result["states"], test_states, self.state_accuracy_percent,
+                                                        "Incorrect marginal with {}".format(backend))
+        # A GHZ state of many qbits measures its qbits all 0 or all 1
+        request = {"num_qbits": 100, "num_measures": self.num_measures, "initial_state": "ghz",
+                   "measure_qbits": [100, 7], "exact": True}
+        result = execute(request)
+        self.assertEqualDictionaryWrapper(result["exact_states"], {"|00>": 0.5, "|11>": 0.5}, "Incorrect GHZ marginal")
+        self.assertReasonablyEqualDictionaryWrapper(result["states"], {"|00>": 0.5, "|11>": 0.5},
+                                                    self.state_accuracy_percent, "Incorrect GHZ marginal states")
+        with self.assertRaises(ValueError):
+            execute(dict(request, measure_qbits=[7, 7]))
+
+    def test_execute_profile(self):
+        # A profiled program reports each operation by type, qbit and Repeat level
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "profile": True,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [
+                {"op": 'H', "args": {"qbit": 1}},
+                {"op": 'Repeat', "args": {"count": 3, "operations": [
+                    {"op": 'H', "args": {"qbit": 2}},
+                    {"op": 'CNOT', "args": {"control": 1, "target": 3}}
+                ]}}
+            ]
+        }
+        profile = execute(request)["profile"]
+        self.assertEqualWrapper(profile["total"]["count"], 7, "Incorrect number of operations")
+        self.assertEqualWrapper(profile["ops"]["CNOT"]["count"], 3, "Incorrect number of CNOT")
+        self.assertEqualWrapper(profile["qbits"]["2"]["count"], 3, "Incorrect number of operations on qbit 2")
+        self.assertEqualWrapper(profile["levels"]["1"]["count"], 6, "Incorrect number of repeated operations")
+        self.assertEqualWrapper(profile["ops"]["H"]["bytes"], 4 * 2 * 16 * 8, "Incorrect bytes of H")
+        self.assertTrue(profile["counting_states"]["time"] > 0, "Counting states not timed")
+        self.assertTrue("profile" not in execute(dict(request, profile=False)), "Profile without asking")
+        # The operations of the program are profiled rather than the gates they optimise into
+        diagonals = [{"op": 'P', "args": {"qbit": qbit, "theta": 0.1}} for qbit in [1, 2, 3]]
+        profile = execute(dict(request, operations=diagonals))["profile"]
+        self.assertSequenceEqualWrapper(sorted(profile["ops"]), ["P"], "Optimised operations profiled")
+        self.assertSequenceEqualWrapper(sorted(profile["qbits"]), ["1", "2", "3"], "Incorrect qbits profiled")
+
+    def test_single_precision_matches_double(self):
+        # Gates keep a single precision state in complex64 and give the same state as double precision
+        num_qbits = 4
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'CNOT', "args": {"control": 1, "target": 3}},
+            {"op": 'U', "args": {"qbit": 2, "matrix": H}},
+            {"op": 'D', "args": {"factors": [[4, [1, 1j]]], "flips": [[5, -1]], "controlled": [[2, 4, [1, -1]]]}},
+            {"op": 'Y', "args": {"qbit": 4}}
+        ]
+        expected = Register(num_qbits, self.num_measures, double_buffer=True)
+        single = Register(num_qbits, self.num_measures, double_buffer=True, precision="single")
+        for register in [expected, single]:
+            register.unit_vector[0] = 1.0
+            register.execute_operations(operations)
+        self.assertEqual(single.unit_vector.dtype, numpy.complex64, "Single precision state changed dtype")
+        self.assertTrue(numpy.allclose(single.unit_vector, expected.unit_vector, atol=1e-6),
+                        "Single precision state differs")
+        with self.assertRaises(ValueError):
+            Register(num_qbits, self.num_measures, precision="half")
+
+    def test_execute_single_precision_norm_drift(self):
+        # A single precision program reports the change in the norm of its state
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "precision": "single",
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [
+                {"op": 'Repeat', "args": {"count": 50, "operations": [
+                    {"op": 'H', "args": {"qbit": 1}},
+                    {"op": 'P', "args": {"qbit": 1, "theta": 0.1}}
+                ]}}
+            ]
+        }
+        result = execute(request)
+        self.assertLess(abs(result["norm_drift"]), 1e-5, "Incorrect norm drift")
+        self.assertTrue("norm_drift" not in execute(dict(request, precision="double")), "Double precision drift")
+        for backend in ["mps", "stabilizer"]:
+            with self.assertRaises(ValueError):
+                execute(dict(request, backend=backend, operations=[{"op": 'H', "args": {"qbit": 1}}]))
+
+    def test_j_gate_and_oracle_flip_sign(self):
+        # J and the oracle only flip the sign of a single amplitude
+        num_qbits = 3
+        state = [1. / sqrt(2 ** num_qbits)] * 2 ** num_qbits
+        register = Register(num_qbits, self.num_measures)
+        register.unit_vector = list(state)
+        register.j_gate()
+        register.oracle(5)
+        expected = list(state)
+        expected[0] = -expected[0]
+        expected[5] = -expected[5]
+        self.assertSequenceEqualWrapper(register.unit_vector.tolist(), expected, "Incorrect J gate and oracle")
+
+    def test_compile_unitary_matches_operations(self):
+        # Compiled unitary with the Repeat raised to a power matches applying each operation in turn
+        num_qbits = 3
+        operations = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'P', "args": {"qbit": 2, "theta": 0.3}},
+            {"op": 'Repeat', "args": {"count": 5, "operations": [
+                {"op": 'O', "args": {"desired_state": 6}},
+                {"op": 'H', "args": {"qbit": 2}},
+                {"op": 'J'},
+                {"op": 'Y', "args": {"qbit": 3}}
+            ]}}
+        ]
+        state = numpy.random.RandomState(3).uniform(-1, 1, (2 ** num_qbits, 2)).view(complex)[:, 0]
+        register = Register(num_qbits, self.num_measures)
+        register.unit_vector = state
+        register.execute_operations(operations)
+        self.assertTrue(numpy.allclose(numpy.dot(compile_unitary(num_qbits, operations), state),
+                                       register.unit_vector), "Compiled unitary does not match operations")
+
+    def test_execute_compiled_uses_cache(self):
+        # Executing the same operations again reuses the cached unitary
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "compile": True,
+            "operations": [
+                {"op": 'H', "args": {"qbit": 3}},
+                {"op": 'Repeat', "args": {"count": 1001, "operations": [{"op": 'X', "args": {"qbit": 2}}]}}
+            ]
+        }
+        unitary_cache.clear()
+        execute(request)
+        request["initial_vector"] = [0, 1.0, 0, 0, 0, 0, 0, 0]
+        result = execute(request)
+        self.assertEqualWrapper(unitary_cache.hits, 1, "Cached unitary not used")
+        self.assertTrue(numpy.allclose(result["final_vector"], [0, 0, ROOT2RECIPRICOL, -ROOT2RECIPRICOL, 0, 0, 0, 0]),
+                        "Incorrect compiled final vector")
+
+    def test_execute_compiles_only_when_asked(self):
+        # Operations are compiled only when the program asks, and a negative Repeat count is refused either way
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [{"op": 'Repeat', "args": {"count": 3, "operations": [{"op": 'H', "args": {"qbit": 1}}]}}]
+        }
+        unitary_cache.clear()
+        execute(request)
+        self.assertEqualWrapper(len(unitary_cache), 0, "Operations compiled without being asked")
+        request["operations"][0]["args"]["count"] = -1
+        for compile_operations in [True, False]:
+            request["compile"] = compile_operations
+            with self.assertRaises(ValueError):
+                execute(request)
+
+    def test_execute_sweep(self):
+        # Sweeping theta of H P H moves the result from |000> to |001>
+        request = {
+            "num_qbits": 3,
+            "num_measures": self.num_measures,
+            "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+            "operations": [
+                {"op": 'H', "args": {"qbit": 3}},
+                {"op": 'P', "args": {"qbit": 3, "theta": {"start": 0.0, "stop": pi, "num": 3}}},
+                {"op": 'H', "args": {"qbit": 3}}
+            ]
+        }
+        results = execute(request)["results"]
+        self.assertEqualWrapper(len(results), 3, "Incorrect number of sweep results")
+        for result, expected in zip(results, [0.0, 0.5, 1.0]):
+            self.assertTrue(numpy.allclose(result["probabilities"], [1 - expected, expected, 0, 0, 0, 0, 0, 0]),
+                            "Incorrect sweep probabilities")
+        self.assertEqualDictionaryWrapper(results[2]["states"], {"|001>": 1.0}, "Incorrect sweep states")
+
+    def test_execute_sweep_matches_single(self):
+        # Each point of a sweep has the same final vector as executing the point on its own
+        thetas = [0.1, 0.7, 2.0]
+        desired_states = [1, 6, 3]
+
+        def request(theta, desired_state):
+            return {
+                "num_qbits": 3,
+                "num_measures": 10,
+                "initial_vector": [1.0, 0, 0, 0, 0, 0, 0, 0],
+                "compile": False,
+                "operations": [
+                    {"op": 'H', "args": {"qbit": 1}},
+                    {"op": 'H', "args": {"qbit": 2}},
+                    {"op": 'Repeat', "args": {"count": 2, "operations": [
+                        {"op": 'O', "args": {"desired_state": desired_state}},
+                        {"op": 'P', "args": {"qbit": 2, "theta": theta}},
+                        {"op": 'Z', "args": {"qbit": 2}},
+                        {"op": 'H', "args": {"qbit": 2}},
+                        {"op": 'J'}
+                    ]}}
+                ]
+            }
+
+        results = execute(request(thetas, desired_states))["results"]
+        for i in range(len(thetas)):
+            single = execute(request(thetas[i], desired_states[i]))
+            self.assertTrue(numpy.allclose(results[i]["final_vector"], single["final_vector"]),
+                            "Sweep point " + str(i) + " differs from single execute")
+
+    def test_execute_sweep_in_repeat(self):
+        # A swept gate that is the whole body of a Repeat is applied count times at every point
+        thetas = [0.1, 0.7, 2.0]
+
+        def request(theta):
+            return {
+                "num_qbits": 2,
+                "num_measures": 10,
+                "initial_vector": [0.5, 0.5, 0.5, 0.5],
+                "operations": [{"op": 'Repeat', "args": {"count": 3, "operations": [
+                    {"op": 'P', "args": {"qbit": 2, "theta": theta}}
+                ]}}]
+            }
+
+        results = execute(request(thetas))["results"]
+        for i in range(len(thetas)):
+            single = execute(request(thetas[i]))
+            self.assertTrue(numpy.allclose(results[i]["final_vector"], single["final_vector"]),
+                            "Sweep point " + str(i) + " in Repeat differs from single execute")
+
+    def test_execute_initial_vectors(self):
+        # Each initial vector gives its own result, whether or not the operations are compiled
+        initial_vectors = [[1.0, 0, 0, 0], [0, 1.0, 0, 0], [0, 0, ROOT2RECIPRICOL, ROOT2RECIPRICOL]]
+        for compile_operations in [True, False]:
+            request = {
+                "num_qbits": 2,
+                "num_measures": self.num_measures,
+                "initial_vectors": initial_vectors,
+                "compile": compile_operations,
+                "operations": [
+                    {"op": 'X', "args": {"qbit": 1}},
+                    {"op": 'H', "args": {"qbit": 2}}
+                ]
+            }
+            results = execute(request)["results"]
+            self.assertEqualWrapper(len(results), 3, "Incorrect number of results")
+            for result, initial_vector in zip(results, initial_vectors):
+                request["initial_vector"] = initial_vector
+                single = execute(dict((key, value) for key, value in request.items() if key != "initial_vectors"))
+                self.assertTrue(numpy.allclose(result["final_vector"], single["final_vector"]),
+                                "Incorrect final vector for initial vector")
+            self.assertEqualDictionaryWrapper(results[2]["states"], {"|00>": 1.0},
+                                              "Incorrect states for initial vector")
+
+    def test_execute_wrong_vector_length(self):
+        # A vector that is not one amplitude for every state is refused rather than broadcast into the state
+        encoded = encode_vector(numpy.array([1.0, 0, 0, 0], complex), "base64")
+        for backend, initial_vector in [(None, [1.0]), ("sparse", [1.0, 0]), ("mps", [1.0]), (None, encoded)]:
+            request = {"num_qbits": 3, "num_measures": 10, "backend": backend, "initial_vector": initial_vector,
+                       "operations": [{"op": 'H', "args": {"qbit": 1}}]}
+            with self.assertRaises(ValueError):
+                execute(request)
+        with self.assertRaises(ValueError):
+            execute({"num_qbits": 2, "num_measures": 10, "initial_vectors": [[1.0, 0, 0, 0], [1.0, 0]],
+                     "operations": []})
+
     def test_execute_no_op(self):
         # Test execute function correctly reads input
         request = {
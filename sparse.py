@@ -0,0 +1,116 @@
+import numpy
+
+
+def from_dense(vector):
+    """
+    :param vector: state vector as a numpy array
+    :return: (sorted numpy array of the indices of the nonzero states, numpy array of their amplitudes)
+    """
+    indices = numpy.flatnonzero(vector).astype(numpy.int64)
+    return indices, vector[indices]
+
+
+def to_dense(number_of_states, indices, values):
+    """
+    :param number_of_states: length of the state vector
+    :param indices: sorted indices of the nonzero states
+    :param values: amplitudes of the nonzero states
+    :return: state vector as a numpy array of the same dtype as values
+    """
+    vector = numpy.zeros(number_of_states, values.dtype)
+    vector[indices] = values
+    return vector
+
+
+def lookup(indices, values, wanted):
+    """
+    :param indices: sorted indices of the nonzero states
+    :param values: amplitudes of the nonzero states
+    :param wanted: numpy array of indices of states
+    :return: numpy array of the amplitudes of the wanted states, zero for states that are not held
+    """
+    if not len(indices):
+        return numpy.zeros(len(wanted), values.dtype)
+    positions = numpy.minimum(numpy.searchsorted(indices, wanted), len(indices) - 1)
+    return numpy.where(indices[positions] == wanted, values[positions], 0)
+
+
+def prune(indices, values):
+    """
+    :return: (indices, values) without the states whose amplitude has become zero
+    """
+    keep = values != 0
+    if keep.all():
+        return indices, values
+    return indices[keep], values[keep]
+
+
+def transform_qbit(indices, values, mask, T):
+    """
+    Apply 2x2 matrix T to the qbit selected by mask.
+    A diagonal gate only scales the amplitudes and an anti-diagonal gate only flips the qbit of each index,
+    otherwise every pair of states differing in the qbit where either is nonzero is transformed.
+    :param indices: sorted indices of the nonzero states
+    :param values: amplitudes of the nonzero states
+    :param mask: integer with only the bit of the qbit set
+    :param T: 2x2 matrix of gate operation
+    :return: (sorted indices, values) of the new state
+    """
+    T = numpy.asarray(T, values.dtype)
+    bits = (indices & mask) != 0
+    if T[0, 1] == 0 and T[1, 0] == 0:
+        return prune(indices, values * numpy.where(bits, T[1, 1], T[0, 0]))
+    if T[0, 0] == 0 and T[1, 1] == 0:
+        # The amplitude moving to where the qbit is 1 came from where it was 0
+        flipped = indices ^ mask
+        order = numpy.argsort(flipped, kind='mergesort')
+        return flipped[order], (values * numpy.where(bits, T[0, 1], T[1, 0]))[order]
+    zero = numpy.unique(indices & ~mask)
+    one = zero | mask
+    zero_values = lookup(indices, values, zero)
+    one_values = lookup(indices, values, one)
+    new_indices = numpy.concatenate([zero, one])
+    new_values = numpy.concatenate([T[0, 0] * zero_values + T[0, 1] * one_values,
+                                    T[1, 0] * zero_values + T[1, 1] * one_values])
+    order = numpy.argsort(new_indices, kind='mergesort')
+    return prune(new_indices[order], new_values[order])
+
+
+def controlled_transform(indices, values, control_mask, mask, T):
+    """
+    Apply 2x2 matrix T to the qbit selected by mask, only for the states where the control qbit is 1
+    :param indices: sorted indices of the nonzero states
+    :param values: amplitudes of the nonzero states
+    :param control_mask: integer with only the bit of the control qbit set
+    :param mask: integer with only the bit of the target qbit set
+    :param T: 2x2 matrix of gate operation
+    :return: (sorted indices, values) of the new state
+    """
+    controlled = (indices & control_mask) != 0
+    changed_indices, changed_values = transform_qbit(indices[controlled], values[controlled], mask, T)
+    new_indices = numpy.concatenate([indices[~controlled], changed_indices])
+    new_values = numpy.concatenate([values[~controlled], changed_values])
+    order = numpy.argsort(new_indices, kind='mergesort')
+    return new_indices[order], new_values[order]
+
+
+def diagonal_factors(indices, num_qbits, factors=(), flips=(), controlled=()):
+    """
+    Find the diagonal of an operation at the nonzero states only
+    :param indices: sorted indices of the nonzero states
+    :param num_qbits: number of qbits in the state
+    :param factors: list of [qbit, [factor when qbit is 0, factor when qbit is 1]]
+    :param flips: list of [state, factor to multiply the state by]
+    :param controlled: list of [control, target, [factor when target is 0, factor when target is 1]]
+        applied only where the control qbit is 1
+    :return: numpy array of the diagonal at each index
+    """
+    diagonal = numpy.ones(len(indices), complex)
+    for qbit, factor in factors:
+        diagonal *= numpy.where(indices & (1 << (num_qbits - qbit)), factor[1], factor[0])
+    for control, target, factor in controlled:
+        target_factor = numpy.where(indices & (1 << (num_qbits - target)), factor[1], factor[0])
+        diagonal *= numpy.where(indices & (1 << (num_qbits - control)), target_factor, 1)
+    for state, factor in flips:
+        diagonal[indices == state] *= factor
+    return diagonal
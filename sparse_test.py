@@ -0,0 +1,46 @@
+from unittest import main
+
+import numpy
+
+from gates import H
+from gates import X
+from gates import Y
+from gates import phase_matrix
+from mock_extension import MockExtension
+from register import apply_controlled_gate
+from register import apply_gate
+from sparse import controlled_transform
+from sparse import from_dense
+from sparse import to_dense
+from sparse import transform_qbit
+
+
+class TestSparse(MockExtension):
+
+    def setUp(self):
+        # State with a few nonzero amplitudes
+        self.num_qbits = 4
+        self.state = numpy.zeros(2 ** self.num_qbits, complex)
+        self.state[[1, 6, 11]] = [0.6, 0.64j, -0.48]
+
+    def test_transform_qbit_matches_dense(self):
+        # Diagonal, anti-diagonal and general gates on the nonzero states match gates on the dense state
+        for T in [phase_matrix(0.3), X, Y, H]:
+            for qbit in range(1, self.num_qbits + 1):
+                indices, values = transform_qbit(*from_dense(self.state), 1 << (self.num_qbits - qbit), T)
+                expected = apply_gate(self.state.copy(), self.num_qbits, qbit, T)
+                self.assertTrue(numpy.all(numpy.diff(indices) > 0), "Indices not sorted")
+                self.assertTrue(numpy.allclose(to_dense(len(self.state), indices, values), expected),
+                                "Sparse gate differs on qbit " + str(qbit))
+
+    def test_controlled_transform_matches_dense(self):
+        # Only the states where the control qbit is 1 are changed
+        indices, values = controlled_transform(*from_dense(self.state), 1 << 2, 1 << 0, H)
+        expected = self.state.copy()
+        apply_controlled_gate(expected, self.num_qbits, 2, 4, H)
+        self.assertTrue(numpy.allclose(to_dense(len(self.state), indices, values), expected),
+                        "Sparse controlled gate differs")
+
+
+if __name__ == '__main__':
+    main()
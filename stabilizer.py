@@ -0,0 +1,475 @@
+import numpy
+
+from circuit import is_swept
+from exact import check_exact_size
+
+CLIFFORD_TOLERANCE = 1e-9  # largest difference of an angle from a Clifford angle
+STABILIZER_OPS = {"H", "P", "X", "Y", "Z", "CNOT", "CZ", "CP", "Repeat"}
+
+
+def quarter_turns(theta, turn):
+    """
+    :param theta: angle in radians
+    :param turn: angle of one turn in radians
+    :return: number of turns in theta modulo 4, or None if theta is not a whole number of turns
+    """
+    turns = theta / turn
+    if abs(turns - round(turns)) > CLIFFORD_TOLERANCE:
+        return None
+    return int(round(turns)) % 4
+
+
+def is_clifford(operations):
+    """
+    :param operations: list of operations in the same format as Register.execute_operations
+    :return: True if every operation, including those in the bodies of Repeat operations, is a Clifford gate:
+        H, X, Y, Z, P with theta a multiple of pi/2, CNOT, CZ or CP with theta a multiple of pi
+    """
+    for operation in operations:
+        name = operation['op']
+        if name not in STABILIZER_OPS or is_swept(operation):
+            return False
+        args = operation['args'] if 'args' in operation else {}
+        if name == 'P' and quarter_turns(args['theta'], numpy.pi / 2) is None:
+            return False
+        if name == 'CP' and quarter_turns(args['theta'], numpy.pi) is None:
+            return False
+        if name == 'Repeat' and not is_clifford(args['operations']):
+            return False
+    return True
+
+
+def basis_state(vector):
+    """
+    :param vector: state vector
+    :return: index of the basis state if vector is a single basis state up to a phase, otherwise None
+    """
+    vector = numpy.asarray(vector)
+    nonzero = numpy.flatnonzero(vector)
+    if len(nonzero) != 1 or abs(abs(vector[nonzero[0]]) - 1) > CLIFFORD_TOLERANCE:
+        return None
+    return int(nonzero[0])
+
+
+def phase_exponents(x1, z1, x2, z2):
+    """
+    Power of i in the product of the Pauli matrices given by bits x1, z1 and x2, z2 of each qbit
+    :return: numpy array of the exponents, each -1, 0 or 1
+    """
+    return numpy.where(x1 & z1, z2 - x2,
+                       numpy.where(x1 == 1, z2 * (2 * x2 - 1), numpy.where(z1 == 1, x2 * (1 - 2 * z2), 0)))
+
+
+def eliminate(matrix, vector):
+    """
+    Gauss-Jordan elimination modulo 2 so that each pivot column is set in one row only
+    :param matrix: numpy array of bits
+    :param vector: numpy array of bits, one for each row of matrix, changed by the same row operations
+    :return: (eliminated copy of matrix, eliminated copy of vector, list of the pivot columns, one for each
+        of the first rows, the rest of the rows being 0)
+    """
+    matrix, vector = matrix.copy(), vector.copy()
+    pivots = []
+    for column in range(matrix.shape[1]):
+        row = len(pivots)
+        candidates = row + numpy.flatnonzero(matrix[row:, column])
+        if not len(candidates):
+            continue
+        pivot = candidates[0]
+        matrix[[row, pivot]] = matrix[[pivot, row]]
+        vector[[row, pivot]] = vector[[pivot, row]]
+        others = numpy.flatnonzero(matrix[:, column])
+        others = others[others != row]
+        matrix[others] ^= matrix[row]
+        vector[others] ^= vector[row]
+        pivots.append(column)
+        if len(pivots) == matrix.shape[0]:
+            break
+    return matrix, vector, pivots
+
+
+def solve_bits(matrix, vector):
+    """
+    Solve matrix . solution = vector modulo 2
+    :param matrix: numpy array of bits
+    :param vector: numpy array of bits, one for each row of matrix
+    :return: numpy array of a solution, one bit for each column of matrix, or None if there is none
+    """
+    matrix, vector, pivots = eliminate(matrix, vector)
+    if vector[len(pivots):].any():
+        return None
+    solution = numpy.zeros(matrix.shape[1], matrix.dtype)
+    solution[pivots] = vector[:len(pivots)]
+    return solution
+
+
+def count_rows(samples):
+    """
+    :param samples: numpy array with the value of each qbit of each measurement, one row for each measurement
+    :return: (numpy array of each different measurement, numpy array of the number of times it was measured)
+    """
+    # Pack the bits of each measurement into bytes so they are compared as single values
+    packed = numpy.packbits(samples.astype(numpy.uint8), axis=1)
+    states, counts = numpy.unique(packed.view(numpy.dtype((numpy.void, packed.shape[1]))), return_counts=True)
+    states = numpy.unpackbits(states.view(numpy.uint8).reshape(len(states), -1), axis=1)[:, :samples.shape[1]]
+    return states, counts
+
+
+class StabilizerRegister(object):
+    """
+    Register of a stabilizer state held as the tableau of the Pauli operators that stabilize it,
+    so Clifford gates take time proportional to the number of qbits rather than 2^n.
+    Row i of the tableau is the Pauli operator (-1)^r[i] prod_j X_j^x[i, j] Z_j^z[i, j],
+    where column j is qbit j + 1.
+    """
+    batch_size = None
+    profiler = None  # Profiler recording the operations applied by execute_operations
+    in_memory = False  # the state vector is never built so cannot be returned
+    holds_amplitudes = False  # the tableau is not amplitudes so the profiler does not estimate its work
+
+    def __init__(self, num_qbits, num_measures, seed=None):
+        """
+        :param num_qbits: number of qbits in the register
+        :param num_measures: number of measurements taken by counting_states
+        :param seed: seed for the random measurements, so that measurements can be repeated
+        """
+        self.num_qbits = num_qbits
+        self.number_of_states = 2 ** self.num_qbits
+        self.numMeasures = num_measures
+        self.random = numpy.random.RandomState(seed)
+        self.initial_norm = None
+        # The state |0...0> is stabilized by Z on each qbit
+        self.x = numpy.zeros((num_qbits, num_qbits), numpy.int8)
+        self.z = numpy.identity(num_qbits, numpy.int8)
+        self.r = numpy.zeros(num_qbits, numpy.int8)
+
+    @property
+    def unit_vector(self):
+        raise ValueError("Stabilizer register of {} qbits has no state vector".format(self.num_qbits))
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.z.nbytes + self.r.nbytes
+
+    def set_basis_state(self, state):
+        """
+        Set the register to a basis state
+        :param state: index of state, qbit 1 is the most significant bit
+        :return:
+        """
+        self.x[...] = 0
+        self.z[...] = numpy.identity(self.num_qbits, numpy.int8)
+        self.r[:] = [(state >> (self.num_qbits - qbit)) & 1 for qbit in range(1, self.num_qbits + 1)]
+
+    def set_uniform_state(self):
+        """
+        Set the register to the equal superposition of every state, Hadamard gates applied to |0...0>
+        :return:
+        """
+        self.set_basis_state(0)
+        for qbit in range(1, self.num_qbits + 1):
+            self.hadamard_gate(qbit)
+
+    def set_ghz_state(self):
+        """
+        Set the register to the GHZ state (|0...0> + |1...1>) / sqrt(2)
+        :return:
+        """
+        self.set_basis_state(0)
+        self.hadamard_gate(1)
+        for qbit in range(2, self.num_qbits + 1):
+            self.controlled_not_gate(1, qbit)
+
+    def norm(self):
+        return 1.
+
+    def state_label(self, bits):
+        """
+        :param bits: value of each qbit of the state, qbit 1 first
+        :return: ket label of state, for example |011>
+        """
+        return "|" + "".join(str(bit) for bit in bits) + ">"
+
+    def rowsum(self, rows, pivot):
+        """
+        Multiply the operators of rows by the operator of the pivot row
+        :param rows: numpy array of the rows to change
+        :param pivot: row to multiply by
+        :return:
+        """
+        # Only the qbits where the pivot operator is not the identity change the phase
+        columns = numpy.flatnonzero(self.x[pivot] | self.z[pivot])
+        x1, z1 = self.x[pivot, columns], self.z[pivot, columns]
+        x2, z2 = self.x[numpy.ix_(rows, columns)], self.z[numpy.ix_(rows, columns)]
+        exponents = phase_exponents(x1, z1, x2, z2).sum(axis=1, dtype=int)
+        self.r[rows] = ((2 * self.r[rows] + 2 * self.r[pivot] + exponents) % 4) // 2
+        self.x[rows] ^= self.x[pivot]
+        self.z[rows] ^= self.z[pivot]
+
+    def reduce(self, bits, first_row):
+        """
+        Gaussian elimination of the rows from first_row so that each pivot column of bits is set in one row only
+        :param bits: x or z part of the tableau
+        :param first_row: first row to eliminate
+        :return: next row after the pivot rows
+        """
+        row = first_row
+        for column in range(self.num_qbits):
+            candidates = row + numpy.flatnonzero(bits[row:, column])
+            if not len(candidates):
+                continue
+            pivot = candidates[0]
+            for part in (self.x, self.z, self.r):
+                part[[row, pivot]] = part[[pivot, row]]
+            others = numpy.flatnonzero(bits[:, column])
+            others = others[(others != row) & (others >= first_row)]
+            if len(others):
+                self.rowsum(others, row)
+            row += 1
+            if row == self.num_qbits:
+                break
+        return row
+
+    def affine_subspace(self):
+        """
+        The measurements of a stabilizer state are uniform over an affine subspace,
+        spanned by the x parts of the operators that have one and offset by a solution of the signs of the rest.
+        :return: numpy array of the vectors spanning the subspace, one row for each,
+            and numpy array of the value of each qbit of the offset
+        """
+        rank = self.reduce(self.x, 0)
+        self.reduce(self.z, rank)
+        offset = numpy.zeros(self.num_qbits, numpy.int8)
+        for row in range(rank, self.num_qbits):
+            columns = numpy.flatnonzero(self.z[row])
+            if len(columns):
+                # Each remaining operator is a product of Z whose first qbit only appears in that operator
+                offset[columns[0]] = self.r[row]
+        return self.x[:rank].copy(), offset
+
+    def marginal_subspace(self, qbits):
+        """
+        The values of some of the qbits are uniform over the projection of the affine subspace onto them
+        :param qbits: list of the qbits to measure
+        :return: numpy array of independent vectors spanning the projected subspace, one row for each,
+            and numpy array of the value of each of qbits of the offset
+        """
+        spanning, offset = self.affine_subspace()
+        columns = numpy.asarray(qbits) - 1
+        spanning, ignored, pivots = eliminate(spanning[:, columns], numpy.zeros(len(spanning), numpy.int8))
+        return spanning[:len(pivots)], offset[columns]
+
+    @staticmethod
+    def subspace_states(spanning, offset, choices):
+        """
+        :param spanning: numpy array of the vectors spanning the affine subspace, one row for each
+        :param offset: offset of the affine subspace
+        :param choices: numpy array of which spanning vectors to add to the offset, one row for each state
+        :return: numpy array with the value of each qbit of each state, one row for each state
+        """
+        # Sums of whole numbers are exact in floating point so the matrix product can use BLAS
+        return (numpy.dot(choices.astype(numpy.float32), spanning.astype(numpy.float32)).astype(int) + offset) % 2
+
+    def sample(self, num_samples, probabilities=None):
+        """
+        Draw all measurements at once, uniformly from the affine subspace of the state
+        :param num_samples: number of measurements to take
+        :param probabilities: ignored
+        :return: numpy array with the value of each qbit of each measurement, one row for each measurement
+        """
+        spanning, offset = self.affine_subspace()
+        return self.subspace_states(spanning, offset, self.random.randint(0, 2, (num_samples, len(spanning))))
+
+    def measure(self):
+        return self.state_label(self.sample(1)[0])
+
+    def count_samples(self, probabilities, qbits=None):
+        """
+        :param probabilities: ignored
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the fraction of measurements that found each state, or each value of qbits
+        """
+        if self.numMeasures <= 0:
+            return {}
+        if qbits is None:
+            samples = self.sample(self.numMeasures)
+        else:
+            spanning, offset = self.marginal_subspace(qbits)
+            samples = self.subspace_states(spanning, offset,
+                                           self.random.randint(0, 2, (self.numMeasures, len(spanning))))
+        states, counts = count_rows(samples)
+        return {self.state_label(state): float(count) / self.numMeasures for state, count in zip(states, counts)}
+
+    def counting_states(self, qbits=None):
+        """
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the fraction of measurements that found each state, or each value of qbits
+        """
+        return self.count_samples(None, qbits)
+
+    def exact_states(self, top_k=None, min_probability=0., qbits=None):
+        """
+        Every state of the affine subspace has the same probability so the first top_k of them are returned
+        :param top_k: largest number of states to return
+        :param min_probability: smallest probability of a state to return
+        :param qbits: list of the qbits to measure, by default every qbit
+        :return: dictionary of the probability of each of the most likely states, or values of qbits
+        """
+        spanning, offset = self.affine_subspace() if qbits is None else self.marginal_subspace(qbits)
+        rank = len(spanning)
+        probability = 2. ** -rank
+        if probability < min_probability:
+            return {}
+        num_states = 2 ** rank if top_k is None else min(2 ** rank, top_k)
+        check_exact_size(num_states)
+        # Only the last spanning vectors are needed to count to num_states
+        bits = min(rank, max(num_states - 1, 0).bit_length())
+        choices = numpy.zeros((num_states, rank), numpy.int8)
+        if bits:
+            choices[:, rank - bits:] = (numpy.arange(num_states)[:, None] >> numpy.arange(bits - 1, -1, -1)) & 1
+        return {self.state_label(state): probability for state in self.subspace_states(spanning, offset, choices)}
+
+    def expectation(self, pauli):
+        """
+        A Pauli string that does not commute with every stabilizer has expectation 0, otherwise it is a product
+        of the stabilizers up to a sign, which is its expectation
+        :param pauli: Pauli string with one of I, X, Y or Z for every qbit, qbit 1 first
+        :return: expectation value of the Pauli string, -1, 0 or 1
+        """
+        x = numpy.array([character in "XY" for character in pauli], numpy.int8)
+        z = numpy.array([character in "ZY" for character in pauli], numpy.int8)
+        if ((numpy.dot(self.x, z.astype(int)) + numpy.dot(self.z, x.astype(int))) % 2).any():
+            return 0.
+        rows = numpy.flatnonzero(solve_bits(numpy.concatenate([self.x, self.z], axis=1).T, numpy.concatenate([x, z])))
+        # Multiply the stabilizers together tracking the power of i
+        exponent = 0
+        product_x, product_z = numpy.zeros_like(x), numpy.zeros_like(z)
+        for row in rows:
+            exponent += 2 * self.r[row] + phase_exponents(self.x[row], self.z[row], product_x, product_z).sum(dtype=int)
+            product_x ^= self.x[row]
+            product_z ^= self.z[row]
+        # The product is i^exponent P and stabilizes the state so <P> = i^-exponent, which is real
+        return 1. if exponent % 4 == 0 else -1.
+
+    def hadamard_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        column = qbit - 1
+        self.r ^= self.x[:, column] & self.z[:, column]
+        self.x[:, column], self.z[:, column] = self.z[:, column].copy(), self.x[:, column].copy()
+
+    def s_gate(self, qbit):
+        """
+        Apply phase shift of pi/2
+        :param qbit:start AT 1
+        :return:
+        """
+        column = qbit - 1
+        self.r ^= self.x[:, column] & self.z[:, column]
+        self.z[:, column] ^= self.x[:, column]
+
+    def phase_gate(self, qbit, theta):
+        """
+        :param qbit:start AT 1
+        :param theta: multiple of pi/2 in radians
+        :return:
+        """
+        turns = quarter_turns(theta, numpy.pi / 2)
+        if turns is None:
+            raise ValueError("Phase shift {} is not a multiple of pi/2".format(theta))
+        if turns % 2:
+            self.s_gate(qbit)
+        if turns >= 2:
+            self.pauli_z_gate(qbit)
+
+    def pauli_x_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.r ^= self.z[:, qbit - 1]
+
+    def pauli_y_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.r ^= self.x[:, qbit - 1] ^ self.z[:, qbit - 1]
+
+    def pauli_z_gate(self, qbit):
+        """
+        :param qbit:start AT 1
+        :return:
+        """
+        self.r ^= self.x[:, qbit - 1]
+
+    def controlled_not_gate(self, control, target):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :return:
+        """
+        if control == target:
+            raise ValueError("Control and target are both qbit {}".format(control))
+        a, b = control - 1, target - 1
+        self.r ^= self.x[:, a] & self.z[:, b] & (self.x[:, b] ^ self.z[:, a] ^ 1)
+        self.x[:, b] ^= self.x[:, a]
+        self.z[:, a] ^= self.z[:, b]
+
+    def controlled_z_gate(self, control, target):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :return:
+        """
+        self.hadamard_gate(target)
+        self.controlled_not_gate(control, target)
+        self.hadamard_gate(target)
+
+    def controlled_phase_gate(self, control, target, theta):
+        """
+        :param control: control qbit, start AT 1
+        :param target: target qbit, start AT 1
+        :param theta: multiple of pi in radians
+        :return:
+        """
+        turns = quarter_turns(theta, numpy.pi)
+        if turns is None:
+            raise ValueError("Controlled phase shift {} is not a multiple of pi".format(theta))
+        if turns % 2:
+            self.controlled_z_gate(control, target)
+
+    def repeat(self, count, operations):
+        for i in range(count):
+            self.execute_operations(operations)
+
+    def execute_operations(self, operations):
+        """
+        Perform list of Clifford operations on register
+        :param operations: list of operations in the same format as Register.execute_operations
+        :return:
+        """
+        if self.profiler is not None:
+            self.profiler.execute_operations(self, operations)
+            return
+        for operation in operations:
+            op = self.op_table[operation['op']]
+            if 'args' in operation:
+                args = operation['args']
+            else:
+                args = {}
+            op(self, **args)
+
+    op_table = {
+        'H': hadamard_gate,
+        'P': phase_gate,
+        'X': pauli_x_gate,
+        'Y': pauli_y_gate,
+        'Z': pauli_z_gate,
+        'CNOT': controlled_not_gate,
+        'CZ': controlled_z_gate,
+        'CP': controlled_phase_gate,
+        'Repeat': repeat
+    }
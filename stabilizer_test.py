@@ -0,0 +1,72 @@
+from math import pi
+from unittest import main
+
+import numpy
+
+from mock_extension import MockExtension
+from register import execute
+from stabilizer import StabilizerRegister
+from stabilizer import is_clifford
+
+
+class TestStabilizer(MockExtension):
+
+    def test_is_clifford(self):
+        # Phase shifts must be multiples of pi/2, and controlled phase shifts multiples of pi
+        clifford = [
+            {"op": 'H', "args": {"qbit": 1}},
+            {"op": 'P', "args": {"qbit": 2, "theta": -pi / 2}},
+            {"op": 'Repeat', "args": {"count": 2, "operations": [
+                {"op": 'CP', "args": {"control": 1, "target": 2, "theta": pi}}
+            ]}}
+        ]
+        self.assertTrue(is_clifford(clifford), "Clifford program not detected")
+        for operation in [{"op": 'P', "args": {"qbit": 2, "theta": pi / 4}},
+                          {"op": 'CP', "args": {"control": 1, "target": 2, "theta": pi / 2}},
+                          {"op": 'Repeat', "args": {"count": 2, "operations": [{"op": 'J'}]}},
+                          {"op": 'P', "args": {"qbit": 2, "theta": numpy.array([0, pi])}}]:
+            self.assertFalse(is_clifford(clifford + [operation]), "Non Clifford operation " + operation['op'])
+
+    def test_matches_state_vector(self):
+        # Random Clifford programs measure the same states with the same probabilities as a state vector
+        random = numpy.random.RandomState(5)
+        num_qbits = 4
+        for trial in range(10):
+            operations = []
+            for i in range(20):
+                name = random.choice(["H", "X", "Y", "Z", "P", "CNOT", "CZ", "CP"])
+                control, target = (int(qbit) for qbit in random.choice(range(1, num_qbits + 1), 2, replace=False))
+                if name in ("CNOT", "CZ", "CP"):
+                    args = {"control": control, "target": target}
+                else:
+                    args = {"qbit": target}
+                if name == "P":
+                    args["theta"] = pi / 2 * random.randint(-5, 6)
+                elif name == "CP":
+                    args["theta"] = pi * random.randint(-3, 4)
+                operations.append({"op": name, "args": args})
+            initial_vector = [0.0] * 2 ** num_qbits
+            initial_vector[random.randint(2 ** num_qbits)] = 1.0
+            request = {"num_qbits": num_qbits, "num_measures": self.num_measures, "seed": trial,
+                       "initial_vector": initial_vector, "operations": operations}
+            final_vector = numpy.array(execute(dict(request, backend="dense"))["final_vector"])
+            expected = {"|" + format(state, "04b") + ">": float(probability)
+                        for state, probability in enumerate(abs(final_vector) ** 2) if probability > 1e-9}
+            self.assertReasonablyEqualDictionaryWrapper(execute(dict(request, backend="stabilizer"))["states"],
+                                                        expected, self.state_accuracy_percent,
+                                                        "Incorrect stabilizer states")
+
+    def test_large_ghz_state(self):
+        # A GHZ state of hundreds of qbits measures all 0 or all 1
+        num_qbits = 300
+        register = StabilizerRegister(num_qbits, self.num_measures, seed=1)
+        register.hadamard_gate(1)
+        for qbit in range(2, num_qbits + 1):
+            register.controlled_not_gate(1, qbit)
+        test_states = {"|" + "0" * num_qbits + ">": 0.5, "|" + "1" * num_qbits + ">": 0.5}
+        self.assertReasonablyEqualDictionaryWrapper(register.counting_states(), test_states,
+                                                    self.state_accuracy_percent, "Incorrect GHZ state")
+
+
+if __name__ == '__main__':
+    main()